@@ -0,0 +1,69 @@
+# Micro-benchmark of the trip cleaning step in create_summary_data.py
+# Compares the original cleaning code (three datetime parses per derived column,
+# speed computed four times, two percentile calls) with trip_summary.clean_trips,
+# on random trips with raw string timestamps, and prints rows / second for each
+# Run from the top directory: python benchmarks/bench_clean.py [rows ...]
+import os, sys, time, numpy as np, pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from trip_summary import clean_col_names, clean_trips
+
+num_dec = 3
+
+
+# Cleaning as originally done in create_summary_data.py
+def legacy_clean(tmp):
+    tmp.columns = clean_col_names(tmp.columns.values.tolist())
+    tmp['rounded_lon'] = tmp.pickup_longitude.round(num_dec)
+    tmp['rounded_lat'] = tmp.pickup_latitude.round(num_dec)
+    tmp['trip_time_in_secs'] = (pd.to_datetime(tmp.dropoff_time, format='%Y-%m-%d %H:%M:%S') -
+                                pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S')).dt.seconds
+    tmp['day'] = pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S').dt.dayofweek
+    tmp['hour'] = pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S').dt.hour
+    tmp['date'] = pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S').dt.date
+    tmp = tmp[(tmp.passenger_count < 20) & (tmp.rounded_lon < -73) & (tmp.rounded_lat < 41) &
+              (0 < tmp.passenger_count)  & (-75 < tmp.rounded_lon) & (40 < tmp.rounded_lat) &
+              (0 < tmp.trip_time_in_secs) & (tmp.trip_time_in_secs < 7200) & (0 < tmp.fare_amount) &
+              (tmp.fare_amount < 200) & (0 < tmp.total_amount) & (tmp.total_amount < 200) &
+              (0 <= tmp.tip_amount) & (tmp.tip_amount < 200) & (0 < tmp.trip_distance) &
+              (tmp.trip_distance < 50)]
+    tmp = tmp[((tmp.trip_distance / tmp.trip_time_in_secs) < np.percentile((tmp.trip_distance / tmp.trip_time_in_secs), 99)) &
+              ((tmp.trip_distance / tmp.trip_time_in_secs) > np.percentile((tmp.trip_distance / tmp.trip_time_in_secs), 1))]
+    return tmp
+
+
+def random_trips(n, seed=0):
+    rng = np.random.RandomState(seed)
+    pickup = pd.Timestamp('2015-05-01') + pd.to_timedelta(rng.randint(0, 31 * 86400, n), unit='s')
+    dropoff = pickup + pd.to_timedelta(rng.randint(-60, 4000, n), unit='s')
+    distance = np.round(rng.exponential(3, n), 2)
+    fare = np.round(2.5 + 2.5 * distance + rng.normal(0, 1, n), 2)
+    tip = np.round(rng.exponential(1, n), 2)
+    return pd.DataFrame({'tpep_pickup_datetime': pickup.strftime('%Y-%m-%d %H:%M:%S'),
+                         'tpep_dropoff_datetime': dropoff.strftime('%Y-%m-%d %H:%M:%S'),
+                         'passenger_count': rng.randint(0, 7, n), 'trip_distance': distance,
+                         'pickup_longitude': rng.normal(-73.97, 0.05, n), 'pickup_latitude': rng.normal(40.75, 0.05, n),
+                         'fare_amount': fare, 'tip_amount': tip, 'total_amount': fare + tip + 0.5,
+                         'dropoff_longitude': rng.normal(-73.97, 0.05, n), 'dropoff_latitude': rng.normal(40.75, 0.05, n)})
+
+
+def best_time(f, frame, repeat=3):
+    times = []
+    for i in range(repeat):
+        tmp = frame.copy()
+        start = time.time()
+        f(tmp)
+        times.append(time.time() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:]] or [100000, 1000000]
+    print('%10s %16s %16s %8s' % ('rows', 'legacy rows/s', 'clean rows/s', 'speedup'))
+    for n in sizes:
+        frame = random_trips(n)
+        old = legacy_clean(frame.copy())
+        new = clean_trips(frame.copy(), num_dec)
+        assert old.shape[0] == new.shape[0]
+        t_old = best_time(legacy_clean, frame)
+        t_new = best_time(lambda x: clean_trips(x, num_dec), frame)
+        print('%10d %16.0f %16.0f %7.1fx' % (n, n / t_old, n / t_new, t_old / t_new))
@@ -0,0 +1,124 @@
+# End to end benchmarks of the pipeline on synthetic trip files (see synth_trips.py)
+# For each size (trips per monthly file) times each stage and records its peak memory:
+# geocode_raster: rasterizing the neighborhoods (find_pickup_dropoff_nbhds.py, use_raster)
+# geocode_points: looking up the unique rounded pickup coords (find_pickup_dropoff_nbhds.py)
+# summarize: building the summaries from the trip files (create_summary_data.py)
+# load: reading the saved summaries back (nyc_taxi_analysis.py)
+# model: fitting the random forest on the pickups by date / hour / nbhd (needs scikit-learn)
+# Peak memory is what tracemalloc sees allocated by Python / numpy during the stage
+# (peak process RSS only ever grows, so it's printed once at the end). Tracing
+# slows down the Python heavy stages (up to ~2x), so set trace_memory = False
+# when comparing timings
+# Run from the top directory: python benchmarks/run_benchmarks.py [rows_per_file ...]
+import os, sys, time, json, glob, shutil, tempfile, tracemalloc, numpy as np, pandas as pd
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nbhd_lookup import NbhdLookup, NbhdRaster
+from trip_summary import clean_col_names, summarize_files, read_trips
+from synth_trips import write_months
+
+num_dec = 3
+chunk_size = 1000000
+n_workers = 1
+# Set to a file name to append the results to (one JSON object per line)
+out_file = None
+trace_memory = True
+
+
+# Runs f(*args), returns its result and the wall time / peak traced memory
+def measure(f, *args):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.time()
+    result = f(*args)
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_mb': peak / 2.0 ** 20 if trace_memory else None}
+
+
+def geocode_points(nbhd_lookup, files):
+    coords = []
+    for x in files:
+        for tmp in read_trips(x, chunk_size):
+            tmp.columns = clean_col_names(tmp.columns.values.tolist())
+            tmp = tmp[['pickup_longitude', 'pickup_latitude']]
+            coords.append(tmp.round(num_dec).drop_duplicates().values)
+    coords = np.unique(np.concatenate(coords), axis=0)
+    return nbhd_lookup.lookup(coords[:, 0], coords[:, 1])
+
+
+def save_summaries(summaries, out_dir):
+    for name, frame in summaries.items():
+        frame.to_csv(os.path.join(out_dir, name + '.gz'), compression='gzip')
+
+
+def load_summaries(out_dir):
+    return dict((os.path.basename(x)[:-3], pd.read_csv(x)) for x in glob.glob(os.path.join(out_dir, '*.gz')))
+
+
+# Random forest on pickups by nbhd / date / hour (as in nyc_taxi_analysis.py, without the search)
+def fit_model(pickups_hdl):
+    from sklearn.ensemble import RandomForestRegressor
+    X = pickups_hdl[['nbhd', 'hour']].astype(str)
+    X['day_of_week'] = pd.to_datetime(pickups_hdl.date).dt.dayofweek.astype(str)
+    X = pd.get_dummies(X)
+    rf = RandomForestRegressor(n_estimators=20, n_jobs=-1, random_state=0)
+    return rf.fit(X, pickups_hdl.passenger_count)
+
+
+def run(rows_per_file, work_dir):
+    data_dir = os.path.join(work_dir, 'trips_%d' % rows_per_file)
+    files = write_months(data_dir, rows_per_file)
+    n_rows = rows_per_file * len(files)
+    nbhd_lookup = NbhdLookup.from_geojson('nyc_neighborhoods.json')
+    results = []
+
+    def record(stage, stats, rows):
+        stats.update({'stage': stage, 'rows_per_file': rows_per_file, 'files': len(files), 'rows': rows,
+                      'rows_per_sec': rows / stats['seconds'] if stats['seconds'] > 0 else None})
+        results.append(stats)
+        print('%10d %-16s %10.2f %12s %14s' % (rows_per_file, stage, stats['seconds'],
+                                               '%.1f' % stats['peak_mb'] if trace_memory else '-',
+                                               '%.0f' % stats['rows_per_sec'] if stats['rows_per_sec'] else '-'))
+
+    nbhd_raster, stats = measure(NbhdRaster.from_lookup, nbhd_lookup, num_dec)
+    record('geocode_raster', stats, nbhd_raster.grid.size)
+    tmp, stats = measure(geocode_points, nbhd_lookup, files)
+    record('geocode_points', stats, n_rows)
+    (summaries, total_records), stats = measure(summarize_files, files, num_dec, nbhd_raster, chunk_size, n_workers)
+    record('summarize', stats, n_rows)
+    save_summaries(summaries, data_dir)
+    summaries, stats = measure(load_summaries, data_dir)
+    record('load', stats, sum(x.shape[0] for x in summaries.values()))
+    try:
+        import sklearn
+    except ImportError:
+        print('%10d %-16s %10s' % (rows_per_file, 'model', 'skipped (no scikit-learn)'))
+    else:
+        tmp, stats = measure(fit_model, summaries['pickups_hdl'])
+        record('model', stats, summaries['pickups_hdl'].shape[0])
+    return results
+
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:]] or [10000, 100000, 1000000]
+    work_dir = tempfile.mkdtemp(prefix='taxi_bench_')
+    print('%10s %-16s %10s %12s %14s' % ('rows/file', 'stage', 'seconds', 'peak MB', 'rows/s'))
+    try:
+        for n in sizes:
+            results = run(n, work_dir)
+            if out_file:
+                with open(out_file, 'a') as f:
+                    for x in results:
+                        f.write(json.dumps(x) + '\n')
+    finally:
+        shutil.rmtree(work_dir)
+    if resource is not None:
+        # ru_maxrss is in KB on Linux, bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print('peak RSS: %.0f MB' % (max_rss / (2.0 ** 20 if sys.platform == 'darwin' else 2.0 ** 10)))
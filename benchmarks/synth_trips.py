@@ -0,0 +1,125 @@
+# Synthetic TLC-like trip files, for benchmarking without downloading the real data
+# Writes gzip CSV files named like data_download.py does (yellow_05_2015.gz), using
+# the header variants of the real files (2009 Trip_Pickup_DateTime / Start_Lon / *_Amt,
+# 2010 - 2014 pickup_datetime with leading spaces, 2015+ tpep_ / lpep_ names, and the
+# green files' extra delimiters at the end of each line)
+# Pickup and dropoff coords are sampled inside the nyc_neighborhoods.json polygons,
+# with a small share of bad records (zero coords, negative fares, ...) for the cleaning
+# Run from the top directory: python benchmarks/synth_trips.py out_dir rows_per_file
+import os, sys, gzip, numpy as np, pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nbhd_lookup import NbhdLookup
+
+# Header (in order) for each layout, and the column each field is filled from
+headers = {
+    'yellow_2009': [('vendor_name', 'vendor'), ('Trip_Pickup_DateTime', 'pickup'), ('Trip_Dropoff_DateTime', 'dropoff'),
+                    ('Passenger_Count', 'passengers'), ('Trip_Distance', 'distance'), ('Start_Lon', 'pickup_lon'),
+                    ('Start_Lat', 'pickup_lat'), ('Rate_Code', 'rate_code'), ('store_and_forward', 'store'),
+                    ('End_Lon', 'dropoff_lon'), ('End_Lat', 'dropoff_lat'), ('Payment_Type', 'payment'),
+                    ('Fare_Amt', 'fare'), ('surcharge', 'extra'), ('mta_tax', 'mta_tax'), ('Tip_Amt', 'tip'),
+                    ('Tolls_Amt', 'tolls'), ('Total_Amt', 'total')],
+    'yellow_2010': [('vendor_id', 'vendor'), (' pickup_datetime', 'pickup'), (' dropoff_datetime', 'dropoff'),
+                    (' passenger_count', 'passengers'), (' trip_distance', 'distance'), (' pickup_longitude', 'pickup_lon'),
+                    (' pickup_latitude', 'pickup_lat'), (' rate_code', 'rate_code'), (' store_and_fwd_flag', 'store'),
+                    (' dropoff_longitude', 'dropoff_lon'), (' dropoff_latitude', 'dropoff_lat'), (' payment_type', 'payment'),
+                    (' fare_amount', 'fare'), (' surcharge', 'extra'), (' mta_tax', 'mta_tax'), (' tip_amount', 'tip'),
+                    (' tolls_amount', 'tolls'), (' total_amount', 'total')],
+    'yellow_2015': [('VendorID', 'vendor'), ('tpep_pickup_datetime', 'pickup'), ('tpep_dropoff_datetime', 'dropoff'),
+                    ('passenger_count', 'passengers'), ('trip_distance', 'distance'), ('pickup_longitude', 'pickup_lon'),
+                    ('pickup_latitude', 'pickup_lat'), ('RatecodeID', 'rate_code'), ('store_and_fwd_flag', 'store'),
+                    ('dropoff_longitude', 'dropoff_lon'), ('dropoff_latitude', 'dropoff_lat'), ('payment_type', 'payment'),
+                    ('fare_amount', 'fare'), ('extra', 'extra'), ('mta_tax', 'mta_tax'), ('tip_amount', 'tip'),
+                    ('tolls_amount', 'tolls'), ('improvement_surcharge', 'surcharge'), ('total_amount', 'total')],
+    'green_2013': [('VendorID', 'vendor'), ('lpep_pickup_datetime', 'pickup'), ('Lpep_dropoff_datetime', 'dropoff'),
+                   ('Store_and_fwd_flag', 'store'), ('RateCodeID', 'rate_code'), ('Pickup_longitude', 'pickup_lon'),
+                   ('Pickup_latitude', 'pickup_lat'), ('Dropoff_longitude', 'dropoff_lon'), ('Dropoff_latitude', 'dropoff_lat'),
+                   ('Passenger_count', 'passengers'), ('Trip_distance', 'distance'), ('Fare_amount', 'fare'),
+                   ('Extra', 'extra'), ('MTA_tax', 'mta_tax'), ('Tip_amount', 'tip'), ('Tolls_amount', 'tolls'),
+                   ('Ehail_fee', 'ehail'), ('Total_amount', 'total'), ('Payment_type', 'payment'), ('Trip_type ', 'trip_type')],
+    'green_2015': [('VendorID', 'vendor'), ('lpep_pickup_datetime', 'pickup'), ('Lpep_dropoff_datetime', 'dropoff'),
+                   ('Store_and_fwd_flag', 'store'), ('RateCodeID', 'rate_code'), ('Pickup_longitude', 'pickup_lon'),
+                   ('Pickup_latitude', 'pickup_lat'), ('Dropoff_longitude', 'dropoff_lon'), ('Dropoff_latitude', 'dropoff_lat'),
+                   ('Passenger_count', 'passengers'), ('Trip_distance', 'distance'), ('Fare_amount', 'fare'),
+                   ('Extra', 'extra'), ('MTA_tax', 'mta_tax'), ('Tip_amount', 'tip'), ('Tolls_amount', 'tolls'),
+                   ('Ehail_fee', 'ehail'), ('improvement_surcharge', 'surcharge'), ('Total_amount', 'total'),
+                   ('Payment_type', 'payment'), ('Trip_type ', 'trip_type')]}
+
+
+def layout(trip_type, year):
+    if trip_type == 'green':
+        return 'green_2015' if year >= 2015 else 'green_2013'
+    return 'yellow_2009' if year == 2009 else 'yellow_2015' if year >= 2015 else 'yellow_2010'
+
+
+# n random points inside the neighborhood polygons (uniform over their area)
+def nbhd_points(nbhd_lookup, n, rng):
+    lon, lat = np.empty(0), np.empty(0)
+    minlon, minlat = nbhd_lookup.bounds[:, :2].min(0)
+    maxlon, maxlat = nbhd_lookup.bounds[:, 2:].max(0)
+    while lon.shape[0] < n:
+        x = rng.uniform(minlon, maxlon, 2 * n)
+        y = rng.uniform(minlat, maxlat, 2 * n)
+        inside = nbhd_lookup.lookup_index(x, y) >= 0
+        lon, lat = np.concatenate([lon, x[inside]]), np.concatenate([lat, y[inside]])
+    return lon[:n], lat[:n]
+
+
+# Random trips for one month, with a small share of bad records
+def random_trips(nbhd_lookup, trip_type, year, month, n, rng, bad_share=0.02):
+    start = pd.Timestamp('%d-%02d-01' % (year, month))
+    n_secs = int((start + pd.DateOffset(months=1) - start).total_seconds())
+    pickup = start + pd.to_timedelta(rng.randint(0, n_secs, n), unit='s')
+    trip_time = rng.gamma(2, 400, n).astype(int) + 30
+    dropoff = pickup + pd.to_timedelta(trip_time, unit='s')
+    pickup_lon, pickup_lat = nbhd_points(nbhd_lookup, n, rng)
+    dropoff_lon, dropoff_lat = nbhd_points(nbhd_lookup, n, rng)
+    distance = np.round(trip_time / 3600.0 * rng.uniform(5, 20, n), 2)
+    fare = np.round(2.5 + 2.5 * distance, 2)
+    tip = np.round(fare * rng.choice([0, 0.15, 0.2], n), 2)
+    trips = pd.DataFrame({'vendor': rng.choice(['CMT', 'VTS'] if year < 2015 and trip_type == 'yellow' else [1, 2], n),
+                          'pickup': pickup.strftime('%Y-%m-%d %H:%M:%S'),
+                          'dropoff': dropoff.strftime('%Y-%m-%d %H:%M:%S'),
+                          'passengers': rng.choice([1, 1, 1, 2, 3, 5], n), 'distance': distance,
+                          'pickup_lon': pickup_lon, 'pickup_lat': pickup_lat,
+                          'dropoff_lon': dropoff_lon, 'dropoff_lat': dropoff_lat,
+                          'rate_code': 1, 'store': 'N', 'payment': rng.choice([1, 2], n),
+                          'fare': fare, 'extra': 0.5, 'mta_tax': 0.5, 'tip': tip, 'tolls': 0.0,
+                          'surcharge': 0.3, 'ehail': '', 'trip_type': 1})
+    trips['total'] = trips.fare + trips.extra + trips.mta_tax + trips.tip + trips.tolls
+    # Bad records: zero coords, zero passengers, negative fares, zero distances
+    bad = np.flatnonzero(rng.rand(n) < bad_share)
+    for col, value in [('pickup_lon', 0.0), ('pickup_lat', 0.0), ('passengers', 0), ('fare', -2.5), ('distance', 0.0)]:
+        rows = bad[rng.rand(bad.shape[0]) < 0.3]
+        trips.loc[rows, col] = value
+    return trips
+
+
+# Writes one month of trips as data_download.py would name it, returns the file name
+def write_month(out_dir, nbhd_lookup, trip_type, year, month, n, seed=0):
+    rng = np.random.RandomState(seed)
+    trips = random_trips(nbhd_lookup, trip_type, year, month, n, rng)
+    cols = headers[layout(trip_type, year)]
+    file_name = os.path.join(out_dir, '%s_%02d_%d.gz' % (trip_type, month, year))
+    body = trips[[x[1] for x in cols]].to_csv(header=False, index=False)
+    if trip_type == 'green':
+        # real green files have extra delimiters at the end of each line
+        body = body.replace('\n', ',,\n')
+    with gzip.open(file_name, 'wt') as f:
+        f.write(','.join(x[0] for x in cols) + '\n')
+        f.write(body)
+    return file_name
+
+
+# Writes rows_per_file trips for each (type, year, month)
+def write_months(out_dir, rows_per_file, months=None, geojson='nyc_neighborhoods.json', seed=0):
+    months = months or [('yellow', 2009, 1), ('yellow', 2012, 6), ('yellow', 2014, 5), ('yellow', 2015, 5),
+                        ('green', 2014, 5), ('green', 2015, 5)]
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    nbhd_lookup = NbhdLookup.from_geojson(geojson)
+    return [write_month(out_dir, nbhd_lookup, x, y, z, rows_per_file, seed + i) for i, (x, y, z) in enumerate(months)]
+
+
+if __name__ == '__main__':
+    for x in write_months(sys.argv[1], int(sys.argv[2])):
+        print(x)
@@ -0,0 +1,131 @@
+# Covariates by date (weather, holidays) for create_summary_data.py and the model in
+# nyc_taxi_analysis.py, parsed and cleaned once and saved as typed arrays (covariates.npz)
+# instead of joining jfk_weather.csv onto every nbhd / date / hour row
+# Every column covers the same consecutive dates from start, so the row of a date is its
+# number of days since start (its date index), and attaching covariates to millions of
+# rows is one array lookup per column
+# Columns are daily (one value per date) or hourly (24 per date, for finer weather),
+# missing values are NaN, and lookups can take the last value at or before each time
+# (as-of), up to max_age hours old
+import numpy as np, pandas as pd
+
+# Weather columns left out (text)
+weather_drop_cols = ['Events']
+
+
+class CovariateStore(object):
+
+    # start: first date, n_dates: number of consecutive dates covered
+    # values: dict of name -> float32 array (n_dates, or n_dates x 24 for hourly columns)
+    def __init__(self, start, n_dates, values=None):
+        self.start = pd.Timestamp(start).normalize()
+        self.n_dates = int(n_dates)
+        self.values = values or {}
+        self._asof = {}
+
+    # From the daily weather file (jfk_weather.csv), with a holiday column (US federal
+    # holidays), over the weather dates and the dates from start to end
+    @classmethod
+    def from_weather(cls, path, start=None, end=None):
+        weather = pd.read_csv(path)
+        weather.columns = [x.strip(' ') for x in weather.columns]
+        dates = pd.to_datetime(weather.pop('EST'), format='%m/%d/%Y')
+        weather = weather.drop(weather_drop_cols, axis=1, errors='ignore')
+        # 'T' (trace) precipitation counts as none
+        if 'PrecipitationIn' in weather.columns:
+            weather['PrecipitationIn'] = weather.PrecipitationIn.astype(str).str.strip().replace('T', '0')
+        first = min([dates.min()] + ([pd.Timestamp(start)] if start is not None else []))
+        last = max([dates.max()] + ([pd.Timestamp(end)] if end is not None else []))
+        store = cls(first, (last.normalize() - first.normalize()).days + 1)
+        for col in weather.columns:
+            store.add(col, dates.values, pd.to_numeric(weather[col], errors='coerce').values)
+        from pandas.tseries.holiday import USFederalHolidayCalendar
+        all_dates = store.dates
+        store.add('holiday', all_dates.values,
+                  all_dates.isin(USFederalHolidayCalendar().holidays(all_dates[0], all_dates[-1])))
+        return store
+
+    @property
+    def dates(self):
+        return pd.date_range(self.start, periods=self.n_dates)
+
+    @property
+    def columns(self):
+        return list(self.values)
+
+    # Date indexes (days since start) of dates
+    def date_index(self, dates):
+        days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+        return days - np.datetime64(self.start.date(), 'D').astype(np.int64)
+
+    # Sets the values of a column at dates (and hours, for an hourly column); dates
+    # must be within the dates covered, and values not set are NaN
+    # Duplicated dates keep their first value
+    def add(self, name, dates, values, hours=None):
+        d = self.date_index(dates)
+        if len(d) and (d.min() < 0 or d.max() >= self.n_dates):
+            raise ValueError('dates of %s outside %s to %s' % (name, self.start.date(), self.dates[-1].date()))
+        values = np.asarray(values, dtype=np.float32)
+        if hours is None:
+            column = np.full(self.n_dates, np.nan, dtype=np.float32)
+            column[d[::-1]] = values[::-1]
+        else:
+            column = np.full((self.n_dates, 24), np.nan, dtype=np.float32)
+            column[d[::-1], np.asarray(hours)[::-1]] = values[::-1]
+        self.values[name] = column
+        self._asof.pop(name, None)
+        return self
+
+    # For each position of a column (flattened), the position of the last value at or
+    # before it (-1 if none)
+    def _last_values(self, name):
+        if name not in self._asof:
+            flat = self.values[name].ravel()
+            positions = np.where(np.isnan(flat), -1, np.arange(len(flat)))
+            self._asof[name] = np.maximum.accumulate(positions) if len(flat) else positions
+        return self._asof[name]
+
+    # Values of cols (default: all) at date indexes d and hours h (default: start of the
+    # day), as a dict of float32 arrays
+    # max_age: hours back to look for the last value if there is none at the time itself
+    # (0: only exact values; NaN where there is none)
+    def lookup(self, d, hours=None, cols=None, max_age=0):
+        d = np.asarray(d, dtype=np.int64)
+        h = np.zeros_like(d) if hours is None else np.asarray(hours, dtype=np.int64)
+        out = {}
+        for name in cols or self.columns:
+            column = self.values[name]
+            steps = 1 if column.ndim == 1 else 24
+            pos = d * steps + (h * steps) // 24
+            n = column.size
+            last = self._last_values(name)
+            src = np.where(pos >= 0, last[np.clip(pos, 0, n - 1)], -1) if n else np.full(pos.shape, -1)
+            # (positions past the last date can use the last value, if it is recent enough)
+            age = (np.maximum(pos, src) - src) * (24 // steps)
+            ok = (src >= 0) & (age <= max_age)
+            out[name] = np.where(ok, column.ravel()[np.maximum(src, 0)], np.nan).astype(np.float32)
+        return out
+
+    # Adds the covariates cols (default: all) as columns of a table with a date column
+    # (and an hour column, used for hourly covariates, if there is one)
+    def join(self, frame, cols=None, max_age=0):
+        d = self.date_index(frame.date.values)
+        hours = frame.hour.values if 'hour' in frame.columns else None
+        frame = frame.copy()
+        for name, values in self.lookup(d, hours, cols, max_age).items():
+            frame[name] = values
+        return frame
+
+    def save(self, path):
+        arrays = dict(('%s_%s' % ('daily' if x.ndim == 1 else 'hourly', name), x) for name, x in self.values.items())
+        np.savez_compressed(path, start=np.array(str(self.start.date())), n_dates=np.array(self.n_dates),
+                            columns=np.array(self.columns), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        values = {}
+        with np.load(path, allow_pickle=False) as f:
+            for name in f['columns'].tolist():
+                key = 'daily_' + name if 'daily_' + name in f.files else 'hourly_' + name
+                values[name] = f[key]
+            return cls(str(f['start']), int(f['n_dates']), values)
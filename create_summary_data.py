@@ -1,93 +1,102 @@
-# Summarizes / cleans the raw data to use in analysis. Only run this once!
-# Creates four files:
+# Summarizes / cleans the raw data to use in analysis. Rerun after downloading new
+# data: only new or changed files are summarized again (see partials_dir)
+# Creates seven files:
 # pickups_hd: total passengers by hour and day of week, sorted by rounded pickup lon/lat coords
 # pickups_hr: total passengers by hour, sorted by rounded pickup lat/lon coords
 # date_avgs: summaries (total passengers, total/avg fares, total/avg tips) by date
 # pickups_hdl: total passengers by hour, date, and neighborhood (not lon/lat coords)
+# od_hdl: trips, total trip time and fares by pickup nbhd, dropoff nbhd, date and hour
+#   (only the combinations with trips, saved as a sparse tensor, see summary_tables.py)
+# pickups_pyramid: total passengers by hour on grids of several resolutions (see pickup_pyramid.py)
+# covariates: weather (cleaned) and holidays by date, as arrays (see covariate_store.py)
 #######################################################
 #######################################################
 
-# Set location of top directory
-top_dir = 'C:/Users/Beatrice/Desktop/Taxi Analysis'
+import os
+# Set location of top directory (or set TAXI_TOP_DIR, as run_pipeline.py does)
+top_dir = os.environ.get('TAXI_TOP_DIR', 'C:/Users/Beatrice/Desktop/Taxi Analysis')
 # Set to number of decimals to round coordinates to
 # 3 decimals provides ~ 100m resolution
 num_dec = 3
+# Set to the coarser grids (number of decimals) to save in pickups_pyramid along with
+# the finest one (trip_summary.pyramid_dec, 4 decimals: ~ 10m), for the heatmaps
+pyramid_decs = [3, 2]
+# Set to True to look up neighborhoods in the raster saved by
+# find_pickup_dropoff_nbhds.py (nbhd_raster.npy) instead of joining on pd_locs.pkl
+use_raster = True
+# Set to number of rows to read at a time (None reads each file at once)
+# Bounds peak memory on the largest monthly files
+chunk_size = 1000000
+# Set to number of worker processes to summarize files in parallel (1 runs serially)
+# On Windows, worker processes re-run this script, so put it under an
+# if __name__ == '__main__': block before using more than one
+n_workers = 1
+# Set to folder (in the data directory) to save each file's partial sums in,
+# along with a manifest of the files summarized so far. Reruns then only
+# summarize new or changed files (None summarizes every file on each run)
+partials_dir = 'summary_partials'
+# Set to True to read the trips from the columnar (Parquet) store created by
+# data_download.py (data/trip_store) instead of the CSV files, and to save
+# the summaries as Parquet (pickups_hdl split into one folder per year)
+use_parquet = False
+# Set to True to save pickups_hdl compactly (borough / nbhd as categoricals, int32
+# counts, int8 hour / calendar columns) without the weather columns, which
+# nyc_taxi_analysis.py looks up by date in covariates.npz where it needs them
+# False copies all the weather columns onto every row (as before)
+compact_hdl = True
+# Set to True to add rows with zero pickups for every nbhd / date / hour without any
+# False only saves the rows with pickups (much smaller), and nyc_taxi_analysis.py
+# fills in the zeros for the data the model uses
+fill_hdl = True
+# Set to file (in the data directory) to log each stage's and each file's wall time,
+# records in / out, records dropped by each filter and peak memory to (JSON lines,
+# see pipeline_log.py), or None for no log
+log_file = 'pipeline_log.jsonl'
+# Set to True to also sample where the time goes in each stage (slower, added to the log)
+profile = False
 import os, glob, pandas as pd, numpy as np
+from trip_summary import summarize_files, summary_keys, pyramid_dec
+from pickup_pyramid import GridPyramid
+from covariate_store import CovariateStore
+from summary_tables import compact_pickups_hdl, fill_zeros, save_sparse_tensor
+from pipeline_log import PipelineLog
 os.chdir(top_dir + '/data')
-files = glob.glob('green*') + glob.glob('yellow*')
-pd_locations = pd.read_pickle('pd_locs.pkl')
+log = PipelineLog(log_file, 'create_summary_data', profile)
+if use_parquet:
+    import trip_store
+    files = trip_store.list_partitions('trip_store')
+else:
+    files = glob.glob('green*') + glob.glob('yellow*')
+if use_raster:
+    from nbhd_lookup import NbhdRaster
+    nbhd_locs = NbhdRaster.load('nbhd_raster')
+else:
+    nbhd_locs = pd.read_pickle('pd_locs.pkl')
 
-# Initialize empty dataframes to fill
-# pickups_hd: pickups by hour, day of week, and rounded lon/lat
-pickups_hd = pd.DataFrame(columns = ['passenger_count', 'day', 'hour', 'rounded_lon', 
-                                     'rounded_lat', 'trip_time_in_secs', 'trip_distance'])
+# Read in, clean and summarize pickups files, summing the partial sums
+# pickups_hd: pickups by hour, day of week, and rounded lon/lat (in neighborhood boundaries)
 # pickups_hdl: pickups by date, hour, and neighborhood
-pickups_hdl = pd.DataFrame(columns = ['passenger_count', 'date', 'hour', 'borough', 'nbhd'])
+# date_avgs / date_counts: overall trip summaries by date
+# total_records: running total of records
+stage = log.begin('summarize', files=len(files))
+summaries, total_records = summarize_files(files, num_dec, nbhd_locs, chunk_size, n_workers, partials_dir, log)
+log.end(stage, rows_in=total_records)
+pickups_hd = summaries['pickups_hd']
+pickups_hdl = summaries['pickups_hdl']
+date_avgs = summaries['date_avgs']
+date_counts = summaries['date_counts']
+od_hdl = summaries['od_hdl']
 
-# date_avgs: overall trip summaries by date
-date_avgs = pd.DataFrame(columns = ['passenger_count', 'date', 'fare_amount', 'tip_amount', 'trip_distance', 'type'])
-date_counts = pd.DataFrame(columns = ['date', 'type', 0])
-
-# running total of records
-total_records = 0
-
-for x in files:
-    print(x)
-    # Read in pickups files
-    tmp = pd.read_csv(x)
-    total_records += tmp.shape[0]
-    tmp_col_names = [x.strip(' ').lower() for x in tmp.columns.values.tolist()]
-    tmp_col_names = [x.replace('amt', 'amount') for x in tmp_col_names]
-    tmp_col_names = [x.replace('start_lon', 'pickup_longitude') for x in tmp_col_names]
-    tmp_col_names = [x.replace('start_lat', 'pickup_latitude') for x in tmp_col_names]
-    tmp_col_names = ['pickup_time' if 'pickup_datetime' in x else x for x in tmp_col_names]
-    tmp_col_names = ['dropoff_time' if 'dropoff_datetime' in x else x for x in tmp_col_names]
-    tmp.columns = tmp_col_names
-    tmp['rounded_lon'] = tmp.pickup_longitude.round(num_dec)
-    tmp['rounded_lat'] = tmp.pickup_latitude.round(num_dec)
-    tmp['trip_time_in_secs'] = (pd.to_datetime(tmp.dropoff_time, format='%Y-%m-%d %H:%M:%S') - 
-                                pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S')).dt.seconds
-    tmp['day'] = pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S').dt.dayofweek
-    tmp['hour'] = pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S').dt.hour
-    tmp['date'] = pd.to_datetime(tmp.pickup_time, format='%Y-%m-%d %H:%M:%S').dt.date
-    # Some data cleaning
-    tmp = tmp[(tmp.passenger_count < 20) & (tmp.rounded_lon < -73) & (tmp.rounded_lat < 41) & 
-              (0 < tmp.passenger_count)  & (-75 < tmp.rounded_lon) & (40 < tmp.rounded_lat) & 
-              (0 < tmp.trip_time_in_secs) & (tmp.trip_time_in_secs < 7200) & (0 < tmp.fare_amount) & 
-              (tmp.fare_amount < 200) & (0 < tmp.total_amount) & (tmp.total_amount < 200) & 
-              (0 <= tmp.tip_amount) & (tmp.tip_amount < 200) & (0 < tmp.trip_distance) & 
-              (tmp.trip_distance < 50)]
-    # Remove trip speeds that may not make sense (trim top/bottom 1%)
-    tmp = tmp[((tmp.trip_distance / tmp.trip_time_in_secs) < np.percentile((tmp.trip_distance / tmp.trip_time_in_secs), 99)) & 
-              ((tmp.trip_distance / tmp.trip_time_in_secs) > np.percentile((tmp.trip_distance / tmp.trip_time_in_secs), 1))]
-    tmp['type'] = 'green' if 'green' in x else 'yellow'
-    # For pickups hour and day
-    pickups_hd = pd.concat([pickups_hd, tmp[['passenger_count', 'day', 'hour', 'rounded_lon', 
-                                             'rounded_lat', 'trip_time_in_secs', 'trip_distance']]], axis=0)
-    pickups_hd = pickups_hd.groupby(['rounded_lon', 'rounded_lat', 'day', 
-                                     'hour'])['passenger_count', 'trip_time_in_secs', 'trip_distance'].sum().reset_index()
-    # For date averages, take sums and number of records by date
-    date_avgs = pd.concat([date_avgs, tmp[['passenger_count', 'date', 'fare_amount', 'tip_amount', 'trip_distance', 'type']]], axis = 0)
-    date_avgs = date_avgs.groupby(['date', 'type'])['passenger_count', 'fare_amount', 'tip_amount', 'trip_distance'].sum().reset_index()
-    date_counts = pd.concat([date_counts, tmp.groupby(['date', 'type']).size().reset_index()], axis=0).groupby(['date', 'type'])[0].sum().reset_index()
-    # For pickups date, hour, and neighborhood
-    tmp = tmp[['passenger_count', 'date', 'hour', 'rounded_lon', 'rounded_lat']]
-    tmp['passenger_count'] = tmp.groupby(['rounded_lon', 'rounded_lat', 'date', 'hour'])['passenger_count'].transform(sum)
-    tmp.drop_duplicates(inplace=True)
-    tmp = pd.merge(tmp, pd_locations, how='inner', on=['rounded_lon', 'rounded_lat'])
-    tmp.drop(['rounded_lon', 'rounded_lat'], axis=1, inplace=True)
-    tmp = tmp.groupby(['borough', 'nbhd', 'date', 'hour'])['passenger_count'].sum().reset_index()
-    pickups_hdl = pd.concat([pickups_hdl, tmp], axis=0)
-    pickups_hdl = pickups_hdl.groupby(['borough', 'nbhd', 'date', 'hour'])['passenger_count'].sum().reset_index()
-    del tmp
-    
-## Remove points not in neighborhood boundaries
-pickups_hd = pd.merge(pickups_hd, pd_locations, how='inner', on=['rounded_lon', 'rounded_lat'])
-    
 # Group by hour
 pickups_hr = pickups_hd.groupby(by=['hour', 'rounded_lat', 
                                     'rounded_lon'])['passenger_count'].sum().reset_index()
 
+# Pickups by hour at each grid resolution (summed down from the finest grid)
+stage = log.begin('pyramid', rows_in=summaries['pickups_grid'].shape[0])
+pyramid = GridPyramid.from_frame(summaries['pickups_grid'], pyramid_dec, pyramid_decs)
+pyramid.save('pickups_pyramid.npz')
+log.end(stage, rows_out=sum(len(x['hour']) for x in pyramid.levels.values()))
+
 # Summaries by date
 date_avgs = pd.merge(date_avgs, date_counts, how='inner', on=['date', 'type'])
 date_avgs.rename(columns={0:'total_pickups'}, inplace=True)
@@ -96,47 +105,61 @@ date_avgs.tip_amount = date_avgs.tip_amount / date_avgs.total_pickups
 date_avgs.trip_distance = date_avgs.trip_distance / date_avgs.total_pickups
 
 # Save to compressed file
-pickups_hd.to_csv("pickups_hd.gz", compression="gzip")
-pickups_hr.to_csv("pickups_hr.gz", compression="gzip")
-date_avgs.to_csv("date_avgs.gz", compression="gzip")
+stage = log.begin('save_summaries')
+if use_parquet:
+    trip_store.write_summary(pickups_hd, 'pickups_hd.parquet')
+    trip_store.write_summary(pickups_hr, 'pickups_hr.parquet')
+    trip_store.write_summary(date_avgs, 'date_avgs.parquet')
+    trip_store.write_summary(od_hdl, 'od_hdl.parquet')
+else:
+    pickups_hd.to_csv("pickups_hd.gz", compression="gzip")
+    pickups_hr.to_csv("pickups_hr.gz", compression="gzip")
+    date_avgs.to_csv("date_avgs.gz", compression="gzip")
+    save_sparse_tensor(od_hdl, 'od_hdl.npz', summary_keys['od_hdl'])
+log.end(stage, rows_out=pickups_hd.shape[0] + pickups_hr.shape[0] + date_avgs.shape[0] + od_hdl.shape[0])
 
 #######################################################
 #######################################################
 # More processing on pickups by date, hour, and nbhd
 # Add in zero pickup counts to those hour/date combinations 
 # not returned from data
-nbhd_list = pickups_hdl['nbhd'].unique().tolist()
-date_list = pickups_hdl['date'].unique().tolist()
-hour_list = pickups_hdl['hour'].unique().tolist()
-
-from itertools import product
-temp_fill = pd.DataFrame(list(product(nbhd_list, date_list, hour_list)), columns=['nbhd', 'date', 'hour'])
-temp_fill['passenger_count'] = 0
-temp_fill = pd.merge(temp_fill, pickups_hdl[['nbhd', 'borough']].drop_duplicates(), 
-                     how='left', on='nbhd')
-
-pickups_hdl = pd.concat([pickups_hdl, temp_fill], axis=0)
-pickups_hdl = pickups_hdl.groupby(['borough', 
-                                   'nbhd', 'date', 'hour'])['passenger_count'].sum().reset_index()
+stage = log.begin('fill_pickups_hdl', rows_in=pickups_hdl.shape[0])
+# (a dense nbhd x date x hour array of counts, see summary_tables.py)
+if fill_hdl:
+    pickups_hdl = fill_zeros(pickups_hdl)
+log.end(stage, rows_out=pickups_hdl.shape[0])
 
 # Merge weather and holiday info!
 # Import weather data (JFK airport, obtained here: 
 # https://www.wunderground.com/history/airport/KJFK)
-weather = pd.read_csv('jfk_weather.csv')
-weather.EST = pd.to_datetime(weather.EST, format='%m/%d/%Y')
+stage = log.begin('add_weather', rows_in=pickups_hdl.shape[0])
 pickups_hdl.date = pd.to_datetime(pickups_hdl.date, format='%Y-%m-%d')
 
+# Weather and US holidays by date, cleaned once and saved as arrays by date
+# (over the weather dates and all the pickup dates)
+covariates = CovariateStore.from_weather('jfk_weather.csv', pickups_hdl.date.min(), pickups_hdl.date.max())
+covariates.save('covariates.npz')
+
 # Check if date falls on a US holiday
-from pandas.tseries.holiday import USFederalHolidayCalendar as calendar
-cal = calendar()
-holidays = cal.holidays(start=pickups_hdl.date.min(), end=pickups_hdl.date.max())
-pickups_hdl['holiday'] = pickups_hdl.date.isin(holidays).astype(int)
+pickups_hdl['holiday'] = covariates.join(pickups_hdl[['date']], cols=['holiday'])['holiday'].astype(int)
 
 # Join weather data w/ pickups (by date)
-pickups_hdl = pd.merge(pickups_hdl, weather, how='left', left_on=['date'], right_on=['EST'])
+if not compact_hdl:
+    weather = pd.read_csv('jfk_weather.csv')
+    weather.EST = pd.to_datetime(weather.EST, format='%m/%d/%Y')
+    pickups_hdl = pd.merge(pickups_hdl, weather, how='left', left_on=['date'], right_on=['EST'])
+    pickups_hdl.drop(['EST'], axis=1, inplace=True)
 pickups_hdl['day_of_week'] = pickups_hdl['date'].dt.dayofweek
 pickups_hdl['month'] = pickups_hdl['date'].dt.month
-pickups_hdl.drop(['EST'], axis=1, inplace=True)
+if compact_hdl:
+    pickups_hdl = compact_pickups_hdl(pickups_hdl)
+log.end(stage, rows_out=pickups_hdl.shape[0])
 
 # Save to compressed file
-pickups_hdl.to_csv("pickups_hdl.gz", compression="gzip")
\ No newline at end of file
+stage = log.begin('save_pickups_hdl', rows_out=pickups_hdl.shape[0])
+if use_parquet:
+    pickups_hdl['year'] = pickups_hdl['date'].dt.year.astype(np.int16)
+    trip_store.write_summary(pickups_hdl, 'pickups_hdl.parquet', partition_cols=['year'])
+else:
+    pickups_hdl.to_csv("pickups_hdl.gz", compression="gzip")
+log.end(stage)
@@ -2,6 +2,8 @@
 # http://www.nyc.gov/html/tlc/html/about/trip_record_data.shtml
 # WARNING: Very slow (each yellow file ~2GB)
 # Compressed to about 1/4 the size in gzip format
+# Files are streamed to disk a few at a time (see trip_download.py), and an
+# interrupted run picks up where it left off when rerun
 
 # Years of data to download (currently 2009 - present)
 years = ['2009', '2010', '2011', '2012', '2013', '2014', '2015', '2016']
@@ -10,23 +12,36 @@ months = ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12'
 # Green only available beginning from August 2013
 types = ['yellow', 'green']
 url_add = 'https://s3.amazonaws.com/nyc-tlc/trip+data/'
+# Number of files to download at once
+n_threads = 4
+# Set to True to also convert each month into the columnar (Parquet) trip store
+# (data/trip_store, partitioned by type / year / month, see trip_store.py)
+to_parquet = False
+# Set to file (in the download directory) to log each file's download / conversion
+# time, size and peak memory to (JSON lines, see pipeline_log.py), or None for no log
+log_file = 'pipeline_log.jsonl'
 
-import os, requests, glob, pandas as pd
-# Set to download directory
-os.chdir('C:/Users/Beatrice/Desktop/Taxi Analysis/data')
-# Get list of already downloaded files
-files = glob.glob('yellow*') + glob.glob('green*')
+import os
+from trip_download import download_all
+from pipeline_log import PipelineLog
+# Set to download directory (the data folder of the top directory, or of TAXI_TOP_DIR
+# if set, as run_pipeline.py does)
+os.chdir(os.environ.get('TAXI_TOP_DIR', 'C:/Users/Beatrice/Desktop/Taxi Analysis') + '/data')
+log = PipelineLog(log_file, 'data_download')
 
-for x in types:
-    for y in years:
-        for z in months:
-            url_tmp = url_add + x + '_tripdata_' + y + '-' + z + '.csv'
-            file_tmp = x + '_' + z + '_' + y + '.gz'
-            if (file_tmp not in files) and (requests.head(url_tmp).status_code != 404):
-                # Determine number of columns (from data dictionaries)
-                col_list = list(range(0, 20)) if 'green' in file_tmp else list(range(0, 19))
-                tmp_data = pd.read_csv(url_tmp, sep=',', index_col=False, usecols=col_list, 
-                                       skip_blank_lines=True, error_bad_lines=False)
-                tmp_data.to_csv(file_tmp, compression='gzip')
-                del tmp_data
-            print(file_tmp)
\ No newline at end of file
+jobs = [(url_add + x + '_tripdata_' + y + '-' + z + '.csv', x + '_' + z + '_' + y + '.gz')
+        for x in types for y in years for z in months]
+# Already downloaded files are listed in download_manifest.json
+manifest = download_all(jobs, n_threads, 'download_manifest.json', log=log)
+
+if to_parquet:
+    import trip_store
+    for x in types:
+        for y in years:
+            for z in months:
+                file_tmp = x + '_' + z + '_' + y + '.gz'
+                if file_tmp in manifest and not os.path.isdir(trip_store.partition_dir('trip_store', x, y, z)):
+                    stage = log.begin('to_parquet', file=file_tmp)
+                    trip_store.write_trips(file_tmp, 'trip_store', x, y, z)
+                    log.end(stage)
+                    print(trip_store.partition_dir('trip_store', x, y, z))
@@ -1,45 +1,36 @@
-import os, json, pandas as pd
-from shapely.geometry import Polygon
-# Set top directory
-top_dir = top_dir = 'C:/Users/Beatrice/Desktop/Taxi Analysis'
+import os, pandas as pd
+from nbhd_geometry import NbhdGeometry
+from pipeline_log import PipelineLog
+# Set top directory (or set TAXI_TOP_DIR, as run_pipeline.py does)
+top_dir = os.environ.get('TAXI_TOP_DIR', 'C:/Users/Beatrice/Desktop/Taxi Analysis')
+# Set to file (in the data directory) to log each stage's wall time, rows and
+# peak memory to (JSON lines, see pipeline_log.py), or None for no log
+log_file = 'pipeline_log.jsonl'
 os.chdir(top_dir)
+log = PipelineLog(log_file and os.path.join(top_dir, 'data', log_file), 'find_nbhd_centroids_boundaries')
 
-# load JSON file containing neighborhood sectors
-with open('nyc_neighborhoods.json', 'r') as f:
-    js = json.load(f)
+# load neighborhood polygons from the JSON file, as packed coordinate arrays
+# (cached in nyc_neighborhoods_cache, see nbhd_geometry.py)
+stage = log.begin('load_geometry')
+geometry = NbhdGeometry.load('nyc_neighborhoods.json')
+log.end(stage, rows_out=geometry.n_features)
 
 ###################################################################
 ###################################################################
 # Finds nbhd centroids for each nbhd in the JSON file
-lon = []
-lat = []
-nbhd = []
-brgh = []
-
-for feature in js['features']:
-    lon.append(Polygon(feature['geometry']['coordinates'][0]).centroid.x)
-    lat.append(Polygon(feature['geometry']['coordinates'][0]).centroid.y)
-    nbhd.append(feature['properties']['neighborhood'])
-    brgh.append(feature['properties']['borough'])
-    
-nbhd_centroids = pd.DataFrame({'lon': lon, 'lat': lat, 'nbhd': nbhd, 'borough': brgh})
+# (area weighted over the polygon with its holes left out)
+stage = log.begin('centroids', rows_in=geometry.n_features)
+nbhd_centroids = geometry.centroid_frame()
 nbhd_centroids = nbhd_centroids.loc[nbhd_centroids[['borough', 'nbhd']].drop_duplicates().index]
 nbhd_centroids.to_pickle('./data/nbhd_centroids.pkl')
+log.end(stage, rows_out=nbhd_centroids.shape[0])
 
 ###################################################################
 ###################################################################
 # Create dataframe of neighborhood border points (from JSON file)
-lon = []
-lat = []
-nbhd = []
-brgh = []
-
-for feature in js['features']:
-    lon.extend([x[0] for x in feature['geometry']['coordinates'][0]])
-    lat.extend([x[1] for x in feature['geometry']['coordinates'][0]])
-    nbhd.extend([feature['properties']['neighborhood']] * len(feature['geometry']['coordinates'][0]))
-    brgh.extend([feature['properties']['borough']] * len(feature['geometry']['coordinates'][0]))
-    
-nbhd_borders = pd.DataFrame({'lon': lon, 'lat': lat, 'nbhd': nbhd, 'borough': brgh})
+# polygon / ring number the rings of each nbhd, to draw them separately
+stage = log.begin('borders', rows_in=geometry.n_features)
+nbhd_borders = geometry.border_frame()
 nbhd_borders = nbhd_borders.drop_duplicates()
-nbhd_borders.to_pickle('./data/nbhd_borders.pkl')
\ No newline at end of file
+nbhd_borders.to_pickle('./data/nbhd_borders.pkl')
+log.end(stage, rows_out=nbhd_borders.shape[0])
@@ -9,93 +9,87 @@
 # Save it as 'nyc_neighborhoods.json' in top directory
 ####################################################################
 ####################################################################
-# Set this to top directory
-top_dir = 'C:/Users/Beatrice/Desktop/Taxi Analysis'
+import os
+# Set this to top directory (or set TAXI_TOP_DIR, as run_pipeline.py does)
+top_dir = os.environ.get('TAXI_TOP_DIR', 'C:/Users/Beatrice/Desktop/Taxi Analysis')
 # Set to number of decimals to round coordinates to
 # 3 decimals provides ~ 100m resolution
 num_dec = 3
+# Set to True to rasterize the neighborhoods onto the whole grid of rounded
+# coords (saved to nbhd_raster.npy / .json) instead of collecting the unique
+# coords from all trip files first
+use_raster = True
+# Set to file (in the data directory) to log each stage's wall time, rows and
+# peak memory to (JSON lines, see pipeline_log.py), or None for no log
+log_file = 'pipeline_log.jsonl'
+# Set to True to also sample where the time goes in each stage (slower, added to the log)
+profile = False
 
 import os, glob, pandas as pd, numpy as np
-os.chdir(top_dir + '/data')
-files = glob.glob('green*') + glob.glob('yellow*')
-pd_locations = pd.DataFrame(columns = ['rounded_lon', 'rounded_lat'])
+from nbhd_lookup import NbhdLookup, NbhdRaster
+from pipeline_log import PipelineLog
+os.chdir(top_dir)
+log = PipelineLog(log_file and os.path.join(top_dir, 'data', log_file), 'find_pickup_dropoff_nbhds', profile)
+# load GeoJSON file containing neighborhood sectors, discussed on lines 7-9
+# Each polygon is built once and indexed by bounding box
+nbhd_lookup = NbhdLookup.from_geojson('nyc_neighborhoods.json')
 
-# Collect all unique rounded pickup/dropoff coords
-for x in files:
-    tmp = pd.read_csv(x)
-    # Clean header names of some files
-    tmp_col_names = [x.strip(' ').lower() for x in tmp.columns.values.tolist()]
-    tmp_col_names = [x.replace('amt', 'amount') for x in tmp_col_names]
-    tmp_col_names = [x.replace('start_lon', 'pickup_longitude') for x in tmp_col_names]
-    tmp_col_names = [x.replace('start_lat', 'pickup_latitude') for x in tmp_col_names]
-    tmp_col_names = [x.replace('end_lon', 'dropoff_longitude') for x in tmp_col_names]
-    tmp_col_names = [x.replace('end_lat', 'dropoff_latitude') for x in tmp_col_names]
-    tmp.columns = tmp_col_names
-    tmp1 = tmp[['pickup_longitude', 'pickup_latitude']].round(num_dec)
-    tmp2 = tmp[['dropoff_longitude', 'dropoff_latitude']].round(num_dec)
-    tmp1.columns = ['rounded_lon', 'rounded_lat']
-    tmp2.columns = ['rounded_lon', 'rounded_lat']
-    tmp_locs = pd.concat([tmp1, tmp2], ignore_index=True)
-    tmp_locs.drop_duplicates(inplace=True)
-    pd_locations = pd.concat([pd_locations, tmp_locs], ignore_index=True)
-    pd_locations.drop_duplicates(inplace=True)
-    print(x)
-    del tmp, tmp1, tmp2, tmp_locs
+if use_raster:
+    # Look up every grid point inside the polygons' min/max coords in one go
+    stage = log.begin('rasterize')
+    nbhd_raster = NbhdRaster.from_lookup(nbhd_lookup, num_dec)
+    nbhd_raster.save('./data/nbhd_raster')
+    log.end(stage, rows_in=nbhd_raster.grid.size, rows_out=int(np.count_nonzero(nbhd_raster.grid >= 0)))
+    # All grid points inside a neighborhood, same columns as below
+    pd_locations = nbhd_raster.to_frame()
+else:
+    os.chdir(top_dir + '/data')
+    files = glob.glob('green*') + glob.glob('yellow*')
+    pd_locations = pd.DataFrame(columns = ['rounded_lon', 'rounded_lat'])
 
-# Change back to top directory
-os.chdir(top_dir)
+    # Collect all unique rounded pickup/dropoff coords
+    for x in files:
+        stage = log.begin('unique_coords', file=x)
+        # index_col=False: some raw files have extra delimiters at the end of each line
+        tmp = pd.read_csv(x, index_col=False)
+        # Clean header names of some files
+        tmp_col_names = [x.strip(' ').lower() for x in tmp.columns.values.tolist()]
+        tmp_col_names = [x.replace('amt', 'amount') for x in tmp_col_names]
+        tmp_col_names = [x.replace('start_lon', 'pickup_longitude') for x in tmp_col_names]
+        tmp_col_names = [x.replace('start_lat', 'pickup_latitude') for x in tmp_col_names]
+        tmp_col_names = [x.replace('end_lon', 'dropoff_longitude') for x in tmp_col_names]
+        tmp_col_names = [x.replace('end_lat', 'dropoff_latitude') for x in tmp_col_names]
+        tmp.columns = tmp_col_names
+        tmp1 = tmp[['pickup_longitude', 'pickup_latitude']].round(num_dec)
+        tmp2 = tmp[['dropoff_longitude', 'dropoff_latitude']].round(num_dec)
+        tmp1.columns = ['rounded_lon', 'rounded_lat']
+        tmp2.columns = ['rounded_lon', 'rounded_lat']
+        tmp_locs = pd.concat([tmp1, tmp2], ignore_index=True)
+        tmp_locs.drop_duplicates(inplace=True)
+        pd_locations = pd.concat([pd_locations, tmp_locs], ignore_index=True)
+        pd_locations.drop_duplicates(inplace=True)
+        print(x)
+        log.end(stage, rows_in=tmp.shape[0], rows_out=tmp_locs.shape[0], total_coords=pd_locations.shape[0])
+        del tmp, tmp1, tmp2, tmp_locs
 
-# Drop NAs, sort coords to make lookups faster
-pd_locations.dropna(inplace=True)
-pd_locations = pd_locations.sort(['rounded_lon', 'rounded_lat']).reset_index()[['rounded_lon', 'rounded_lat']]
+    # Change back to top directory
+    os.chdir(top_dir)
 
-# Do geohashing to borough and neighborhood
-import json
-from shapely.geometry import shape, Point
-# load GeoJSON file containing neighborhood sectors, discussed on lines 7-9
-with open('nyc_neighborhoods.json', 'r') as f:
-    js = json.load(f)
-      
-# Create some heuristic boundaries based on min/max coords of all polygons 
-poly_bounds = np.empty((0))
-for feature in js['features']:
-    check_coords = feature['geometry']['coordinates'][0]
-    poly_bounds = np.append(poly_bounds, [item for item in check_coords])
-poly_bounds = poly_bounds.flatten()
-poly_minlat = min(poly_bounds[poly_bounds > 0])
-poly_maxlat = max(poly_bounds[poly_bounds > 0])
-poly_minlon = min(poly_bounds[poly_bounds < 0])
-poly_maxlon = max(poly_bounds[poly_bounds < 0])
+    # Drop NAs, sort coords to make lookups faster
+    pd_locations.dropna(inplace=True)
+    pd_locations = pd_locations.sort(['rounded_lon', 'rounded_lat']).reset_index()[['rounded_lon', 'rounded_lat']]
 
-# initialize some things for the loop
-l1 = []
-l2 = []
-feature = js['features'][0]
+    # Do geohashing to borough and neighborhood
+    # all coordinates are looked up in one batched call
+    print(str(pd_locations.shape[0]) + ' rows to process...')
+    stage = log.begin('lookup', rows_in=pd_locations.shape[0])
+    l1, l2 = nbhd_lookup.lookup(pd_locations.rounded_lon.values, pd_locations.rounded_lat.values)
 
-# check each polygon to see if it contains the point
-# try the previous point's nbhd first, since the points are sorted
-for x, row1 in pd_locations.iterrows():
-    temp_point = Point(pd_locations.rounded_lon[x], pd_locations.rounded_lat[x])
-    l1.append(np.nan)
-    l2.append(np.nan)
-    if(x%1000 == 0):
-        print(str(x) + ' rows processed...')
-    if(poly_minlon < pd_locations.rounded_lon[x] < poly_maxlon) and (poly_minlat < pd_locations.rounded_lat[x] < poly_maxlat):
-        temp_polygon = shape(feature['geometry'])
-        if temp_polygon.contains(temp_point):
-            l1[x] = feature['properties']['borough']
-            l2[x] = feature['properties']['neighborhood']
-        else:
-            for feature in js['features']:
-                polygon = shape(feature['geometry'])
-                if polygon.contains(temp_point):
-                    l1[x] = feature['properties']['borough']
-                    l2[x] = feature['properties']['neighborhood']
-                    break
+    pd_locations['borough'] = l1
+    pd_locations['nbhd'] = l2
 
-pd_locations['borough'] = l1
-pd_locations['nbhd'] = l2
+    pd_locations = pd_locations.dropna().reset_index(drop=True)
+    log.end(stage, rows_out=pd_locations.shape[0])
 
-pd_locations = pd_locations.dropna().reset_index(drop=True)
 # save file to pickle as pd_locs.pkl
 pd_locations.to_pickle('./data/pd_locs.pkl')
\ No newline at end of file
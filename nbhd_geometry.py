@@ -0,0 +1,170 @@
+# Neighborhood polygons from the GeoJSON file (nyc_neighborhoods.json) as packed arrays
+# All ring vertices are kept in one (n, 2) array of lon / lat, with offsets marking where
+# each ring, polygon (outer ring then holes) and feature (one or more polygons) starts,
+# so centroids, bounds and borders are computed for all features at once with NumPy
+# Parsing the 1.5 MB JSON file is the slow part, so the arrays are cached as .npy files
+# (memory-mappable) next to it, named by a hash of its contents: an edited file gets
+# a new cache, see NbhdGeometry.load
+import os, json, hashlib, numpy as np, pandas as pd
+
+
+class NbhdGeometry(object):
+
+    # coords: ring vertices, ring_start / polygon_start / feature_start: position of the
+    # first vertex of each ring / first ring of each polygon / first polygon of each
+    # feature, with the total count appended
+    def __init__(self, coords, ring_start, polygon_start, feature_start, borough, nbhd):
+        self.coords = coords
+        self.ring_start = ring_start
+        self.polygon_start = polygon_start
+        self.feature_start = feature_start
+        self.borough = np.asarray(borough, dtype=object)
+        self.nbhd = np.asarray(nbhd, dtype=object)
+
+    @classmethod
+    def from_features(cls, features):
+        coords, ring_start, polygon_start, feature_start = [], [0], [0], [0]
+        for feature in features:
+            geometry = feature['geometry']
+            polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+            for polygon in polygons:
+                for ring in polygon:
+                    coords.extend(x[:2] for x in ring)
+                    ring_start.append(len(coords))
+                polygon_start.append(len(ring_start) - 1)
+            feature_start.append(len(polygon_start) - 1)
+        return cls(np.array(coords, dtype=float).reshape(-1, 2), np.array(ring_start, dtype=np.int64),
+                   np.array(polygon_start, dtype=np.int64), np.array(feature_start, dtype=np.int64),
+                   [feature['properties']['borough'] for feature in features],
+                   [feature['properties']['neighborhood'] for feature in features])
+
+    @classmethod
+    def from_geojson(cls, path='nyc_neighborhoods.json'):
+        with open(path, 'r') as f:
+            js = json.load(f)
+        return cls.from_features(js['features'])
+
+    # Each file is written to a temporary file (named by process) and then moved into
+    # place, so processes building the same cache at once (e.g. stages of run_pipeline.py)
+    # never read a half written file
+    def save(self, path):
+        tmp = '.%d.tmp' % os.getpid()
+        for x in ['coords', 'ring_start', 'polygon_start', 'feature_start']:
+            with open(path + '_' + x + '.npy' + tmp, 'wb') as f:
+                np.save(f, getattr(self, x))
+            os.replace(path + '_' + x + '.npy' + tmp, path + '_' + x + '.npy')
+        # names last, so a cache without them is incomplete
+        with open(path + '.json' + tmp, 'w') as f:
+            json.dump({'borough': self.borough.tolist(), 'nbhd': self.nbhd.tolist()}, f)
+        os.replace(path + '.json' + tmp, path + '.json')
+
+    @classmethod
+    def load_arrays(cls, path, mmap=True):
+        with open(path + '.json', 'r') as f:
+            names = json.load(f)
+        arrays = [np.load(path + '_' + x + '.npy', mmap_mode='r' if mmap else None)
+                  for x in ['coords', 'ring_start', 'polygon_start', 'feature_start']]
+        return cls(*arrays, borough=names['borough'], nbhd=names['nbhd'])
+
+    # Geometry of a GeoJSON file, from the cache (cache_dir, by default a folder next to
+    # the file) if the file has been parsed before, else parsed and added to the cache
+    @classmethod
+    def load(cls, path='nyc_neighborhoods.json', cache_dir=None, mmap=True):
+        with open(path, 'rb') as f:
+            file_hash = hashlib.sha1(f.read()).hexdigest()
+        cache_dir = cache_dir or os.path.splitext(path)[0] + '_cache'
+        cache_path = os.path.join(cache_dir, file_hash)
+        if not os.path.exists(cache_path + '.json'):
+            os.makedirs(cache_dir, exist_ok=True)
+            cls.from_geojson(path).save(cache_path)
+        return cls.load_arrays(cache_path, mmap)
+
+    @property
+    def n_features(self):
+        return len(self.feature_start) - 1
+
+    # Feature of each ring and whether it is a polygon's outer ring (not a hole)
+    def _ring_features(self):
+        n_rings = len(self.ring_start) - 1
+        polygon = np.repeat(np.arange(len(self.polygon_start) - 1), np.diff(self.polygon_start))
+        feature = np.repeat(np.arange(self.n_features), np.diff(self.feature_start))[polygon]
+        outer = np.zeros(n_rings, dtype=bool)
+        outer[np.asarray(self.polygon_start[:-1])] = True
+        return feature, outer
+
+    # Signed area and centroid of each ring (shoelace formula, with coords relative to
+    # the ring's first vertex to keep the precision)
+    def _ring_moments(self):
+        coords = np.asarray(self.coords)
+        ring_start = np.asarray(self.ring_start)
+        lengths = np.diff(ring_start)
+        ring = np.repeat(np.arange(len(lengths)), lengths)
+        xy = coords - coords[ring_start[:-1]][ring]
+        # each vertex with the next one in its ring (rings are closed, so the last vertex
+        # of a ring pairs with nothing)
+        last = ring_start[1:] - 1
+        nxt = np.roll(xy, -1, axis=0)
+        cross = xy[:, 0] * nxt[:, 1] - nxt[:, 0] * xy[:, 1]
+        cross[last] = 0
+        sums = [np.bincount(ring, weights=w, minlength=len(lengths))
+                for w in (cross, (xy[:, 0] + nxt[:, 0]) * cross, (xy[:, 1] + nxt[:, 1]) * cross)]
+        area = sums[0] / 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cx = sums[1] / (6 * area) + coords[ring_start[:-1], 0]
+            cy = sums[2] / (6 * area) + coords[ring_start[:-1], 1]
+        return area, cx, cy
+
+    # Area of each feature (holes subtracted), in squared degrees
+    def areas(self):
+        area = self._ring_moments()[0]
+        feature, outer = self._ring_features()
+        return np.bincount(feature, weights=np.where(outer, 1, -1) * np.abs(area), minlength=self.n_features)
+
+    # Centroid (lon, lat) of each feature, over all its polygons with the holes left out
+    def centroids(self):
+        area, cx, cy = self._ring_moments()
+        feature, outer = self._ring_features()
+        weight = np.where(outer, 1, -1) * np.abs(area)
+        total = np.bincount(feature, weights=weight, minlength=self.n_features)
+        lon = np.bincount(feature, weights=weight * np.nan_to_num(cx), minlength=self.n_features) / total
+        lat = np.bincount(feature, weights=weight * np.nan_to_num(cy), minlength=self.n_features) / total
+        return np.column_stack([lon, lat])
+
+    # Bounding box (minlon, minlat, maxlon, maxlat) of each feature
+    def bounds(self):
+        coords = np.asarray(self.coords)
+        start = np.asarray(self.ring_start)[np.asarray(self.polygon_start)[np.asarray(self.feature_start[:-1])]]
+        return np.column_stack([np.minimum.reduceat(coords, start, axis=0),
+                                np.maximum.reduceat(coords, start, axis=0)])
+
+    # Table of centroids (lon, lat, nbhd, borough), one row per feature
+    def centroid_frame(self):
+        centroids = self.centroids()
+        return pd.DataFrame({'lon': centroids[:, 0], 'lat': centroids[:, 1], 'nbhd': self.nbhd, 'borough': self.borough})
+
+    # Table of all ring vertices (lon, lat, nbhd, borough), with the polygon they belong to
+    # (position over all features) and the ring within it (0 for the outer ring, then
+    # holes), to draw with group = polygon and subgroup = ring
+    def border_frame(self):
+        coords = np.asarray(self.coords)
+        lengths = np.diff(np.asarray(self.ring_start))
+        feature, outer = self._ring_features()
+        polygon = np.repeat(np.arange(len(self.polygon_start) - 1), np.diff(self.polygon_start))
+        ring_in_polygon = np.arange(len(lengths)) - np.asarray(self.polygon_start)[polygon]
+        return pd.DataFrame({'lon': coords[:, 0], 'lat': coords[:, 1],
+                             'nbhd': np.repeat(self.nbhd[feature], lengths),
+                             'borough': np.repeat(self.borough[feature], lengths),
+                             'polygon': np.repeat(polygon, lengths), 'ring': np.repeat(ring_in_polygon, lengths)})
+
+    # Shapely geometry of each feature (a Polygon, or a MultiPolygon if it has several)
+    def shapes(self):
+        from shapely.geometry import Polygon, MultiPolygon
+        coords = np.asarray(self.coords)
+        ring_start, polygon_start = np.asarray(self.ring_start), np.asarray(self.polygon_start)
+        polygons = []
+        for i in range(len(polygon_start) - 1):
+            rings = [coords[ring_start[r]:ring_start[r + 1]] for r in range(polygon_start[i], polygon_start[i + 1])]
+            polygons.append(Polygon(rings[0], rings[1:]))
+        feature_start = np.asarray(self.feature_start)
+        return [polygons[feature_start[i]] if feature_start[i + 1] - feature_start[i] == 1
+                else MultiPolygon(polygons[feature_start[i]:feature_start[i + 1]]) for i in range(self.n_features)]
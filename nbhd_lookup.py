@@ -0,0 +1,161 @@
+# Reverse geocodes arrays of lon/lat points to NYC neighborhood / borough
+# Each polygon from the GeoJSON file is built only once, and a grid-bucket
+# index over the polygon bounding boxes limits the point-in-polygon tests
+# to the points that can actually fall inside each neighborhood
+# A point gets the first neighborhood (in file order) whose polygon contains it,
+# points outside every neighborhood get NaN
+import json, numpy as np
+from shapely.geometry import shape
+from nbhd_geometry import NbhdGeometry
+try:
+    from shapely import contains_xy
+except ImportError:
+    # shapely < 2.0
+    from shapely.vectorized import contains as contains_xy
+
+
+class NbhdLookup(object):
+
+    # polygons: shapely geometry of each neighborhood, borough / nbhd: their names
+    def __init__(self, polygons, borough, nbhd, cell_size=0.01):
+        self.polygons = list(polygons)
+        self.borough = np.asarray(borough, dtype=object)
+        self.nbhd = np.asarray(nbhd, dtype=object)
+        # polygon bounding boxes (minlon, minlat, maxlon, maxlat)
+        self.bounds = np.array([polygon.bounds for polygon in self.polygons])
+        self.cell_size = cell_size
+        self.min_lon = self.bounds[:, 0].min()
+        self.min_lat = self.bounds[:, 1].min()
+        self.n_cols = int((self.bounds[:, 2].max() - self.min_lon) // cell_size) + 1
+        self.n_rows = int((self.bounds[:, 3].max() - self.min_lat) // cell_size) + 1
+        # Range of grid cells covered by each polygon's bounding box
+        self.col_range = ((self.bounds[:, [0, 2]] - self.min_lon) // cell_size).astype(int)
+        self.row_range = ((self.bounds[:, [1, 3]] - self.min_lat) // cell_size).astype(int)
+
+    @classmethod
+    def from_features(cls, features, **kwargs):
+        return cls([shape(feature['geometry']) for feature in features],
+                   [feature['properties']['borough'] for feature in features],
+                   [feature['properties']['neighborhood'] for feature in features], **kwargs)
+
+    # Polygons from the packed arrays cached by nbhd_geometry.py (the JSON file is
+    # only parsed when it has changed)
+    @classmethod
+    def from_geojson(cls, path='nyc_neighborhoods.json', cache_dir=None, **kwargs):
+        geometry = NbhdGeometry.load(path, cache_dir)
+        return cls(geometry.shapes(), geometry.borough, geometry.nbhd, **kwargs)
+
+    # Returns the position of the containing polygon for each point (-1 if none)
+    def lookup_index(self, lon, lat):
+        lon = np.asarray(lon, dtype=float).ravel()
+        lat = np.asarray(lat, dtype=float).ravel()
+        idx = np.full(lon.shape[0], -1, dtype=np.intp)
+        col = (lon - self.min_lon) // self.cell_size
+        row = (lat - self.min_lat) // self.cell_size
+        # NaN coords fail these comparisons too
+        in_grid = (0 <= col) & (col < self.n_cols) & (0 <= row) & (row < self.n_rows)
+        pts = np.flatnonzero(in_grid)
+        if pts.shape[0] == 0:
+            return idx
+        # Bucket points by grid cell (row major), so each row of cells
+        # spanned by a bounding box is a contiguous slice of pts
+        cell = row[pts].astype(np.intp) * self.n_cols + col[pts].astype(np.intp)
+        order = np.argsort(cell, kind='mergesort')
+        pts = pts[order]
+        cell_start = np.searchsorted(cell[order], np.arange(self.n_rows * self.n_cols + 1))
+        for i, polygon in enumerate(self.polygons):
+            c0, c1 = self.col_range[i]
+            r0, r1 = self.row_range[i]
+            cand = np.concatenate([pts[cell_start[r * self.n_cols + c0]:cell_start[r * self.n_cols + c1 + 1]]
+                                   for r in range(r0, r1 + 1)])
+            # skip points already matched to an earlier polygon
+            cand = cand[idx[cand] < 0]
+            if cand.shape[0] == 0:
+                continue
+            hit = contains_xy(polygon, lon[cand], lat[cand])
+            idx[cand[hit]] = i
+        return idx
+
+    # Returns borough and neighborhood arrays (NaN where no polygon contains the point)
+    def lookup(self, lon, lat):
+        idx = self.lookup_index(lon, lat)
+        found = idx >= 0
+        borough = np.full(idx.shape[0], np.nan, dtype=object)
+        nbhd = np.full(idx.shape[0], np.nan, dtype=object)
+        borough[found] = self.borough[idx[found]]
+        nbhd[found] = self.nbhd[idx[found]]
+        return borough, nbhd
+
+
+# Neighborhood raster over the grid of rounded lon/lat coordinates
+# Cell (j, i) holds the position of the neighborhood containing the point
+# (lon0 + i, lat0 + j) / 10**num_dec, or -1 if it is not in any neighborhood
+# Saved as a .npy file (memory-mappable) plus a small JSON file of names
+class NbhdRaster(object):
+
+    def __init__(self, grid, num_dec, lon0, lat0, borough, nbhd):
+        self.grid = grid
+        self.num_dec = num_dec
+        self.scale = 10.0 ** num_dec
+        self.lon0 = lon0
+        self.lat0 = lat0
+        self.borough = np.asarray(borough, dtype=object)
+        self.nbhd = np.asarray(nbhd, dtype=object)
+
+    # Rasterizes the neighborhood polygons onto the rounded coordinate grid
+    # covering the min/max coords of all polygons
+    @classmethod
+    def from_lookup(cls, nbhd_lookup, num_dec=3):
+        scale = 10.0 ** num_dec
+        lon0 = int(np.ceil(nbhd_lookup.bounds[:, 0].min() * scale))
+        lon1 = int(np.floor(nbhd_lookup.bounds[:, 2].max() * scale))
+        lat0 = int(np.ceil(nbhd_lookup.bounds[:, 1].min() * scale))
+        lat1 = int(np.floor(nbhd_lookup.bounds[:, 3].max() * scale))
+        lon_grid, lat_grid = np.meshgrid(np.arange(lon0, lon1 + 1) / scale, np.arange(lat0, lat1 + 1) / scale)
+        grid = nbhd_lookup.lookup_index(lon_grid, lat_grid).astype(np.int16).reshape(lon_grid.shape)
+        return cls(grid, num_dec, lon0, lat0, nbhd_lookup.borough, nbhd_lookup.nbhd)
+
+    def save(self, path):
+        np.save(path + '.npy', self.grid)
+        with open(path + '.json', 'w') as f:
+            json.dump({'num_dec': self.num_dec, 'lon0': self.lon0, 'lat0': self.lat0,
+                       'borough': self.borough.tolist(), 'nbhd': self.nbhd.tolist()}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(path + '.json', 'r') as f:
+            meta = json.load(f)
+        grid = np.load(path + '.npy', mmap_mode='r' if mmap else None)
+        return cls(grid, meta['num_dec'], meta['lon0'], meta['lat0'], meta['borough'], meta['nbhd'])
+
+    # Position of the neighborhood for each point after rounding to num_dec (-1 if none)
+    def lookup_index(self, lon, lat):
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        i = np.rint(lon * self.scale) - self.lon0
+        j = np.rint(lat * self.scale) - self.lat0
+        n_lat, n_lon = self.grid.shape
+        # NaN coords fail these comparisons too
+        valid = (0 <= i) & (i < n_lon) & (0 <= j) & (j < n_lat)
+        idx = np.full(lon.shape, -1, dtype=np.intp)
+        idx[valid] = self.grid[j[valid].astype(np.intp), i[valid].astype(np.intp)]
+        return idx
+
+    def lookup(self, lon, lat):
+        idx = self.lookup_index(lon, lat)
+        found = idx >= 0
+        borough = np.full(idx.shape, np.nan, dtype=object)
+        nbhd = np.full(idx.shape, np.nan, dtype=object)
+        borough[found] = self.borough[idx[found]]
+        nbhd[found] = self.nbhd[idx[found]]
+        return borough, nbhd
+
+    # All grid points inside a neighborhood, in the same layout as pd_locs.pkl
+    def to_frame(self):
+        import pandas as pd
+        j, i = np.nonzero(np.asarray(self.grid) >= 0)
+        idx = np.asarray(self.grid)[j, i]
+        return pd.DataFrame({'rounded_lon': (i + self.lon0) / self.scale,
+                             'rounded_lat': (j + self.lat0) / self.scale,
+                             'borough': self.borough[idx],
+                             'nbhd': self.nbhd[idx]})[['rounded_lon', 'rounded_lat', 'borough', 'nbhd']]
@@ -4,8 +4,43 @@
 #################################################################
 #################################################################
 
-# Change this path to point to your top directory
-top_dir = 'C:/Users/Beatrice/Desktop/Taxi Analysis'
+import os
+# Change this path to point to your top directory (or set TAXI_TOP_DIR, as run_pipeline.py does)
+top_dir = os.environ.get('TAXI_TOP_DIR', 'C:/Users/Beatrice/Desktop/Taxi Analysis')
+# Parts to run: 'plots' (descriptive plots and tables, needs rpy2) and / or 'model'
+# (random forest, needs scikit-learn); each only imports what it needs, and the plot of
+# the model's predictions is only drawn with both
+sections = os.environ.get('TAXI_SECTIONS', 'plots,model').split(',')
+# Set to True to load the Parquet summaries from create_summary_data.py
+# (only the columns and years used below are read)
+use_parquet = False
+# Set to file (in the data directory) to log the loading / model fitting wall time,
+# rows and peak memory to (JSON lines, see pipeline_log.py), or None for no log
+log_file = 'pipeline_log.jsonl'
+# Set to True to draw the frames of the pickup animations as image arrays (see
+# pickup_frames.py) in n_workers processes, instead of one ggplot2 plot per frame
+fast_frames = True
+n_workers = 4
+# Set to True to also animate pickups by day of week and hour (pickups_hd), and by
+# date for each neighborhood (pickups_hdl, with nbhd_raster from find_pickup_dropoff_nbhds.py)
+more_movies = False
+# Set to a grid of pickups_pyramid.npz from create_summary_data.py (number of decimals:
+# 2, 3 or 4) to draw the hourly pickups movie from, over heatmap_extent (min lon,
+# max lon, min lat, max lat; None: all of NYC), each cell heatmap_scale pixels wide
+# None draws it from the rounded coords of pickups_hr (pickups in neighborhoods only)
+# (4 decimals over all of NYC makes frames ~ 4600 x 3700 pixels: zoom in with heatmap_extent)
+heatmap_dec = 3
+heatmap_extent = None
+heatmap_scale = 1
+# Random forest: number of parameter sets to search, processes to use (-1: all cores),
+# and whether to give each nbhd its own (sparse) feature column rather than one code
+n_candidates = 50
+n_jobs = -1
+one_hot_nbhds = False
+# Set to True to give the model lag and rolling mean features of each nbhd's pickups
+# (same hour yesterday / last week / 52 weeks ago, means over the last weeks, see
+# pickup_lags.py), which also loads the 2013 pickups for the lags of 2014
+lag_features = True
 
 #################################################################
 #################################################################
@@ -13,141 +48,193 @@ top_dir = 'C:/Users/Beatrice/Desktop/Taxi Analysis'
 #################################################################
 #################################################################
 
-import os, pandas as pd, numpy as np, random
-from rpy2 import robjects
-from rpy2.robjects.lib import ggplot2
-from rpy2.robjects import pandas2ri
-from tabulate import tabulate
-%load_ext rpy2.ipython
-%R require('ggplot2')
-pandas2ri.activate()
+import pandas as pd, numpy as np, random
+from pipeline_log import PipelineLog
+from summary_tables import read_pickups_hdl, fill_zeros
+from covariate_store import CovariateStore
+from summary_query import SummaryQuery
 # Set random seed
 random.seed(7)
 
 os.chdir(top_dir)
-pickups_hd = pd.read_csv('./data/pickups_hd.gz')
-pickups_hr = pd.read_csv('./data/pickups_hr.gz')
-pickups_hdl = pd.read_csv('./data/pickups_hdl.gz')
-pickups_hdl['date'] = pd.to_datetime(pickups_hdl.date, format='%Y-%m-%d')
-pickups_hdl['year'] = pickups_hdl.date.dt.year
-date_avgs = pd.read_csv('./data/date_avgs.gz')
+log = PipelineLog(log_file and './data/' + log_file, 'nyc_taxi_analysis')
+stage = log.begin('load')
+# Only 2010 and 2015 (percent change), 2014 and 2015 (model) of pickups_hdl are used
+# (and 2013 for the lag features)
+hdl_years = [2010, 2013, 2014, 2015] if lag_features and 'model' in sections else [2010, 2014, 2015]
+if use_parquet:
+    import trip_store
+    pickups_hd = trip_store.read_summary('./data/pickups_hd.parquet', 
+                                         columns=['rounded_lon', 'rounded_lat', 'day', 'hour', 'passenger_count', 
+                                                  'trip_time_in_secs', 'trip_distance', 'borough', 'nbhd'])
+    pickups_hr = trip_store.read_summary('./data/pickups_hr.parquet')
+    pickups_hdl = read_pickups_hdl('./data/pickups_hdl.parquet', years=hdl_years)
+    date_avgs = trip_store.read_summary('./data/date_avgs.parquet')
+else:
+    pickups_hd = pd.read_csv('./data/pickups_hd.gz')
+    pickups_hr = pd.read_csv('./data/pickups_hr.gz')
+    pickups_hdl = read_pickups_hdl('./data/pickups_hdl.gz', years=hdl_years)
+    date_avgs = pd.read_csv('./data/date_avgs.gz')
+# Weather and holidays by date (cleaned by create_summary_data.py), looked up below only for the model
+covariates = CovariateStore.load('./data/covariates.npz')
 date_avgs['date'] = pd.to_datetime(date_avgs.date, format='%Y-%m-%d')
 pd_locs = pd.read_pickle('./data/pd_locs.pkl')
 nbhd_borders = pd.read_pickle('./data/nbhd_borders.pkl')
-
-# Average speed by borough
-borough_speed = pickups_hd.groupby(['borough'])['trip_time_in_secs', 'trip_distance'].sum().reset_index()
-borough_speed['mph'] = 3600 * (borough_speed.trip_distance / borough_speed.trip_time_in_secs)
-borough_speed
-
-# Average speed by day, hour
-hour_speed = pickups_hd.groupby(['day', 'hour'])['trip_time_in_secs', 'trip_distance'].sum().reset_index()
-hour_speed['mph'] = 3600 * (hour_speed.trip_distance / hour_speed.trip_time_in_secs)
-hour_speed
+log.end(stage, rows_out=pickups_hd.shape[0] + pickups_hr.shape[0] + pickups_hdl.shape[0] + date_avgs.shape[0])
+
+if 'plots' in sections:
+    from rpy2 import robjects
+    from rpy2.robjects.lib import ggplot2
+    from rpy2.robjects import pandas2ri
+    from tabulate import tabulate
+    robjects.r('require(ggplot2)')
+    pandas2ri.activate()
+
+    # Group-by / filter queries on pickups_hd and pickups_hdl (see summary_query.py), with
+    # the groupings used below pre-summed
+    stage = log.begin('query_index', rows_in=pickups_hd.shape[0] + pickups_hdl.shape[0])
+    hd_query = SummaryQuery(pickups_hd, ['borough', 'nbhd', 'day', 'hour'],
+                            ['passenger_count', 'trip_time_in_secs', 'trip_distance'],
+                            rollups=[['borough'], ['day', 'hour'], ['nbhd', 'hour']])
+    hdl_query = SummaryQuery(pickups_hdl, ['borough', 'nbhd', 'date', 'hour'], ['passenger_count'],
+                             rollups=[['nbhd', 'borough', 'year']])
+    log.end(stage)
+
+    # Average speed by borough
+    borough_speed = hd_query.query('borough', measures=['trip_time_in_secs', 'trip_distance'])
+    borough_speed['mph'] = 3600 * (borough_speed.trip_distance / borough_speed.trip_time_in_secs)
+    borough_speed
+
+    # Average speed by day, hour
+    hour_speed = hd_query.query(['day', 'hour'], measures=['trip_time_in_secs', 'trip_distance'])
+    hour_speed['mph'] = 3600 * (hour_speed.trip_distance / hour_speed.trip_time_in_secs)
+    hour_speed
    
-# Pickups by hour (aggregated across all days)
-max_passenger_count = np.max(np.log1p(pickups_hr['passenger_count']))
-min_passenger_count = np.log1p(1)
-
-for i in range(0,24):
-        temp = pickups_hr[(pickups_hr.hour==i)].reset_index()
-        temp.passenger_count = np.log1p(temp.passenger_count)
-        temp_r = pandas2ri.py2ri(temp)
-        p = ggplot2.ggplot(temp_r) + \
-            ggplot2.aes_string(x='rounded_lon', y='rounded_lat', color='passenger_count') + \
-            ggplot2.geom_point(size=0.5) + \
-            ggplot2.scale_color_gradient(low='black', high='white', limits=np.array([min_passenger_count, max_passenger_count])) + \
-            ggplot2.xlim(-74.2, -73.7) + ggplot2.ylim(40.56, 40.93) + \
-            ggplot2.labs(x=' ', y=' ', title='NYC taxi pickups %02i:00' % i) + \
-            ggplot2.guides(color=False)
-        p.save('./plots/taxi_pickups%02i.png' % i, width=4, height=4.5)
+    # Pickups by hour (aggregated across all days)
+    if fast_frames:
+        from pickup_frames import render_frames, render_nbhd_frames, render_grids, save_gif
+        if heatmap_dec is not None:
+            from pickup_pyramid import GridPyramid, nyc_extent
+            stage = log.begin('pickups_movie', dec=heatmap_dec)
+            # (one hour's totals at a time, the finest grid over all of NYC is large)
+            hours, totals, cell_extent, peak = GridPyramid.load('./data/pickups_pyramid.npz').frames(
+                heatmap_dec, heatmap_extent or nyc_extent)
+            hours, frames = render_grids(totals, hours, heatmap_scale, title='NYC taxi pickups %02i:00', peak=peak,
+                                         n_workers=n_workers)
+        else:
+            stage = log.begin('pickups_movie', rows_in=pickups_hr.shape[0])
+            hours, frames = render_frames(pickups_hr, 'hour', title='NYC taxi pickups %02i:00', n_workers=n_workers)
+        save_gif(frames, './plots/pickups_movie.gif', duration=0.4)
+        log.end(stage, frames=len(frames))
+        if more_movies:
+            days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+            stage = log.begin('pickups_week_movie', rows_in=pickups_hd.shape[0])
+            keys, frames = render_frames(pickups_hd, ['day', 'hour'], n_workers=n_workers,
+                                         title=lambda x: 'NYC taxi pickups %s %02i:00' % (days[x[0]], x[1]))
+            save_gif(frames, './plots/pickups_week_movie.gif', duration=0.1)
+            log.end(stage, frames=len(frames))
+            from nbhd_lookup import NbhdRaster
+            stage = log.begin('pickups_date_movie', rows_in=pickups_hdl.shape[0])
+            keys, frames = render_nbhd_frames(pickups_hdl, NbhdRaster.load('./data/nbhd_raster'), 'date',
+                                              title='NYC taxi pickups %Y-%m-%d', n_workers=n_workers)
+            save_gif(frames, './plots/pickups_date_movie.gif', duration=0.1)
+            log.end(stage, frames=len(frames))
+    else:
+        max_passenger_count = np.max(np.log1p(pickups_hr['passenger_count']))
+        min_passenger_count = np.log1p(1)
+
+        for i in range(0,24):
+                temp = pickups_hr[(pickups_hr.hour==i)].reset_index()
+                temp.passenger_count = np.log1p(temp.passenger_count)
+                temp_r = pandas2ri.py2ri(temp)
+                p = ggplot2.ggplot(temp_r) + \
+                    ggplot2.aes_string(x='rounded_lon', y='rounded_lat', color='passenger_count') + \
+                    ggplot2.geom_point(size=0.5) + \
+                    ggplot2.scale_color_gradient(low='black', high='white', limits=np.array([min_passenger_count, max_passenger_count])) + \
+                    ggplot2.xlim(-74.2, -73.7) + ggplot2.ylim(40.56, 40.93) + \
+                    ggplot2.labs(x=' ', y=' ', title='NYC taxi pickups %02i:00' % i) + \
+                    ggplot2.guides(color=False)
+                p.save('./plots/taxi_pickups%02i.png' % i, width=4, height=4.5)
         
-# Create animated .gif of pickups by hour
-import imageio
-
-file_names = sorted((fn for fn in os.listdir('./plots') if fn.startswith('taxi_pickups')))
-file_names = ['plots/' + s for s in file_names]
-images = []
-for filename in file_names:
-    images.append(imageio.imread(filename))
-imageio.mimsave('./plots/pickups_movie.gif', images, duration=0.4)
-
-# total pickups by date, color
-p1 = ggplot2.ggplot(pandas2ri.py2ri(date_avgs)) + \
-ggplot2.aes_string(x='date', y='total_pickups', color='type') + \
-ggplot2.scale_colour_manual(values = robjects.StrVector(['green', 'yellow'])) + \
-ggplot2.geom_line() + \
-ggplot2.theme(legend_position='bottom') + \
-ggplot2.labs(y='Total Pickups', x='Date', title='Total Pickups by Date')
-p1.save('./plots/pickups_by_date.png', width=6, height=5)
-
-# average fare and tip by date, color
-p2 = ggplot2.ggplot(pandas2ri.py2ri(date_avgs)) + \
-ggplot2.aes_string(x='date', y='fare_amount', color='type') + \
-ggplot2.scale_colour_manual(values = robjects.StrVector(['green', 'yellow'])) + \
-ggplot2.geom_line() + \
-ggplot2.theme(legend_position='bottom') + \
-ggplot2.labs(y='Average Fare ($)', x='Date', title='Average Fare by Date')
-p2.save('./plots/fares_by_date.png', width=6, height=5)
-
-p3 = ggplot2.ggplot(pandas2ri.py2ri(date_avgs)) + \
-ggplot2.aes_string(x='date', y='tip_amount', color='type') + \
-ggplot2.scale_colour_manual(values = robjects.StrVector(['green', 'yellow'])) + \
-ggplot2.geom_line() + \
-ggplot2.theme(legend_position='bottom') + \
-ggplot2.labs(y='Average Tip ($)', x='Date', title='Average Tip by Date')
-p3.save('./plots/tips_by_date.png', width=6, height=5)
-
-# Plot late night % of pickups by neighborhood
-pickups_late = pd.merge(pickups_hd, pd_locs, 
-                        how='inner', on=['rounded_lon', 'rounded_lat', 'borough', 'nbhd'])
-
-# Group by late, not late in each neighborhood
-pickups_late['period'] = np.where(pickups_late['hour'].isin([22, 23, 0, 1, 2]), 'late', 'not late')
-pickups_late = pickups_late.groupby(['nbhd', 'period'])['passenger_count'].sum().reset_index()
-
-temp_perc = pickups_late.groupby(['nbhd'])['passenger_count'].apply(lambda x: 100*x/float(x.sum())).reset_index()
-temp_perc = temp_perc.rename(columns={'passenger_count':'relative_percent'})
-pickups_late = pd.concat([pickups_late, temp_perc['relative_percent']], axis=1)
-pickups_late = pickups_late[pickups_late['period'] == 'late']
-pickups_late = pd.merge(pickups_late, nbhd_borders, how='right', on=['nbhd']).dropna()
-
-# Find top 10 neighborhoods with largest late night % of pickups
-print(tabulate(pickups_late[['relative_percent', 'nbhd', 
-                             'borough']].drop_duplicates().sort(['relative_percent'], ascending=False).head(10), 
-                             tablefmt='pipe', headers='keys', showindex=False))
-
-p4 = ggplot2.ggplot(pandas2ri.py2ri(pickups_late)) + \
-ggplot2.aes_string(x='lon', y='lat', group='nbhd', fill='relative_percent') + \
-ggplot2.geom_polygon() + \
-ggplot2.theme(legend_position='bottom') + \
-ggplot2.labs(x='', y='', title='Late Night Pickups (% of All Pickups)')
-p4.save('./plots/late_night_pickups.png', width=5, height=6)
-
-# Plot % change (2010 to 2015) in pickups by neighborhood
-pickups_change = pickups_hdl.groupby(['nbhd', 'borough', 'year'])['passenger_count'].sum().reset_index()
-pickups_change = pickups_change[pickups_change['year'].isin([2010, 2015])].reset_index()
-pickups_change = pickups_change.sort_values(['nbhd', 'year']).reset_index()
-temp_change = pickups_change.groupby(['nbhd'])['passenger_count'].apply(lambda x: x.pct_change()).reset_index()
-temp_change = temp_change.rename(columns={'passenger_count':'percent_change'})
-pickups_change = pd.concat([pickups_change, temp_change['percent_change']], axis=1)
-pickups_change = pickups_change.dropna()
-
-# Find top 10 neighborhoods with largest percent change
-print(tabulate(pickups_change[['percent_change', 'nbhd', 
-                               'borough']].drop_duplicates().sort(['percent_change'], ascending=False).head(10), 
-                               tablefmt='pipe', headers='keys', showindex=False))
-
-pickups_change['percent_change'] = np.log1p(pickups_change['percent_change'] + abs(min(pickups_change['percent_change'])))
-pickups_change = pd.merge(pickups_change, nbhd_borders, how='right', on=['nbhd']).dropna()
-
-p5 = ggplot2.ggplot(pandas2ri.py2ri(pickups_change)) + \
-ggplot2.aes_string(x='lon', y='lat', group='nbhd', fill='percent_change') + \
-ggplot2.geom_polygon() + \
-ggplot2.scale_fill_gradient(low='blue', high='green') + \
-ggplot2.theme(legend_position='bottom') + \
-ggplot2.labs(x='', y='', title='Change In Annual # of Pickups (2010 - 2015)', fill='Percent Change\n(Log-Scale)')
-p5.save('./plots/2010_2015_percent_change.png', width=5, height=6)
+        # Create animated .gif of pickups by hour
+        import imageio
+
+        file_names = sorted((fn for fn in os.listdir('./plots') if fn.startswith('taxi_pickups')))
+        file_names = ['plots/' + s for s in file_names]
+        images = []
+        for filename in file_names:
+            images.append(imageio.imread(filename))
+        imageio.mimsave('./plots/pickups_movie.gif', images, duration=0.4)
+
+    # total pickups by date, color
+    p1 = ggplot2.ggplot(pandas2ri.py2ri(date_avgs)) + \
+    ggplot2.aes_string(x='date', y='total_pickups', color='type') + \
+    ggplot2.scale_colour_manual(values = robjects.StrVector(['green', 'yellow'])) + \
+    ggplot2.geom_line() + \
+    ggplot2.theme(legend_position='bottom') + \
+    ggplot2.labs(y='Total Pickups', x='Date', title='Total Pickups by Date')
+    p1.save('./plots/pickups_by_date.png', width=6, height=5)
+
+    # average fare and tip by date, color
+    p2 = ggplot2.ggplot(pandas2ri.py2ri(date_avgs)) + \
+    ggplot2.aes_string(x='date', y='fare_amount', color='type') + \
+    ggplot2.scale_colour_manual(values = robjects.StrVector(['green', 'yellow'])) + \
+    ggplot2.geom_line() + \
+    ggplot2.theme(legend_position='bottom') + \
+    ggplot2.labs(y='Average Fare ($)', x='Date', title='Average Fare by Date')
+    p2.save('./plots/fares_by_date.png', width=6, height=5)
+
+    p3 = ggplot2.ggplot(pandas2ri.py2ri(date_avgs)) + \
+    ggplot2.aes_string(x='date', y='tip_amount', color='type') + \
+    ggplot2.scale_colour_manual(values = robjects.StrVector(['green', 'yellow'])) + \
+    ggplot2.geom_line() + \
+    ggplot2.theme(legend_position='bottom') + \
+    ggplot2.labs(y='Average Tip ($)', x='Date', title='Average Tip by Date')
+    p3.save('./plots/tips_by_date.png', width=6, height=5)
+
+    # Plot late night % of pickups by neighborhood
+    # Late night (10pm to 3am) and all pickups in each neighborhood
+    pickups_late = hd_query.query('nbhd', where={'hour': [22, 23, 0, 1, 2]}, measures='passenger_count')
+    nbhd_totals = hd_query.query('nbhd', measures='passenger_count')
+    pickups_late = pd.merge(pickups_late, nbhd_totals, how='inner', on=['nbhd'], suffixes=('', '_total'))
+    pickups_late['relative_percent'] = 100 * pickups_late.passenger_count / pickups_late.passenger_count_total.astype(float)
+    pickups_late = pd.merge(pickups_late, nbhd_borders, how='right', on=['nbhd']).dropna()
+
+    # Find top 10 neighborhoods with largest late night % of pickups
+    print(tabulate(pickups_late[['relative_percent', 'nbhd', 
+                                 'borough']].drop_duplicates().sort(['relative_percent'], ascending=False).head(10), 
+                                 tablefmt='pipe', headers='keys', showindex=False))
+
+    p4 = ggplot2.ggplot(pandas2ri.py2ri(pickups_late)) + \
+    ggplot2.aes_string(x='lon', y='lat', group='polygon', subgroup='ring', fill='relative_percent') + \
+    ggplot2.geom_polygon() + \
+    ggplot2.theme(legend_position='bottom') + \
+    ggplot2.labs(x='', y='', title='Late Night Pickups (% of All Pickups)')
+    p4.save('./plots/late_night_pickups.png', width=5, height=6)
+
+    # Plot % change (2010 to 2015) in pickups by neighborhood
+    pickups_change = hdl_query.query(['nbhd', 'borough', 'year'], where={'year': [2010, 2015]})
+    pickups_change = pickups_change.sort_values(['nbhd', 'year']).reset_index()
+    temp_change = pickups_change.groupby(['nbhd'])['passenger_count'].apply(lambda x: x.pct_change()).reset_index()
+    temp_change = temp_change.rename(columns={'passenger_count':'percent_change'})
+    pickups_change = pd.concat([pickups_change, temp_change['percent_change']], axis=1)
+    pickups_change = pickups_change.dropna()
+
+    # Find top 10 neighborhoods with largest percent change
+    print(tabulate(pickups_change[['percent_change', 'nbhd', 
+                                   'borough']].drop_duplicates().sort(['percent_change'], ascending=False).head(10), 
+                                   tablefmt='pipe', headers='keys', showindex=False))
+
+    pickups_change['percent_change'] = np.log1p(pickups_change['percent_change'] + abs(min(pickups_change['percent_change'])))
+    pickups_change = pd.merge(pickups_change, nbhd_borders, how='right', on=['nbhd']).dropna()
+
+    p5 = ggplot2.ggplot(pandas2ri.py2ri(pickups_change)) + \
+    ggplot2.aes_string(x='lon', y='lat', group='polygon', subgroup='ring', fill='percent_change') + \
+    ggplot2.geom_polygon() + \
+    ggplot2.scale_fill_gradient(low='blue', high='green') + \
+    ggplot2.theme(legend_position='bottom') + \
+    ggplot2.labs(x='', y='', title='Change In Annual # of Pickups (2010 - 2015)', fill='Percent Change\n(Log-Scale)')
+    p5.save('./plots/2010_2015_percent_change.png', width=5, height=6)
 
 
 #################################################################
@@ -156,105 +243,107 @@ p5.save('./plots/2010_2015_percent_change.png', width=5, height=6)
 #################################################################
 #################################################################
 
-# Do some quick benchmarks (predict 2015 from 2014 data)
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import RandomizedSearchCV
-from scipy.stats import randint as sp_randint
-from sklearn.metrics import mean_squared_error, r2_score
-
-pickups_14_15 = pickups_hdl[pickups_hdl['year'].isin([2014, 2015])]
-
-# Data cleaning
-# Remove NAs and non-informative data
-pickups_14_15_col_names = pickups_14_15.columns.values.tolist()
-pickups_14_15.columns = [x.strip(' ') for x in pickups_14_15_col_names]
-pickups_14_15['PrecipitationIn'] = pickups_14_15.PrecipitationIn.str.replace('T', '0')
-pickups_14_15.PrecipitationIn = pickups_14_15.PrecipitationIn.apply(pd.to_numeric, errors='coerce')
-pickups_14_15.drop(['Unnamed: 0', 'CloudCover', 'Events', 'WindDirDegrees'], axis=1, inplace=True)
-pickups_14_15.dropna(inplace=True)
-
-# Find invalid dates in both 2014 and 2015 (those without weather info)
-dates_2014 = pickups_14_15[pickups_14_15.year == 2014].date.apply(lambda x: x.strftime('%m-%d'))  
-dates_2015 = pickups_14_15[pickups_14_15.year == 2015].date.apply(lambda x: x.strftime('%m-%d'))  
-dates_intersect = set.intersection(set(dates_2014), set(dates_2015))
-pickups_14_15 = pickups_14_15[pickups_14_15.date.apply(lambda x: x.strftime('%m-%d')).isin(dates_intersect)]
-pickups_14_15 = pickups_14_15.sort_values(['nbhd', 'date', 'hour']).reset_index()
-
-# Check MSE and R^2 of naive approach
-mean_squared_error(pickups_14_15[pickups_14_15.year == 2014]['passenger_count'], 
-                   pickups_14_15[pickups_14_15.year == 2015]['passenger_count'])
-
-r2_score(pickups_14_15[pickups_14_15.year == 2014]['passenger_count'], 
-                   pickups_14_15[pickups_14_15.year == 2015]['passenger_count'])
-
-# Split data into train/test by year
-pickups_14_15['day_of_week'] = pickups_14_15['day_of_week'].apply(str)
-pickups_14_15['hour'] = pickups_14_15['hour'].apply(str)
-pickups_14_15['month'] = pickups_14_15['month'].apply(str)
-
-# Create training data (2014)
-X_train = pickups_14_15[pickups_14_15['year'] == 2014]
-Y_train = X_train['passenger_count']
-X_train.drop(['date', 'passenger_count', 'year'], axis=1, inplace=True)
-X_train = pd.get_dummies(X_train)
-
-# Try random forest model, randomized search for optimal parameters
-rf = RandomForestRegressor()
-# Specify parameters and distributions to sample from
-param_dist = {'n_estimators': sp_randint(1, 101),
-              'max_depth': [1, 2, 3, None],
-              'max_features': sp_randint(1, X_train.shape[1]),
-              'min_samples_split': sp_randint(1, 11),
-              'min_samples_leaf': sp_randint(1, 11),
-              'bootstrap': [True, False]}
-
-# Run randomized search
-# Try it on subset of training data to speed up search
-sample_index = X_train.sample(50000).index
-n_iter_search = 50
-random_search = RandomizedSearchCV(rf, param_distributions=param_dist, n_iter=n_iter_search)
-random_search.fit(X_train.ix[sample_index], Y_train.ix[sample_index])
-random_search.best_params_
-
-# Create test data (2015)
-X_test = pickups_14_15[pickups_14_15['year'] == 2015]
-Y_test = X_test['passenger_count']
-X_test.drop(['date', 'passenger_count', 'year'], axis=1, inplace=True)
-X_test = pd.get_dummies(X_test)
-
-# Use 'best' parameters from the random_search output
-# to train the full 2014 data
-rf = RandomForestRegressor(n_estimators=random_search.best_params_['n_estimators'], 
-                           max_depth=random_search.best_params_['max_depth'], 
-                           max_features=random_search.best_params_['max_features'], 
-                           min_samples_leaf=random_search.best_params_['min_samples_leaf'], 
-                           min_samples_split=random_search.best_params_['min_samples_split'], 
-                           bootstrap=random_search.best_params_['bootstrap'])
-rf.fit(X_train, Y_train)
-
-# Check MSE and R^2 of RF approach
-mean_squared_error(Y_test, rf.predict(X_test))
-r2_score(Y_test, rf.predict(X_test))
-
-# Prepare the RF output to be plotted
-pickups_2015_actual = pickups_14_15[pickups_14_15['year'] == 2015][['borough', 'nbhd', 'date', 'hour', 'passenger_count']]
-pickups_2015_pred = pickups_2015_actual.copy()
-pickups_2015_pred['passenger_count'] = rf.predict(X_test)
-pickups_2015_actual['type'] = 'actual'
-pickups_2015_pred['type'] = 'predicted'
-pickups_2015 = pd.concat([pickups_2015_actual, pickups_2015_pred], axis=0)
-pickups_2015 = pickups_2015.groupby(['borough', 'nbhd', 'date', 'type'])['passenger_count'].sum().reset_index()
-# Pick a random date to look at
-pickups_2015 = pickups_2015[pickups_2015['date'] == '2015-05-07']
-pickups_2015 = pd.merge(pickups_2015, nbhd_borders, how='right', on=['nbhd']).dropna()
-pickups_2015['passenger_count'] = np.log1p(pickups_2015['passenger_count'])
-
-# Plot actual vs. predicted
-p6 = ggplot2.ggplot(pandas2ri.py2ri(pickups_2015)) + \
-ggplot2.aes_string(x='lon', y='lat', group='nbhd', fill='passenger_count') + \
-ggplot2.geom_polygon() + \
-ggplot2.facet_wrap(robjects.Formula('~ type')) + \
-ggplot2.scale_fill_gradient(low='yellow', high='red') + \
-ggplot2.theme(legend_position='bottom') + \
-ggplot2.labs(x='', y='', title='Actual vs. Expected Total Passengers on 5-7-2015', fill='Passenger Count\n(Log-Scale)')
-p6.save('./plots/actual_pred_pickups.png', width=7, height=5)
\ No newline at end of file
+if 'model' in sections:
+    # Do some quick benchmarks (predict 2015 from 2014 data)
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.metrics import mean_squared_error, r2_score
+    from pickup_model import feature_matrix, search, fit, evaluate
+    from pickup_service import PickupForecaster
+
+    pickups_14_15 = pickups_hdl[pickups_hdl['year'].isin([2014, 2015])]
+    # Fill in zero pickups for every nbhd / date / hour (if pickups_hdl was saved without them,
+    # see fill_hdl in create_summary_data.py; otherwise nothing changes)
+    pickups_14_15 = fill_zeros(pickups_14_15, nbhds=pickups_hdl[['borough', 'nbhd']].drop_duplicates())
+    # Add the weather columns by date from the covariate store (already cleaned: numbers,
+    # 'T' precipitation as 0), in place of any saved on pickups_hdl (compact_hdl = False
+    # in create_summary_data.py)
+    pickups_14_15.columns = [x.strip(' ') for x in pickups_14_15.columns]
+    pickups_14_15 = pickups_14_15.drop(['Unnamed: 0', 'Events'] + [x for x in covariates.columns if x != 'holiday'],
+                                       axis=1, errors='ignore')
+    # (leaving out non-informative data)
+    weather_cols = [x for x in covariates.columns if x not in ('holiday', 'CloudCover', 'WindDirDegrees')]
+    pickups_14_15 = covariates.join(pickups_14_15, cols=weather_cols)
+
+    # Data cleaning
+    # Remove NAs (dates without weather)
+    pickups_14_15.dropna(inplace=True)
+
+    # Find invalid dates in both 2014 and 2015 (those without weather info)
+    # (month / day as one number, month * 100 + day)
+    month_day = (pickups_14_15.date.dt.month * 100 + pickups_14_15.date.dt.day).values
+    dates_intersect = np.intersect1d(month_day[(pickups_14_15.year == 2014).values],
+                                     month_day[(pickups_14_15.year == 2015).values])
+    pickups_14_15 = pickups_14_15[np.isin(month_day, dates_intersect)]
+    pickups_14_15 = pickups_14_15.sort_values(['nbhd', 'date', 'hour']).reset_index()
+
+    # Check MSE and R^2 of naive approach
+    mean_squared_error(pickups_14_15[pickups_14_15.year == 2014]['passenger_count'], 
+                       pickups_14_15[pickups_14_15.year == 2015]['passenger_count'])
+
+    r2_score(pickups_14_15[pickups_14_15.year == 2014]['passenger_count'], 
+                       pickups_14_15[pickups_14_15.year == 2015]['passenger_count'])
+
+    # Lag / rolling mean features of each row, from the dense nbhd x date x hour counts
+    # (trees split the missing lags, -1, off from the rest)
+    lags = None
+    if lag_features:
+        from pickup_lags import LagFeatures
+        stage = log.begin('lag_features', rows_in=pickups_14_15.shape[0])
+        lags = LagFeatures.from_frame(pickups_hdl[pickups_hdl['year'].isin([2013, 2014, 2015])],
+                                      nbhds=pickups_hdl[['borough', 'nbhd']].drop_duplicates())
+        pickups_14_15 = lags.add_features(pickups_14_15, fill=-1)
+        log.end(stage, dates=lags.n_dates)
+
+    # Features for the 2014 (training) and 2015 (test) rows, built together so the
+    # nbhd codes agree (see pickup_model.py)
+    X, feature_names = feature_matrix(pickups_14_15, one_hot=one_hot_nbhds)
+    train = (pickups_14_15['year'] == 2014).values
+    X_train, Y_train = X[train], pickups_14_15['passenger_count'].values[train]
+    X_test, Y_test = X[~train], pickups_14_15['passenger_count'].values[~train]
+
+    # Try random forest model, search for optimal parameters by successive halving
+    # (candidates tried on a sample first, the best ones on up to the full 2014 data),
+    # n_jobs candidates fitted at once
+    stage = log.begin('model_search', rows_in=X_train.shape[0], n_features=X_train.shape[1], n_candidates=n_candidates)
+    random_search = search(X_train, Y_train, n_candidates, n_jobs=n_jobs)
+    log.end(stage, best_score=random_search.best_score_)
+    random_search.best_params_
+
+    # Use 'best' parameters from the search output
+    # to train the full 2014 data
+    rf = RandomForestRegressor(n_jobs=n_jobs, **random_search.best_params_)
+    stage = log.begin('model_fit', rows_in=X_train.shape[0], n_features=X_train.shape[1])
+    rf, fit_seconds = fit(rf, X_train, Y_train)
+    # Check MSE and R^2 of RF approach (predicting 2015)
+    pred_2015, rf_scores = evaluate(rf, X_test, Y_test)
+    log.end(stage, fit_seconds=fit_seconds, **rf_scores)
+    rf_scores
+
+    # Save the fitted model with its feature encoding, for forecasts on demand
+    # (python pickup_service.py data/pickup_model.pkl)
+    PickupForecaster.from_training(rf, pickups_14_15, feature_names, covariates, lags).save('./data/pickup_model.pkl')
+
+    # Plot actual vs. predicted (only with the plots: rpy2 is imported there, so the
+    # model alone only needs scikit-learn)
+    if 'plots' in sections:
+        # Prepare the RF output to be plotted
+        pickups_2015_actual = pickups_14_15[pickups_14_15['year'] == 2015][['borough', 'nbhd', 'date', 'hour', 'passenger_count']]
+        pickups_2015_pred = pickups_2015_actual.copy()
+        pickups_2015_pred['passenger_count'] = pred_2015
+        pickups_2015_actual['type'] = 'actual'
+        pickups_2015_pred['type'] = 'predicted'
+        pickups_2015 = pd.concat([pickups_2015_actual, pickups_2015_pred], axis=0)
+        pickups_2015 = pickups_2015.groupby(['borough', 'nbhd', 'date', 'type'], observed=True)['passenger_count'].sum().reset_index()
+        # Pick a random date to look at
+        pickups_2015 = pickups_2015[pickups_2015['date'] == '2015-05-07']
+        pickups_2015 = pd.merge(pickups_2015, nbhd_borders, how='right', on=['nbhd']).dropna()
+        pickups_2015['passenger_count'] = np.log1p(pickups_2015['passenger_count'])
+
+        p6 = ggplot2.ggplot(pandas2ri.py2ri(pickups_2015)) + \
+        ggplot2.aes_string(x='lon', y='lat', group='polygon', subgroup='ring', fill='passenger_count') + \
+        ggplot2.geom_polygon() + \
+        ggplot2.facet_wrap(robjects.Formula('~ type')) + \
+        ggplot2.scale_fill_gradient(low='yellow', high='red') + \
+        ggplot2.theme(legend_position='bottom') + \
+        ggplot2.labs(x='', y='', title='Actual vs. Expected Total Passengers on 5-7-2015', fill='Passenger Count\n(Log-Scale)')
+        p6.save('./plots/actual_pred_pickups.png', width=7, height=5)
\ No newline at end of file
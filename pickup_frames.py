@@ -0,0 +1,196 @@
+# Frames of the pickup animations in nyc_taxi_analysis.py, drawn straight into image
+# arrays instead of through ggplot2 and PNG files
+# Each rounded coordinate (num_dec digits) is one pixel of the frame, so a frame is
+# the pickups of one group (hour, day and hour, ...) summed into a lat x lon grid with
+# np.bincount, then shaded on a log scale from black (no pickups) to white, with the
+# same scale for every frame so they can be compared
+# Frames are drawn in a pool of worker processes and the GIF is encoded from the arrays
+# For animations by date, render_nbhd_frames shades whole neighborhoods through the
+# neighborhood raster (nbhd_raster.npy, see nbhd_lookup.NbhdRaster) from pickups_hdl
+# render_grids shades totals already summed into grids (e.g. a window of the pickups
+# pyramid, see pickup_pyramid.py)
+import io
+from itertools import islice
+from multiprocessing import Pool
+import numpy as np, pandas as pd
+from pickup_pyramid import nyc_extent
+
+
+# Shades a lat x lon grid of totals on a log scale (log1p, clipped to vmin / vmax)
+# as an 8 bit grayscale image, north up, each cell as a scale x scale block of pixels
+def shade(totals, vmin, vmax, scale=1):
+    values = (np.log1p(totals) - vmin) / float(vmax - vmin)
+    image = np.where(totals > 0, np.rint(255 * np.clip(values, 0, 1)), 0).astype(np.uint8)[::-1]
+    if scale > 1:
+        image = np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+    return image
+
+
+# Sums values at each point into the grid of rounded coordinates covering extent
+# Points outside extent are left out
+def bin_points(lon, lat, values, extent=nyc_extent, num_dec=3):
+    grid_scale = 10.0 ** num_dec
+    lon0, lat0 = int(np.ceil(extent[0] * grid_scale)), int(np.ceil(extent[2] * grid_scale))
+    n_lon = int(np.floor(extent[1] * grid_scale)) - lon0 + 1
+    n_lat = int(np.floor(extent[3] * grid_scale)) - lat0 + 1
+    i = np.rint(np.asarray(lon, dtype=float) * grid_scale) - lon0
+    j = np.rint(np.asarray(lat, dtype=float) * grid_scale) - lat0
+    keep = (0 <= i) & (i < n_lon) & (0 <= j) & (j < n_lat)
+    cells = j[keep].astype(np.intp) * n_lon + i[keep].astype(np.intp)
+    totals = np.bincount(cells, weights=np.asarray(values, dtype=float)[keep], minlength=n_lat * n_lon)
+    return totals.reshape(n_lat, n_lon)
+
+
+# Writes text (a title) onto the top left of a grayscale image
+def add_title(image, text):
+    from PIL import Image, ImageDraw
+    img = Image.fromarray(image)
+    ImageDraw.Draw(img).text((4, 2), text, fill=255)
+    return np.asarray(img)
+
+
+# Label of a group key: title % key (key is a tuple when grouping by several columns),
+# key.strftime(title) for dates, or title(key) if title is a function
+def _title(title, key):
+    if callable(title):
+        return title(key)
+    if isinstance(key, pd.Timestamp):
+        return key.strftime(title)
+    return title % key
+
+
+def _render_points(positions, label):
+    lon, lat, values, extent, num_dec, vmin, vmax, scale = _frame_args
+    image = shade(bin_points(lon[positions], lat[positions], values[positions], extent, num_dec), vmin, vmax, scale)
+    return add_title(image, label) if label else image
+
+
+def _render_nbhds(positions, label):
+    grid, nbhd_idx, values, n_nbhds, vmin, vmax, scale = _frame_args
+    totals = np.bincount(nbhd_idx[positions], weights=values[positions], minlength=n_nbhds + 1)
+    # the last total (cells outside all nbhds) is always 0
+    totals[n_nbhds] = 0
+    image = shade(totals[grid], vmin, vmax, scale)
+    return add_title(image, label) if label else image
+
+
+def _init_worker(args):
+    global _frame_args
+    _frame_args = args
+
+
+def _render_worker(job):
+    render, positions, label = job
+    return render(positions, label)
+
+
+# Draws one frame per group (positions of its rows, in key order) with render, using
+# a pool of n_workers processes if n_workers > 1
+# (labels are made here, so title can be a function even when the workers are spawned)
+def _render_groups(render, args, groups, title, n_workers):
+    jobs = [(render, groups[x], _title(title, x) if title else None) for x in sorted(groups)]
+    if n_workers <= 1:
+        _init_worker(args)
+        return [_render_worker(x) for x in jobs]
+    pool = Pool(n_workers, initializer=_init_worker, initargs=(args,))
+    try:
+        images = pool.map(_render_worker, jobs)
+    except BaseException:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return images
+
+
+# Log scale limits for frames of totals: from 1 pickup to the largest total
+def _limits(totals):
+    return np.log1p(1), np.log1p(max(totals.max() if len(totals) else 0, 2))
+
+
+# One frame for each value of by (a column or list of columns, e.g. 'hour' of
+# pickups_hr or ['day', 'hour'] of pickups_hd), sorted by that value, from the col
+# totals at each rounded coordinate (one row per value of by and coordinate, as in the
+# summary tables)
+# title: format string for each frame's label (e.g. 'NYC taxi pickups %02i:00'), function
+# of the value, or None for no labels
+# Returns the keys and the frames (2D uint8 arrays)
+def render_frames(frame, by, col='passenger_count', lon='rounded_lon', lat='rounded_lat', extent=nyc_extent,
+                  num_dec=3, scale=1, title=None, n_workers=1):
+    groups = frame.groupby(by, sort=True, observed=True).indices
+    lon, lat, values = frame[lon].values, frame[lat].values, frame[col].values.astype(float)
+    # same color scale for all frames, up to the largest total at any coordinate
+    vmin, vmax = _limits(values)
+    args = (lon, lat, values, extent, num_dec, vmin, vmax, scale)
+    return sorted(groups), _render_groups(_render_points, args, groups, title, n_workers)
+
+
+# One frame for each value of by (e.g. 'date' of pickups_hdl), with each neighborhood
+# shaded by its col total, through a NbhdRaster (north up, one pixel per raster cell)
+# Returns the keys and the frames (2D uint8 arrays)
+def render_nbhd_frames(frame, nbhd_raster, by='date', col='passenger_count', scale=1, title=None, n_workers=1):
+    # raster cells hold polygon positions, and a nbhd can have several polygons
+    polygon_nbhd, names = pd.MultiIndex.from_arrays([nbhd_raster.borough, nbhd_raster.nbhd]).factorize()
+    nbhd_idx = names.get_indexer(pd.MultiIndex.from_frame(frame[['borough', 'nbhd']].astype(object)))
+    n_nbhds = len(names)
+    # rows and raster cells outside the raster's nbhds go to an extra (always 0) total
+    nbhd_idx[nbhd_idx < 0] = n_nbhds
+    # (cells outside all polygons are -1, so take the last entry)
+    grid = np.append(polygon_nbhd, n_nbhds)[np.asarray(nbhd_raster.grid)]
+    values = frame[col].values.astype(float)
+    grouped = frame.groupby(by, sort=True, observed=True)
+    groups = grouped.indices
+    # same color scale for all frames, up to the largest nbhd total in any frame
+    totals = np.bincount(grouped.ngroup().values * (n_nbhds + 1) + nbhd_idx, weights=values,
+                         minlength=len(groups) * (n_nbhds + 1))
+    vmin, vmax = _limits(totals.reshape(-1, n_nbhds + 1)[:, :n_nbhds].ravel())
+    args = (grid, nbhd_idx, values, n_nbhds, vmin, vmax, scale)
+    return sorted(groups), _render_groups(_render_nbhds, args, groups, title, n_workers)
+
+
+def _render_grid(job):
+    totals, label = job
+    vmin, vmax, scale = _frame_args
+    image = shade(totals, vmin, vmax, scale)
+    return add_title(image, label) if label else image
+
+
+# One frame for each grid of totals (keys x lat x lon array, or an iterable of lat x lon
+# arrays, lat increasing, e.g. from pickup_pyramid.GridPyramid.window / frames), with the
+# same color scale for all: up to peak (the largest total), by default found in totals
+# With n_workers > 1 the grids are shaded in a pool of processes, n_workers grids at a
+# time (so no more grids than that are held at once when totals is an iterator)
+# Returns the keys and the frames (2D uint8 arrays)
+def render_grids(totals, keys, scale=1, title=None, peak=None, n_workers=1):
+    vmin, vmax = _limits(np.ravel(totals) if peak is None else np.array([peak]))
+    jobs = zip(totals, [_title(title, x) if title else None for x in keys])
+    if n_workers <= 1:
+        _init_worker((vmin, vmax, scale))
+        return list(keys), [_render_grid(x) for x in jobs]
+    pool = Pool(n_workers, initializer=_init_worker, initargs=((vmin, vmax, scale),))
+    images = []
+    try:
+        while True:
+            batch = list(islice(jobs, n_workers))
+            if not batch:
+                break
+            images.extend(pool.map(_render_grid, batch))
+    except BaseException:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return list(keys), images
+
+
+# GIF of the frames, encoded in memory (returns the bytes)
+def gif_bytes(images, duration=0.4):
+    import imageio
+    buf = io.BytesIO()
+    imageio.mimsave(buf, images, format='GIF', duration=duration)
+    return buf.getvalue()
+
+
+def save_gif(images, path, duration=0.4):
+    with open(path, 'wb') as f:
+        f.write(gif_bytes(images, duration))
@@ -0,0 +1,152 @@
+# Lag and seasonal features of pickups by nbhd / date / hour, for the model in
+# nyc_taxi_analysis.py and the forecasts of pickup_service.py
+# The counts are kept as a dense nbhd x date x hour array (see summary_tables.pickups_hdl_cube)
+# over consecutive days, so the same hour k days earlier is k places back along the date
+# axis, and a rolling mean over w days is the difference of the running sums (cumsum
+# along the dates) w places apart: every feature of any set of (nbhd, date, hour) cells
+# is a few array lookups, with no lining up of rows by date
+# A feature of a date only uses the pickups of earlier dates, so the features of a day
+# are known as soon as the day before is in; features that reach back before the first
+# date, or to dates without data, are NaN
+# append adds new dates after the last one, only extending the arrays by the new dates
+import numpy as np, pandas as pd
+from summary_tables import pickups_hdl_cube
+
+# Same hour k days earlier: yesterday, last week, and 52 weeks ago (same day of week)
+lag_days = {'lag_1d': 1, 'lag_1w': 7, 'lag_1y': 364}
+# Mean of the same hour over the last w days
+mean_days = {'mean_1w': 7, 'mean_4w': 28}
+# Mean pickups per hour (all hours) over the last w days
+daily_mean_days = {'daily_mean_1w': 7}
+
+
+class LagFeatures(object):
+
+    # counts: nbhds x dates x hours array, for consecutive dates from start
+    # nbhds: table of the borough / nbhd pairs along the first axis
+    # observed: which dates have data (default: all)
+    def __init__(self, counts, nbhds, start, observed=None):
+        self.nbhds = nbhds[['borough', 'nbhd']].reset_index(drop=True)
+        self.nbhd_index = pd.MultiIndex.from_frame(self.nbhds.astype(object))
+        self.start = pd.Timestamp(start).normalize()
+        self.n_nbhds, self.n_hours = counts.shape[0], counts.shape[2]
+        self.n_dates = 0
+        # running sums before each date (one more entry than dates), by hour and by day,
+        # and number of dates without data before each date
+        self.counts = np.zeros((self.n_nbhds, 0, self.n_hours), dtype=counts.dtype)
+        self.sums = np.zeros((self.n_nbhds, 1, self.n_hours), dtype=np.int64)
+        self.day_sums = np.zeros((self.n_nbhds, 1), dtype=np.int64)
+        self.missing = np.zeros(1, dtype=np.int64)
+        self._extend(counts, np.ones(counts.shape[1], dtype=bool) if observed is None else np.asarray(observed))
+
+    # From a table of pickups by nbhd / date / hour (as pickups_hdl, with or without the
+    # zero counts), over every date from its first to its last
+    # nbhds: table of borough / nbhd pairs to use (by default those in frame)
+    @classmethod
+    def from_frame(cls, frame, col='passenger_count', nbhds=None):
+        dates = pd.date_range(frame.date.min(), frame.date.max()).values
+        counts, nbhds, dates, hours = pickups_hdl_cube(frame, col, nbhds, dates, np.arange(24))
+        return cls(counts, nbhds, dates[0], np.isin(dates, frame.date.values))
+
+    @property
+    def names(self):
+        # (the calendar features, holiday / day_of_week, are already columns of the table)
+        return list(lag_days) + list(mean_days) + list(daily_mean_days)
+
+    @property
+    def dates(self):
+        return pd.date_range(self.start, periods=self.n_dates)
+
+    # Adds the counts of dates after the last one (capacity along the dates doubles
+    # when it runs out, as in summary_cube.KeyedCube)
+    def _extend(self, counts, observed):
+        n, m = self.n_dates, counts.shape[1]
+        if n + m > self.counts.shape[1]:
+            capacity = max(n + m, 2 * self.counts.shape[1])
+            for name, extra in [('counts', 0), ('sums', 1), ('day_sums', 1), ('missing', 1)]:
+                old = getattr(self, name)
+                shape = list(old.shape)
+                shape[0 if old.ndim == 1 else 1] = capacity + extra
+                new = np.zeros(shape, dtype=old.dtype)
+                if old.ndim == 1:
+                    new[:n + extra] = old[:n + extra]
+                else:
+                    new[:, :n + extra] = old[:, :n + extra]
+                setattr(self, name, new)
+        self.counts[:, n:n + m] = counts
+        self.sums[:, n + 1:n + m + 1] = self.sums[:, n:n + 1] + np.cumsum(counts, axis=1)
+        self.day_sums[:, n + 1:n + m + 1] = self.day_sums[:, n:n + 1] + np.cumsum(counts.sum(axis=2), axis=1)
+        self.missing[n + 1:n + m + 1] = self.missing[n] + np.cumsum(~observed)
+        self.n_dates = n + m
+
+    # Adds the pickups of new dates (all after the last date so far; dates in between
+    # without rows count as dates without data, nbhds not in nbhds are left out)
+    def append(self, frame, col='passenger_count'):
+        first = self.start + pd.Timedelta(days=self.n_dates)
+        if frame.date.min() < first:
+            raise ValueError('dates up to %s are already added' % (first - pd.Timedelta(days=1)).date())
+        dates = pd.date_range(first, frame.date.max()).values
+        counts = pickups_hdl_cube(frame, col, self.nbhds, dates, np.arange(self.n_hours))[0]
+        self._extend(counts.astype(self.counts.dtype), np.isin(dates, frame.date.values))
+        return self
+
+    # Running sum positions of the w days before date positions d, and whether they all have data
+    def _window(self, d, w):
+        valid = (d - w >= 0) & (d <= self.n_dates)
+        lo, hi = np.clip(d - w, 0, self.n_dates), np.clip(d, 0, self.n_dates)
+        return lo, hi, valid & (self.missing[hi] == self.missing[lo])
+
+    # Features of the cells at nbhd positions i, date positions d (days from start, may be
+    # past the last date) and hours h (broadcast together), as a dict of float arrays
+    def _gather(self, i, d, h):
+        i, d, h = np.broadcast_arrays(i, d, h)
+        out = {}
+        for name, k in lag_days.items():
+            src = d - k
+            valid = (src >= 0) & (src < self.n_dates)
+            src = np.clip(src, 0, max(self.n_dates - 1, 0))
+            valid &= self.missing[src + 1] == self.missing[src]
+            out[name] = np.where(valid, self.counts[i, src, h], np.nan)
+        for name, w in mean_days.items():
+            lo, hi, valid = self._window(d, w)
+            out[name] = np.where(valid, (self.sums[i, hi, h] - self.sums[i, lo, h]) / float(w), np.nan)
+        for name, w in daily_mean_days.items():
+            lo, hi, valid = self._window(d, w)
+            out[name] = np.where(valid, (self.day_sums[i, hi] - self.day_sums[i, lo]) / float(w * self.n_hours),
+                                 np.nan)
+        return out
+
+    # Positions of dates (days from start)
+    def _days(self, dates):
+        return np.asarray((pd.DatetimeIndex(np.atleast_1d(dates)).normalize() - self.start).days)
+
+    # Positions of borough / nbhd pairs (-1 for those not in nbhds)
+    def _nbhd_positions(self, frame):
+        return self.nbhd_index.get_indexer(pd.MultiIndex.from_frame(frame[['borough', 'nbhd']].astype(object)))
+
+    # Features (nbhds x dates x hours arrays) of every nbhd, on dates and each hour
+    def features(self, dates):
+        d = self._days(dates)
+        return self._gather(np.arange(self.n_nbhds)[:, None, None], d[None, :, None],
+                            np.arange(self.n_hours)[None, None, :])
+
+    # Features of one date and hour for each nbhd of the table nbhds (default: nbhds),
+    # as a dict of arrays (nbhds not in the counts get NaN)
+    def at(self, date, hour, nbhds=None):
+        i = np.arange(self.n_nbhds) if nbhds is None else self._nbhd_positions(nbhds)
+        out = self._gather(np.maximum(i, 0), self._days(date)[0], int(hour))
+        for name in out:
+            out[name][i < 0] = np.nan
+        return out
+
+    # Adds the features as columns of a table of pickups by nbhd / date / hour
+    # (e.g. the model's training rows), with NaN replaced by fill
+    def add_features(self, frame, fill=np.nan):
+        i = self._nbhd_positions(frame)
+        out = self._gather(np.maximum(i, 0), self._days(frame.date.values), frame.hour.values.astype(np.intp))
+        frame = frame.copy()
+        for name in self.names:
+            values = out[name].astype(np.float32)
+            values[(i < 0) | np.isnan(values)] = fill
+            frame[name] = values
+        return frame
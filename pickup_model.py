@@ -0,0 +1,99 @@
+# Training path for the pickup forecaster in nyc_taxi_analysis.py (random forest on
+# pickups by nbhd / date / hour: fit on 2014, predict 2015)
+# Features come straight from the compact pickups_hdl columns: the calendar and weather
+# columns as numbers, and the borough / nbhd pair either as one integer code (trees
+# split on it like any other ordered column) or as one-hot columns of a scipy.sparse
+# matrix, instead of pd.get_dummies on string columns (a dense column per level)
+# The parameter search uses successive halving: every candidate is fitted on a small
+# sample of rows, and only the best third go on to three times as many rows, and so on
+# up to the full training set, with the candidates fitted in parallel across cores
+import time, numpy as np, pandas as pd
+
+# Columns of the table that are not features (index: left by reset_index)
+non_feature_cols = ['index', 'date', 'year', 'passenger_count']
+nbhd_cols = ['borough', 'nbhd']
+
+
+# Feature matrix of a table of pickups by nbhd / date / hour (all columns other than
+# non_feature_cols and exclude are used), and the names of its columns
+# one_hot: one column per borough / nbhd pair (scipy.sparse CSR matrix), otherwise one
+# column of integer codes (dense float32 array)
+# Build it once on the training and test rows together, so the codes agree
+def feature_matrix(frame, one_hot=False, exclude=()):
+    names = [x for x in frame.columns if x not in non_feature_cols + nbhd_cols + list(exclude)]
+    numeric = frame[names].to_numpy(dtype=np.float32)
+    codes, pairs = pd.MultiIndex.from_frame(frame[nbhd_cols].astype(object)).factorize()
+    if not one_hot:
+        return np.column_stack([numeric, codes.astype(np.float32)]), names + ['nbhd_code']
+    from scipy import sparse
+    n = frame.shape[0]
+    dummies = sparse.csr_matrix((np.ones(n, dtype=np.float32), (np.arange(n), codes)), shape=(n, len(pairs)))
+    return sparse.hstack([sparse.csr_matrix(numeric), dummies], format='csr'), names + ['%s_%s' % x for x in pairs]
+
+
+# Random forest parameters to sample from (max_features as a share of the columns, so
+# it works for either layout of feature_matrix)
+def param_distributions():
+    from scipy.stats import randint as sp_randint, uniform
+    return {'n_estimators': sp_randint(10, 101),
+            'max_depth': [8, 16, 32, None],
+            'max_features': uniform(0.1, 0.9),
+            'min_samples_split': sp_randint(2, 11),
+            'min_samples_leaf': sp_randint(1, 11),
+            'bootstrap': [True, False]}
+
+
+# Rows of the first round of a halving search, so that its last round uses all n_rows
+# rows (less the remainder of dividing them by factor ** (rounds - 1))
+# Each round has factor times the rows of the one before, and there are as many rounds
+# as it takes to get down to one candidate, or as fit between min_rows and n_rows
+def halving_min_rows(n_rows, n_candidates, factor=3, min_rows=20000):
+    min_rows = min(min_rows, n_rows)
+    n_rounds = 1
+    while factor ** n_rounds <= n_candidates and min_rows * factor ** n_rounds <= n_rows:
+        n_rounds += 1
+    return n_rows // factor ** (n_rounds - 1)
+
+
+# Searches random forest parameters on X / y by successive halving over the rows
+# (n_candidates parameter sets, each round keeps the best 1 / factor of them on factor
+# times as many rows, at least min_rows in the first round and all of X in the last,
+# see halving_min_rows), fitting n_jobs candidates at once (-1: all cores)
+# Falls back to a randomized search on min_rows rows with scikit-learn < 0.24
+# Returns the fitted search (best_params_, cv_results_, ...), without refitting the
+# best candidate (the caller fits the final model on all cores)
+def search(X, y, n_candidates=50, factor=3, min_rows=20000, cv=3, n_jobs=-1, random_state=0):
+    from sklearn.ensemble import RandomForestRegressor
+    # one tree at a time per candidate, the candidates are the parallel part
+    rf = RandomForestRegressor(n_jobs=1, random_state=random_state)
+    try:
+        from sklearn.experimental import enable_halving_search_cv
+        from sklearn.model_selection import HalvingRandomSearchCV
+    except ImportError:
+        from sklearn.model_selection import RandomizedSearchCV
+        rows = np.random.RandomState(random_state).permutation(X.shape[0])[:min_rows]
+        random_search = RandomizedSearchCV(rf, param_distributions(), n_iter=n_candidates, cv=cv, n_jobs=n_jobs,
+                                           refit=False, random_state=random_state)
+        return random_search.fit(X[rows], np.asarray(y)[rows])
+    halving_search = HalvingRandomSearchCV(rf, param_distributions(), n_candidates=n_candidates, factor=factor,
+                                           resource='n_samples',
+                                           min_resources=halving_min_rows(X.shape[0], n_candidates, factor, min_rows),
+                                           max_resources=X.shape[0], cv=cv, n_jobs=n_jobs, refit=False,
+                                           random_state=random_state)
+    return halving_search.fit(X, np.asarray(y))
+
+
+# Fits model on X / y, timed
+def fit(model, X, y):
+    start = time.time()
+    model.fit(X, np.asarray(y))
+    return model, time.time() - start
+
+
+# Predictions of model on X, with the predict time and their MSE / R^2 against y
+def evaluate(model, X, y):
+    from sklearn.metrics import mean_squared_error, r2_score
+    start = time.time()
+    pred = model.predict(X)
+    seconds = time.time() - start
+    return pred, {'predict_seconds': seconds, 'mse': mean_squared_error(y, pred), 'r2': r2_score(y, pred)}
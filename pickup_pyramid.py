@@ -0,0 +1,131 @@
+# Pickups by hour on grids of several resolutions (a pyramid), so the heatmaps in
+# nyc_taxi_analysis.py can switch resolution and zoom window without rereading the trips
+# Level dec is the grid of cells 10^-dec degrees wide: cell (i, j) covers lons from
+# i / 10^dec to (i + 1) / 10^dec and lats from j / 10^dec to (j + 1) / 10^dec
+# (cells are floored, not rounded like rounded_lon / rounded_lat, so that each cell is
+# exactly 10 x 10 cells of the next finer level)
+# create_summary_data.py sums the pickups at the finest level (trip_summary.pyramid_dec)
+# in the same pass as the other summaries, and each coarser level is summed from the
+# level above it by dividing the cell numbers
+# Each level is kept as arrays (one entry per hour and cell with pickups): lon / lat cell
+# numbers, hour and passenger_count, sorted by hour, lat and lon
+import numpy as np
+
+level_cols = ['lon', 'lat', 'hour', 'passenger_count']
+# Area shown (min lon, max lon, min lat, max lat), as the xlim / ylim of the ggplot2 frames
+# (here rather than in pickup_frames.py, so building the pyramid doesn't import the rendering)
+nyc_extent = (-74.2, -73.7, 40.56, 40.93)
+
+
+# Cell numbers (lon, lat) of points at level dec
+# (points are nudged 1e-9 degrees up, so coords saved with dec decimals fall in their own
+# cell, by the same distance at every level, so the levels agree on which cell it is)
+def grid_cells(lon, lat, dec):
+    scale = 10.0 ** dec
+    return (np.floor((np.asarray(lon, dtype=float) + 1e-9) * scale).astype(np.int64),
+            np.floor((np.asarray(lat, dtype=float) + 1e-9) * scale).astype(np.int64))
+
+
+# Sums values by hour / lat / lon cell, as a level (dict of arrays, sorted)
+def _aggregate(lon, lat, hour, values):
+    if not len(values):
+        return {'lon': lon[:0].astype(np.int64), 'lat': lat[:0].astype(np.int64),
+                'hour': hour[:0].astype(np.int8), 'passenger_count': values[:0]}
+    lon0, lat0 = lon.min(), lat.min()
+    n_lon, n_lat = int(lon.max() - lon0) + 1, int(lat.max() - lat0) + 1
+    key = (hour.astype(np.int64) * n_lat + (lat - lat0)) * n_lon + (lon - lon0)
+    keys, inverse = np.unique(key, return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=values, minlength=len(keys)).astype(values.dtype)
+    return {'lon': keys % n_lon + lon0, 'lat': keys // n_lon % n_lat + lat0,
+            'hour': (keys // (n_lon * n_lat)).astype(np.int8), 'passenger_count': totals}
+
+
+class GridPyramid(object):
+
+    # levels: dict of dec -> level (dict of level_cols arrays)
+    def __init__(self, levels):
+        self.levels = levels
+
+    # From a table of pickups by finest level cell and hour (the pickups_grid summary),
+    # adding each coarser level in decs
+    @classmethod
+    def from_frame(cls, frame, dec, decs=(), lon='grid_lon', lat='grid_lat', col='passenger_count'):
+        levels = {dec: _aggregate(frame[lon].values.astype(np.int64), frame[lat].values.astype(np.int64),
+                                  frame['hour'].values, frame[col].values)}
+        for x in sorted(set(decs) - set([dec]), reverse=True):
+            if x > dec:
+                raise ValueError('level %d is finer than the summed level %d' % (x, dec))
+            # from the next finer level made so far
+            finer = min(y for y in levels if y > x)
+            level = levels[finer]
+            factor = 10 ** (finer - x)
+            levels[x] = _aggregate(level['lon'] // factor, level['lat'] // factor, level['hour'],
+                                   level['passenger_count'])
+        return cls(levels)
+
+    @property
+    def decs(self):
+        return sorted(self.levels)
+
+    def save(self, path):
+        np.savez_compressed(path, **dict(('%s_%d' % (col, dec), level[col])
+                                         for dec, level in self.levels.items() for col in level_cols))
+
+    @classmethod
+    def load(cls, path):
+        levels = {}
+        with np.load(path) as arrays:
+            for name in arrays.files:
+                col, dec = name.rsplit('_', 1)
+                levels.setdefault(int(dec), {})[col] = arrays[name]
+        return cls(levels)
+
+    # Entries of level dec in extent (and hours, default: the hours with pickups), with
+    # the window clipped to the cells with pickups
+    # Returns the hours, each entry's position in them, its lat / lon position in the
+    # window and total, the window shape (lat x lon) and the extent its cells cover
+    def _select(self, dec, extent, hours):
+        if dec not in self.levels:
+            raise KeyError('no level %d in the pyramid (levels: %s)' % (dec, self.decs))
+        level = self.levels[dec]
+        (i0, i1), (j0, j1) = grid_cells(extent[:2], extent[2:], dec)
+        hours = np.unique(level['hour']) if hours is None else np.sort(np.asarray(hours))
+        h = np.searchsorted(hours, level['hour'])
+        keep = ((h < len(hours)) & (i0 <= level['lon']) & (level['lon'] <= i1) &
+                (j0 <= level['lat']) & (level['lat'] <= j1))
+        keep[keep] = hours[h[keep]] == level['hour'][keep]
+        lon, lat = level['lon'][keep], level['lat'][keep]
+        if len(lon):
+            i0, i1, j0, j1 = lon.min(), lon.max(), lat.min(), lat.max()
+        scale = 10.0 ** dec
+        cell_extent = (i0 / scale, (i1 + 1) / scale, j0 / scale, (j1 + 1) / scale)
+        return (hours, h[keep], lat - j0, lon - i0, level['passenger_count'][keep],
+                (int(j1 - j0) + 1, int(i1 - i0) + 1), cell_extent)
+
+    # Dense totals (hours x lat x lon float32, lat increasing) of the level dec cells
+    # covering extent (clipped to the cells with pickups), for each hour in hours
+    # (default: the hours with pickups)
+    # Returns the hours, the totals, and the extent the cells cover
+    # (for the finest levels over large extents, frames only holds one hour at a time)
+    def window(self, dec, extent=nyc_extent, hours=None):
+        hours, h, j, i, values, shape, cell_extent = self._select(dec, extent, hours)
+        totals = np.zeros((len(hours),) + shape, dtype=np.float32)
+        # (one entry per hour and cell, so no sums are needed)
+        totals[h, j, i] = values
+        return hours, totals, cell_extent
+
+    # Same as window, but the totals of each hour (lat x lon float32) one at a time, from
+    # an iterator, with the largest total of any cell and hour (for a common color scale)
+    # Returns the hours, the iterator, the extent the cells cover and the largest total
+    def frames(self, dec, extent=nyc_extent, hours=None):
+        hours, h, j, i, values, shape, cell_extent = self._select(dec, extent, hours)
+        # (entries are sorted by hour)
+        starts = np.searchsorted(h, np.arange(len(hours) + 1))
+
+        def totals():
+            for x in range(len(hours)):
+                grid = np.zeros(shape, dtype=np.float32)
+                rows = slice(starts[x], starts[x + 1])
+                grid[j[rows], i[rows]] = values[rows]
+                yield grid
+        return hours, totals(), cell_extent, values.max() if len(values) else 0
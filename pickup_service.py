@@ -0,0 +1,289 @@
+# Pickup forecasts for every nbhd, served from the model fitted in nyc_taxi_analysis.py
+# PickupForecaster is the saved artifact: the fitted model plus its feature encoding
+# (column order, nbhd codes) and the weather by date (a covariate_store.CovariateStore),
+# so a forecast only needs a date and hour. The calendar features (day of week, month,
+# holiday) come from the date itself, and the weather is the last known at or before
+# the hour (up to weather_max_age hours old), so dates after the data can be forecast
+# The feature rows of a (date, hour) are the same for every request, so they are
+# built once (one row per nbhd) and kept in a cache of the cache_size most recently used
+# With lag features (pickup_lags.LagFeatures), the artifact also keeps the pickup counts
+# they come from, and add_pickups adds the pickups (and weather) of new dates as they arrive
+# PredictionService answers requests from several threads together: requests that
+# arrive within max_wait seconds of each other are predicted in one model.predict call
+# python pickup_service.py data/pickup_model.pkl [port] serves them over HTTP:
+# GET /predict?start=2015-05-07T08&hours=3 returns JSON with the nbhds and, for each
+# hour from start, the forecast pickups in the same order
+import sys, json, time, pickle, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np, pandas as pd
+from pickup_model import nbhd_cols
+
+# Features computed from the date itself
+calendar_features = {'day_of_week': lambda x: x.dayofweek, 'month': lambda x: x.month}
+
+
+class PickupForecaster(object):
+
+    # model: fitted regressor, feature_names: its columns (see pickup_model.feature_matrix),
+    # nbhds: borough / nbhd pairs in code order, covariates: CovariateStore of the weather
+    # features (or None), lags: LagFeatures of the pickups (or None)
+    # weather_max_age: hours back to take the last known weather from
+    def __init__(self, model, feature_names, nbhds, covariates=None, lags=None, weather_max_age=72,
+                 cache_size=512):
+        self.model = model
+        self.feature_names = list(feature_names)
+        self.nbhds = pd.DataFrame(nbhds, columns=nbhd_cols).reset_index(drop=True)
+        self.covariates = covariates
+        self.lags = lags
+        self.weather_max_age = weather_max_age
+        self.one_hot = 'nbhd_code' not in self.feature_names
+        # (features other than the nbhd columns, the date's own and the lags are weather)
+        n_nbhd_cols = self.nbhds.shape[0] if self.one_hot else 1
+        own = ['hour', 'holiday'] + list(calendar_features) + (lags.names if lags is not None else [])
+        self.weather_cols = [x for x in self.feature_names[:len(self.feature_names) - n_nbhd_cols] if x not in own]
+        unknown = [x for x in self.weather_cols if covariates is None or x not in covariates.columns]
+        if unknown:
+            raise ValueError('no covariates for features %s' % unknown)
+        self._holidays = {}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    # From the table the model was trained on (as passed to feature_matrix)
+    @classmethod
+    def from_training(cls, model, frame, feature_names, covariates=None, lags=None, **kwargs):
+        nbhds = pd.MultiIndex.from_frame(frame[nbhd_cols].astype(object)).unique()
+        return cls(model, feature_names, list(nbhds), covariates, lags, **kwargs)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({'model': self.model, 'feature_names': self.feature_names,
+                         'nbhds': self.nbhds.values.tolist(), 'covariates': self.covariates, 'lags': self.lags},
+                        f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+        return cls(artifact['model'], artifact['feature_names'], artifact['nbhds'], artifact.get('covariates'),
+                   artifact.get('lags'), **kwargs)
+
+    # Replaces the weather (e.g. a CovariateStore rebuilt after new weather arrives)
+    def set_covariates(self, covariates):
+        with self.lock:
+            self.covariates = covariates
+            self.cache.clear()
+
+    def _is_holiday(self, date):
+        if date.year not in self._holidays:
+            from pandas.tseries.holiday import USFederalHolidayCalendar
+            self._holidays[date.year] = set(USFederalHolidayCalendar().holidays('%d-01-01' % date.year,
+                                                                                '%d-12-31' % date.year))
+        return date in self._holidays[date.year]
+
+    # Adds the pickups (by nbhd / date / hour) of dates after the last one to the lag
+    # features, so forecasts past them use the latest counts, and the weather up to them
+    # if covariates (a CovariateStore covering the new dates) is given
+    def add_pickups(self, frame, covariates=None):
+        with self.lock:
+            self.lags.append(frame)
+            if covariates is not None:
+                self.covariates = covariates
+            self.cache.clear()
+
+    # Feature rows (one per nbhd, in nbhds order) for a date and hour
+    def features(self, date, hour):
+        key = (pd.Timestamp(date), int(hour))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        date = key[0].normalize()
+        n = self.nbhds.shape[0]
+        values = dict((x, f(date)) for x, f in calendar_features.items())
+        values['hour'] = key[1]
+        values['holiday'] = float(self._is_holiday(date))
+        if self.weather_cols:
+            weather = self.covariates.lookup(self.covariates.date_index([date.to_datetime64()]), [key[1]],
+                                             self.weather_cols, self.weather_max_age)
+            missing = [x for x in self.weather_cols if np.isnan(weather[x][0])]
+            if missing:
+                raise KeyError('no weather within %d hours before %s %02d:00 (%s)' %
+                               (self.weather_max_age, date.date(), key[1], ', '.join(missing)))
+            values.update((x, weather[x][0]) for x in self.weather_cols)
+        if self.lags is not None:
+            # (-1 for missing lags, as in training)
+            for x, lag in self.lags.at(key[0], key[1], self.nbhds).items():
+                values[x] = np.where(np.isnan(lag), -1, lag)
+        if self.one_hot:
+            rows = np.zeros((n, len(self.feature_names)), dtype=np.float32)
+            rows[:, len(self.feature_names) - n:] = np.eye(n, dtype=np.float32)
+        else:
+            rows = np.empty((n, len(self.feature_names)), dtype=np.float32)
+            values['nbhd_code'] = np.arange(n)
+        for i, x in enumerate(self.feature_names):
+            if x in values:
+                rows[:, i] = values[x]
+        with self.lock:
+            self.cache[key] = rows
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return rows
+
+    # (date, hour) of each of n_hours hours from start (a datetime, e.g. '2015-05-07 08:00')
+    @staticmethod
+    def hours(start, n_hours=1):
+        start = pd.Timestamp(start).floor('h')
+        times = start + pd.to_timedelta(np.arange(n_hours), unit='h')
+        return list(zip(times.normalize(), times.hour))
+
+    # Forecast pickups (n_nbhds x len(keys)) for a list of (date, hour)
+    def predict_hours(self, keys):
+        if not keys:
+            return np.empty((self.nbhds.shape[0], 0))
+        X = np.concatenate([self.features(date, hour) for date, hour in keys])
+        return self.model.predict(X).reshape(len(keys), -1).T
+
+    # Table of forecast pickups for every nbhd and each of n_hours hours from start
+    def predict(self, start, n_hours=1):
+        keys = self.hours(start, n_hours)
+        return self.to_frame(keys, self.predict_hours(keys))
+
+    def to_frame(self, keys, pred):
+        n = self.nbhds.shape[0]
+        out = pd.concat([self.nbhds] * len(keys), ignore_index=True)
+        out['date'] = np.repeat([x[0] for x in keys], n)
+        out['hour'] = np.repeat([x[1] for x in keys], n)
+        out['pickups'] = pred.T.ravel()
+        return out
+
+
+# Runs the forecasts of concurrent requests in batches, from a worker thread
+# A batch is the requests waiting when the worker is free, plus any arriving within
+# max_wait seconds (up to max_batch requests); the (date, hour) keys they share are
+# predicted once
+class PredictionService(object):
+
+    def __init__(self, forecaster, max_batch=64, max_wait=0.002):
+        self.forecaster = forecaster
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.batches = 0
+        self.worker = threading.Thread(target=self._run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    # Future for the forecasts (n_nbhds x n_hours array) of n_hours hours from start
+    def submit(self, start, n_hours=1):
+        keys = self.forecaster.hours(start, n_hours)
+        future = Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError('service is closed')
+            self.pending.append((keys, future))
+            self.cond.notify()
+        return future
+
+    # Table of forecasts for every nbhd and each of n_hours hours from start
+    def predict(self, start, n_hours=1, timeout=None):
+        keys = self.forecaster.hours(start, n_hours)
+        return self.forecaster.to_frame(keys, self.submit(start, n_hours).result(timeout))
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            if not self.pending:
+                return None
+            deadline = time.time() + self.max_wait
+            while len(self.pending) < self.max_batch and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self.batches += 1
+            keys = list(OrderedDict.fromkeys(x for request_keys, future in batch for x in request_keys))
+            try:
+                pred = self.forecaster.predict_hours(keys)
+            except Exception:
+                # predict separately, so one bad request (e.g. a date without features)
+                # only fails itself
+                for request_keys, future in batch:
+                    try:
+                        future.set_result(self.forecaster.predict_hours(request_keys))
+                    except Exception as e:
+                        future.set_exception(e)
+                continue
+            position = dict((x, i) for i, x in enumerate(keys))
+            for request_keys, future in batch:
+                future.set_result(pred[:, [position[x] for x in request_keys]])
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.worker.join()
+
+
+# HTTP server (one thread per connection) for GET /predict?start=...&hours=...
+# (hours from 1 to max_hours, so one request can't build an arbitrarily large batch)
+def make_server(service, host='127.0.0.1', port=8000, max_hours=168):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+    nbhds = service.forecaster.nbhds.values.tolist()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/predict':
+                return self._send(404, {'error': 'not found'})
+            args = parse_qs(url.query)
+            try:
+                start = args['start'][0]
+                n_hours = int(args.get('hours', ['1'])[0])
+                if not 1 <= n_hours <= max_hours:
+                    raise ValueError('hours must be from 1 to %d' % max_hours)
+                keys = service.forecaster.hours(start, n_hours)
+                pred = service.submit(start, n_hours).result()
+            except (KeyError, ValueError) as e:
+                return self._send(400, {'error': str(e.args[0]) if e.args else repr(e)})
+            except Exception as e:
+                # (e.g. the model failed, or the service is closed) answer rather than drop the connection
+                return self._send(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            self._send(200, {'nbhds': nbhds,
+                             'hours': [{'date': str(date.date()), 'hour': int(hour), 'pickups': pred[:, i].tolist()}
+                                       for i, (date, hour) in enumerate(keys)]})
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+if __name__ == '__main__':
+    service = PredictionService(PickupForecaster.load(sys.argv[1]))
+    server = make_server(service, port=int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
+    print('serving on http://%s:%d/predict' % server.server_address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,159 @@
+# Instrumentation for the pipeline scripts: each stage (and each file within a stage)
+# is written as one JSON object per line to a log file, with its wall time, rows in /
+# out, throughput and the process' peak RSS so far, e.g.
+# {"script": "create_summary_data", "stage": "summarize_file", "file": "yellow_05_2015.gz",
+#  "seconds": 412.3, "rows_in": 12324935, "rows_out": 11987210, "rows_per_sec": 29892.1,
+#  "drops": {"fare_amount > 0": 3011, ...}, "max_rss_mb": 1822.4, ...}
+# so slow months and regressions can be found with e.g.
+# pd.read_json('pipeline_log.jsonl', lines=True)
+# With profile=True a sampling profiler runs during each stage (a thread looking at
+# the stage's stack every profile_interval seconds), and the functions seen most
+# often are added to the stage's record
+import os, sys, json, time, threading
+from collections import Counter
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+# Peak resident memory of this process so far, in MB (None if it can't be found)
+def max_rss_mb():
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # KB on Linux, bytes on macOS
+        return max_rss / (2.0 ** 20 if sys.platform == 'darwin' else 2.0 ** 10)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss) / 2.0 ** 20
+
+
+# Samples one thread's stack every interval seconds
+# Counts the innermost function (self) and every function on the stack (cumulative)
+class StackSampler(threading.Thread):
+
+    def __init__(self, thread_id, interval=0.01):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()
+        self.cum_counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_counts[_frame_name(frame)] += 1
+            seen = set()
+            while frame is not None:
+                name = _frame_name(frame, line=False)
+                if name not in seen:
+                    seen.add(name)
+                    self.cum_counts[name] += 1
+                frame = frame.f_back
+
+    def stop(self, n_top=15):
+        self._stop_event.set()
+        self.join()
+        return {'samples': self.samples, 'interval': self.interval,
+                'self': self.self_counts.most_common(n_top), 'cumulative': self.cum_counts.most_common(n_top)}
+
+
+def _frame_name(frame, line=True):
+    code = frame.f_code
+    name = os.path.basename(code.co_filename) + ':' + code.co_name
+    return name + ':' + str(frame.f_lineno) if line else name
+
+
+# Adds throughput to a record with seconds and rows_in / bytes
+def _add_rates(record):
+    seconds = record.get('seconds')
+    if seconds:
+        if record.get('rows_in') is not None:
+            record['rows_per_sec'] = record['rows_in'] / seconds
+        if record.get('bytes') is not None:
+            record['mb_per_sec'] = record['bytes'] / seconds / 2.0 ** 20
+    return record
+
+
+# path: JSON lines file to append the records to (None only times the stages)
+# script: name of the script, added to each record
+class PipelineLog(object):
+
+    def __init__(self, path=None, script=None, profile=False, profile_interval=0.01):
+        self.path = path
+        self.script = script
+        self.profile = profile
+        self.profile_interval = profile_interval
+        self._lock = threading.Lock()
+
+    # Appends one record (stamped with the script, process and time) to the log
+    def write(self, record):
+        record = _add_rates(dict(record))
+        record.setdefault('script', self.script)
+        record.setdefault('pid', os.getpid())
+        record.setdefault('time', time.strftime('%Y-%m-%dT%H:%M:%S'))
+        if self.path is not None:
+            line = json.dumps(record, default=str)
+            with self._lock:
+                with open(self.path, 'a') as f:
+                    f.write(line + '\n')
+        return record
+
+    # Starts timing a stage, returns its record (pass it to end)
+    # Extra fields (e.g. file=...) are added to the record
+    def begin(self, stage, **fields):
+        record = dict(fields)
+        record['stage'] = stage
+        record['_start'] = time.time()
+        if self.profile:
+            record['_sampler'] = StackSampler(threading.current_thread().ident, self.profile_interval)
+            record['_sampler'].start()
+        return record
+
+    # Finishes a stage: adds its wall time, peak RSS, throughput and any extra fields
+    # (rows_in, rows_out, drops, bytes, ...), and writes it to the log
+    def end(self, record, **fields):
+        seconds = time.time() - record.pop('_start')
+        sampler = record.pop('_sampler', None)
+        record.update(fields)
+        record['seconds'] = seconds
+        record['max_rss_mb'] = max_rss_mb()
+        if sampler is not None:
+            record['profile'] = sampler.stop()
+        return self.write(record)
+
+    # Same as begin / end, around a with block:
+    # with log.stage('load') as rec:
+    #     ...
+    #     rec['rows_in'] = n
+    def stage(self, stage, **fields):
+        return _Stage(self, stage, fields)
+
+
+class _Stage(object):
+
+    def __init__(self, log, stage, fields):
+        self.log = log
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.record = self.log.begin(self.stage, **self.fields)
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.log.end(self.record, status='ok')
+        else:
+            self.log.end(self.record, status='error', error=exc_type.__name__ + ': ' + str(exc))
+        return False
@@ -0,0 +1,301 @@
+# Runs the scripts of the analysis (see README.md) as one pipeline:
+# download -> centroids / borders, geocode -> summarize -> plots, model
+# python run_pipeline.py run [stages]   runs the stages (default all) and the ones they
+#                                       depend on, skipping those that are up to date
+# python run_pipeline.py status         shows which stages are up to date
+# python run_pipeline.py table pickups_hd borough --where hour=22,23
+#                                       prints one summary table grouped / filtered
+#                                       (see summary_query.py), without the plotting
+#                                       or model libraries
+# A stage is up to date when nothing it depends on has changed since it last ran: its
+# script and modules, its input files and the output files of the stages before it
+# (size / modification time), the settings passed to it, and its own output files are
+# still as it left them (recorded in data/pipeline_state.json)
+# Stages whose dependencies are done run at the same time (up to --jobs), each script
+# in its own process with TAXI_TOP_DIR set, its output going to data/run_<stage>.log
+# Only the standard library is imported here; each subcommand imports what it needs
+import os, sys, json, glob, time, hashlib, argparse, subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Set top directory (or set TAXI_TOP_DIR, or pass --top-dir)
+top_dir = os.environ.get('TAXI_TOP_DIR', 'C:/Users/Beatrice/Desktop/Taxi Analysis')
+# Set to number of stages to run at once
+n_jobs = 2
+# File (in the data directory) recording each stage's last successful run
+state_file = 'pipeline_state.json'
+
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Each stage: script (in this folder), the stages it needs first, the modules it uses
+# (changes rerun it), its input and output files (glob patterns, relative to the top
+# directory) and environment settings for the script
+# Outputs name the exact files each stage writes, so no stage claims another's files
+stages = OrderedDict([
+    ('download', {'script': 'data_download.py', 'deps': [],
+                  'modules': ['trip_download.py', 'trip_store.py', 'pipeline_log.py'],
+                  'inputs': [], 'outputs': ['data/download_manifest.json']}),
+    ('centroids', {'script': 'find_nbhd_centroids_boundaries.py', 'deps': [],
+                   'modules': ['nbhd_geometry.py', 'pipeline_log.py'],
+                   'inputs': ['nyc_neighborhoods.json'],
+                   'outputs': ['data/nbhd_centroids.pkl', 'data/nbhd_borders.pkl']}),
+    ('geocode', {'script': 'find_pickup_dropoff_nbhds.py', 'deps': ['download'],
+                 'modules': ['nbhd_lookup.py', 'nbhd_geometry.py', 'pipeline_log.py'],
+                 'inputs': ['nyc_neighborhoods.json'],
+                 'outputs': ['data/pd_locs.pkl', 'data/nbhd_raster.*']}),
+    ('summarize', {'script': 'create_summary_data.py', 'deps': ['download', 'geocode'],
+                   'modules': ['trip_summary.py', 'summary_cube.py', 'summary_tables.py', 'nbhd_lookup.py',
+                               'trip_store.py', 'pipeline_log.py', 'pickup_pyramid.py', 'covariate_store.py'],
+                   # (the downloaded trips, as CSV or in the trip store)
+                   'inputs': ['data/jfk_weather.csv', 'data/yellow_*.gz', 'data/green_*.gz',
+                              'data/trip_store/type=*/year=*/month=*/*'],
+                   'outputs': ['data/pickups_hd.*', 'data/pickups_hr.*', 'data/date_avgs.*', 'data/pickups_hdl.*',
+                               'data/od_hdl.*', 'data/pickups_pyramid.npz', 'data/covariates.npz']}),
+    ('plots', {'script': 'nyc_taxi_analysis.py', 'deps': ['centroids', 'summarize'],
+               'modules': ['summary_tables.py', 'summary_query.py', 'pickup_frames.py', 'pickup_pyramid.py',
+                           'nbhd_lookup.py', 'covariate_store.py', 'pipeline_log.py'],
+               'inputs': [],
+               'outputs': ['plots/pickups_movie.gif', 'plots/pickups_week_movie.gif', 'plots/pickups_date_movie.gif',
+                           'plots/pickups_by_date.png', 'plots/fares_by_date.png', 'plots/tips_by_date.png',
+                           'plots/late_night_pickups.png', 'plots/2010_2015_percent_change.png'] +
+                          ['plots/taxi_pickups%02i.png' % i for i in range(24)],
+               'env': {'TAXI_SECTIONS': 'plots'}}),
+    ('model', {'script': 'nyc_taxi_analysis.py', 'deps': ['centroids', 'summarize'],
+               'modules': ['summary_tables.py', 'pickup_model.py', 'pickup_service.py', 'pickup_lags.py',
+                           'covariate_store.py', 'pipeline_log.py'],
+               # (the plot of the predictions is only drawn when the script runs with the plots too)
+               'inputs': [], 'outputs': ['data/pickup_model.pkl', 'plots/actual_pred_pickups.png'],
+               'env': {'TAXI_SECTIONS': 'model'}}),
+])
+
+# Summary tables for the table subcommand: key columns and summed columns
+tables = {'pickups_hd': (['borough', 'nbhd', 'day', 'hour'], ['passenger_count', 'trip_time_in_secs', 'trip_distance']),
+          'pickups_hr': (['rounded_lon', 'rounded_lat', 'hour'], ['passenger_count']),
+          'pickups_hdl': (['borough', 'nbhd', 'date', 'hour'], ['passenger_count'])}
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _files(patterns):
+    return sorted(set(x for pattern in patterns for x in glob.glob(os.path.join(top_dir, pattern))))
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Fingerprint of everything a stage depends on (as the files are now)
+def fingerprint(name):
+    stage = stages[name]
+    inputs = stage['inputs'] + [x for dep in stage['deps'] for x in stages[dep]['outputs']]
+    h = hashlib.sha1()
+    h.update(json.dumps({'name': name,
+                         'code': [_file_hash(os.path.join(code_dir, x)) for x in [stage['script']] + stage['modules']],
+                         'inputs': [[os.path.relpath(x, top_dir), _stamp(x)] for x in _files(inputs)],
+                         'env': stage.get('env', {})}, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_state():
+    path = os.path.join(top_dir, 'data', state_file)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(state):
+    path = os.path.join(top_dir, 'data', state_file)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+# Whether a stage's last run had this fingerprint and left its outputs unchanged
+def up_to_date(name, fingerprint_now, state):
+    last = state.get(name)
+    if not last or last['fingerprint'] != fingerprint_now or not last['outputs']:
+        return False
+    return all(os.path.exists(os.path.join(top_dir, x)) and _stamp(os.path.join(top_dir, x)) == stamp
+               for x, stamp in last['outputs'].items())
+
+
+# The stages given and all the ones they depend on, in pipeline order
+def with_deps(names):
+    needed = set()
+
+    def add(x):
+        if x not in needed:
+            needed.add(x)
+            for dep in stages[x]['deps']:
+                add(dep)
+    for x in names:
+        add(x)
+    return [x for x in stages if x in needed]
+
+
+def run_script(name):
+    stage = stages[name]
+    env = dict(os.environ)
+    env.update(stage.get('env', {}))
+    env['TAXI_TOP_DIR'] = top_dir
+    env['PYTHONPATH'] = code_dir + os.pathsep + env.get('PYTHONPATH', '')
+    start = time.time()
+    with open(os.path.join(top_dir, 'data', 'run_' + name + '.log'), 'w') as out:
+        result = subprocess.call([sys.executable, os.path.join(code_dir, stage['script'])], cwd=top_dir, env=env,
+                                 stdout=out, stderr=subprocess.STDOUT)
+    return result, time.time() - start
+
+
+# Runs the stages (and those they depend on) that are not up to date, n_jobs at a time
+# Returns True if all of them succeeded
+def run(names, force=False, jobs=n_jobs, dry_run=False):
+    forced = set(names or stages) if force else set()
+    names = with_deps(names or list(stages))
+    state = load_state()
+    prints = {}
+    status = {}
+    pending = list(names)
+    running = {}
+    with ThreadPoolExecutor(max(jobs, 1)) as pool:
+        while pending or running:
+            for name in list(pending):
+                deps = stages[name]['deps']
+                if any(status.get(x) in ('failed', 'blocked') for x in deps):
+                    status[name] = 'blocked'
+                    pending.remove(name)
+                    print('%-10s skipped (a stage it needs failed)' % name)
+                    continue
+                if any(x not in status for x in deps):
+                    continue
+                pending.remove(name)
+                if dry_run and any(status[x] == 'would run' for x in deps):
+                    status[name] = 'would run'
+                    print('%-10s would run (after a stage it needs)' % name)
+                    continue
+                prints[name] = fingerprint(name)
+                if name not in forced and up_to_date(name, prints[name], state):
+                    status[name] = 'up to date'
+                    print('%-10s up to date' % name)
+                elif dry_run:
+                    status[name] = 'would run'
+                    print('%-10s would run' % name)
+                else:
+                    print('%-10s running %s' % (name, stages[name]['script']))
+                    running[pool.submit(run_script, name)] = name
+            if not running:
+                continue
+            done, tmp = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result, seconds = future.result()
+                except Exception as e:
+                    # (e.g. the script could not be started) only this stage and the ones
+                    # that need it fail, the others carry on
+                    status[name] = 'failed'
+                    print('%-10s failed (%s: %s)' % (name, type(e).__name__, e))
+                    continue
+                if result != 0:
+                    status[name] = 'failed'
+                    print('%-10s failed (exit code %d, see data/run_%s.log)' % (name, result, name))
+                    continue
+                status[name] = 'done'
+                print('%-10s done in %.1fs' % (name, seconds))
+                state[name] = {'fingerprint': prints[name], 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                               'seconds': seconds,
+                               'outputs': dict((os.path.relpath(x, top_dir).replace(os.sep, '/'), _stamp(x))
+                                               for x in _files(stages[name]['outputs']))}
+                save_state(state)
+    return all(x in ('done', 'up to date', 'would run') for x in status.values())
+
+
+def show_status():
+    state = load_state()
+    for name in stages:
+        if up_to_date(name, fingerprint(name), state):
+            print('%-10s up to date (last run %s, %.1fs)' % (name, state[name]['time'], state[name]['seconds']))
+        elif name in state:
+            print('%-10s out of date (last run %s)' % (name, state[name]['time']))
+        else:
+            print('%-10s never run' % name)
+
+
+# Value of a --where option: dim=value or dim=value1,value2 (numbers where possible),
+# or dim=lo:hi for lo <= value <= hi
+def _where_value(text):
+    def parse(x):
+        for f in (int, float):
+            try:
+                return f(x)
+            except ValueError:
+                pass
+        return x
+    if ':' in text:
+        lo, hi = text.split(':', 1)
+        return slice(parse(lo) if lo else None, parse(hi) if hi else None)
+    values = [parse(x) for x in text.split(',')]
+    return values if len(values) > 1 else values[0]
+
+
+def show_table(name, by, where, measures, use_parquet=False):
+    import pandas as pd
+    from summary_query import SummaryQuery
+    path = os.path.join(top_dir, 'data', name + ('.parquet' if use_parquet else '.gz'))
+    if name == 'pickups_hdl':
+        from summary_tables import read_pickups_hdl
+        frame = read_pickups_hdl(path)
+    elif use_parquet:
+        import trip_store
+        frame = trip_store.read_summary(path)
+    else:
+        frame = pd.read_csv(path, usecols=lambda x: not x.startswith('Unnamed'))
+    dims, all_measures = tables[name]
+    query = SummaryQuery(frame, dims, all_measures)
+    result = query.query(by, dict((k, _where_value(v)) for k, v in where), measures or None)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(result.to_string(index=False))
+
+
+def main(argv=None):
+    global top_dir
+    parser = argparse.ArgumentParser(description='Runs the NYC taxi analysis pipeline')
+    parser.add_argument('--top-dir', default=top_dir, help='top directory (with the data and plots folders)')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run stages that are not up to date')
+    run_parser.add_argument('stages', nargs='*', metavar='stage',
+                            help='stages to run (with the ones they need): ' + ', '.join(stages))
+    run_parser.add_argument('--force', action='store_true', help='run the stages given (default all) even if up to date')
+    run_parser.add_argument('--jobs', type=int, default=n_jobs, help='stages to run at once')
+    run_parser.add_argument('--dry-run', action='store_true', help='only show what would run')
+    commands.add_parser('status', help='show which stages are up to date')
+    table_parser = commands.add_parser('table', help='print a summary table grouped by some columns')
+    table_parser.add_argument('name', choices=sorted(tables))
+    table_parser.add_argument('by', nargs='*', help='columns to group by (with a date: also year, month, day)')
+    table_parser.add_argument('--where', action='append', default=[], metavar='DIM=VALUE',
+                              help='filter, e.g. hour=22,23 or date=2015-01-01:2015-01-31')
+    table_parser.add_argument('--measures', nargs='+', help='columns to sum (default all)')
+    table_parser.add_argument('--parquet', action='store_true', help='read the Parquet summaries')
+    args = parser.parse_args(argv)
+    top_dir = os.path.abspath(args.top_dir)
+    if args.command == 'status':
+        show_status()
+    elif args.command == 'table':
+        where = [x.split('=', 1) for x in args.where]
+        show_table(args.name, args.by, where, args.measures, args.parquet)
+    elif args.command == 'run':
+        unknown = [x for x in args.stages if x not in stages]
+        if unknown:
+            parser.error('unknown stages: ' + ', '.join(unknown))
+        return 0 if run(args.stages, args.force, args.jobs, args.dry_run) else 1
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
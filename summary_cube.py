@@ -0,0 +1,155 @@
+# Running sums for the summary tables, kept as dense arrays over keyed axes
+# Each axis maps its key values (e.g. a date, or a rounded lon/lat pair) to a slot
+# in the arrays, so adding a partial summary only costs time proportional to its
+# own rows, rather than re-grouping everything accumulated so far
+# SparseCube keeps only the slot combinations seen so far, for summaries whose
+# dense arrays would be mostly empty (e.g. origin x destination x date x hour)
+import numpy as np, pandas as pd
+
+
+class KeyedCube(object):
+
+    # axes: list of lists of key columns, one list per array dimension
+    # cols: summed columns
+    def __init__(self, axes, cols):
+        self.axes = [list(x) for x in axes]
+        self.cols = list(cols)
+        self.slots = [{} for x in self.axes]
+        self.keys = [[] for x in self.axes]
+        self.values = None
+        self.seen = np.zeros([1] * len(self.axes), dtype=bool)
+
+    @property
+    def shape(self):
+        return tuple(len(x) for x in self.keys)
+
+    # Maps each row's key on one axis to its slot, adding new slots as needed
+    def _lookup(self, i, frame):
+        if len(self.axes[i]) == 1:
+            codes, uniques = pd.factorize(frame[self.axes[i][0]])
+        else:
+            codes, uniques = pd.MultiIndex.from_frame(frame[self.axes[i]]).factorize()
+        slots = self.slots[i]
+        n_slots = len(slots)
+        unique_slots = np.array([slots.setdefault(x, len(slots)) for x in uniques.tolist()], dtype=np.intp)
+        self.keys[i].extend(uniques[unique_slots >= n_slots].tolist())
+        return unique_slots[codes]
+
+    # Grows the arrays (doubling capacity) to fit all slots
+    def _reserve(self, frame):
+        shape = self.shape
+        capacity = self.seen.shape
+        if all(x <= y for x, y in zip(shape, capacity)) and self.values is not None:
+            return
+        capacity = tuple(max(x, 2 * y if x > y else y) for x, y in zip(shape, capacity))
+        seen = np.zeros(capacity, dtype=bool)
+        seen[tuple(slice(0, x) for x in self.seen.shape)] = self.seen
+        self.seen = seen
+        values = {}
+        for col in self.cols:
+            dtype = frame[col].dtype if self.values is None else self.values[col].dtype
+            values[col] = np.zeros(capacity, dtype=dtype)
+            if self.values is not None:
+                values[col][tuple(slice(0, x) for x in self.values[col].shape)] = self.values[col]
+        self.values = values
+
+    # Adds the summed columns of frame into the running sums
+    def add(self, frame):
+        idx = tuple(self._lookup(i, frame) for i in range(len(self.axes)))
+        self._reserve(frame)
+        self.seen[idx] = True
+        for col in self.cols:
+            v = frame[col].values
+            if not np.can_cast(v.dtype, self.values[col].dtype):
+                self.values[col] = self.values[col].astype(np.result_type(v.dtype, self.values[col].dtype))
+            np.add.at(self.values[col], idx, v)
+        return self
+
+    # Long format table of all key combinations added so far, sorted by key
+    def to_frame(self, sort_by=None):
+        shape = self.shape
+        idx = np.nonzero(self.seen[tuple(slice(0, x) for x in shape)])
+        return self._frame(idx, dict((col, self.values[col][idx]) for col in self.cols), sort_by)
+
+    # Table of the keys at slots idx (one array per axis) and their summed values
+    def _frame(self, idx, values, sort_by=None):
+        out = {}
+        for i, axis in enumerate(self.axes):
+            keys = np.empty(len(self.keys[i]), dtype=object)
+            keys[:] = self.keys[i]
+            keys = keys[idx[i]]
+            if len(axis) == 1:
+                out[axis[0]] = keys
+            else:
+                for j, key in enumerate(axis):
+                    out[key] = [x[j] for x in keys]
+        key_cols = [x for axis in self.axes for x in axis]
+        frame = pd.DataFrame(out, columns=key_cols).infer_objects()
+        for col in self.cols:
+            frame[col] = values[col]
+        frame = frame.sort_values(sort_by or key_cols, kind='mergesort')
+        return frame.reset_index(drop=True)
+
+
+class SparseCube(KeyedCube):
+
+    # Added rows are kept aside until there are merge_rows of them (or as many as
+    # there are sums so far, if more), then summed in one sort
+    merge_rows = 1 << 20
+
+    def __init__(self, axes, cols):
+        KeyedCube.__init__(self, axes, cols)
+        # Bits of the packed index given to each axis' slot
+        self.bits = 63 // len(self.axes)
+        self.index = np.zeros(0, dtype=np.int64)
+        self.values = None
+        self.pending = []
+        self.n_pending = 0
+
+    # One int64 per row, the slots of each axis packed together
+    def _pack(self, idx):
+        packed = np.zeros(len(idx[0]), dtype=np.int64)
+        for x in idx:
+            if len(x) and x.max() >= 1 << self.bits:
+                raise ValueError('more than %d keys on one axis' % ((1 << self.bits) - 1))
+            packed <<= self.bits
+            packed |= x
+        return packed
+
+    def _unpack(self, packed):
+        idx = []
+        for i in range(len(self.axes)):
+            idx.append((packed >> (self.bits * (len(self.axes) - 1 - i))) & ((1 << self.bits) - 1))
+        return tuple(idx)
+
+    # Sums the pending rows into the sums, one entry per packed index
+    def _merge(self):
+        if not self.pending:
+            return
+        index = np.concatenate([self.index] + [x[0] for x in self.pending])
+        values = {}
+        for col in self.cols:
+            values[col] = np.concatenate(([] if self.values is None else [self.values[col]]) +
+                                         [x[1][col] for x in self.pending])
+        order = np.argsort(index, kind='mergesort')
+        index = index[order]
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        self.index = index[starts]
+        self.values = dict((col, np.add.reduceat(values[col][order], starts) if len(starts) else values[col][:0])
+                           for col in self.cols)
+        self.pending = []
+        self.n_pending = 0
+
+    def add(self, frame):
+        idx = tuple(self._lookup(i, frame) for i in range(len(self.axes)))
+        self.pending.append((self._pack(idx), dict((col, frame[col].values) for col in self.cols)))
+        self.n_pending += frame.shape[0]
+        if self.n_pending >= max(self.merge_rows, len(self.index)):
+            self._merge()
+        return self
+
+    def to_frame(self, sort_by=None):
+        self._merge()
+        if self.values is None:
+            return self._frame(self._unpack(self.index), dict((col, np.zeros(0)) for col in self.cols), sort_by)
+        return self._frame(self._unpack(self.index), self.values, sort_by)
@@ -0,0 +1,165 @@
+# Group-by / filter queries over the summary tables (pickups_hd, pickups_hdl, od_hdl, ...)
+# for nyc_taxi_analysis.py, e.g.
+# hdl = SummaryQuery(pickups_hdl, ['borough', 'nbhd', 'date', 'hour'], ['passenger_count'],
+#                    rollups=[['borough', 'nbhd', 'year']])
+# hdl.query(['nbhd', 'year'], where={'borough': 'Bronx', 'hour': [22, 23, 0, 1, 2]})
+# Each dimension is coded once as integers (its sorted values are the levels), so a
+# query is a mask and a bincount over integer arrays rather than a pandas groupby
+# With a date dimension, year / month / day (day of week, Monday = 0) can also be used
+# Rollups are the table pre-summed over fewer dimensions: each query uses the smallest
+# one that has all its dimensions. Results are kept in a cache of the cache_size most
+# recently used queries
+from collections import OrderedDict
+import numpy as np, pandas as pd
+
+date_parts = {'year': lambda x: x.year, 'month': lambda x: x.month, 'day': lambda x: x.dayofweek}
+
+
+# Sums of measures (dict of arrays) over rows with the same codes on dims
+# Returns the codes (one array per dim) and sums of each group, sorted by code
+# Sums are int64 for integer measures (float64 otherwise), whatever the measure's own
+# type, so sums of compact int32 counts over many rows can't overflow
+def _group(codes, measures, dims, sizes):
+    if not dims:
+        return {}, dict((k, np.array([v.sum(dtype=_sum_dtype(v))])) for k, v in measures.items())
+    key = np.ravel_multi_index([codes[x] for x in dims], [sizes[x] for x in dims])
+    uniques, inverse = np.unique(key, return_inverse=True)
+    inverse = inverse.ravel()
+    sums = {}
+    for k, v in measures.items():
+        if v.dtype.kind in 'iu':
+            sums[k] = _int_sums(inverse, v, len(uniques))
+        else:
+            sums[k] = np.bincount(inverse, weights=v, minlength=len(uniques))
+    group_codes = np.unravel_index(uniques, [sizes[x] for x in dims])
+    return dict(zip(dims, group_codes)), sums
+
+
+def _sum_dtype(values):
+    return np.int64 if values.dtype.kind in 'iu' else np.float64
+
+
+# int64 sums of integer values by group (inverse: group of each value)
+# When no sum can pass 2^53 (e.g. counts), the float64 bincount is exact and much faster
+# than np.add.at, otherwise the values are added as integers
+def _int_sums(inverse, values, n_groups):
+    if not len(values) or max(int(values.max()), -int(values.min())) * len(values) < 2 ** 53:
+        return np.bincount(inverse, weights=values, minlength=n_groups).astype(np.int64)
+    sums = np.zeros(n_groups, dtype=np.int64)
+    np.add.at(sums, inverse, values)
+    return sums
+
+
+def _freeze(value):
+    if isinstance(value, slice):
+        return ('slice', value.start, value.stop)
+    if isinstance(value, (list, tuple, set, np.ndarray, pd.Index)):
+        return ('in',) + tuple(sorted(value))
+    return ('eq', value)
+
+
+class SummaryQuery(object):
+
+    # frame: summary table, dims: its key columns, measures: its summed columns
+    # rollups: lists of dims (including year / month / day) to pre-sum the table over
+    def __init__(self, frame, dims, measures, rollups=(), cache_size=128):
+        self.measures = list(measures)
+        self.levels = {}
+        codes = {}
+        for x in dims:
+            if isinstance(frame[x].dtype, pd.CategoricalDtype):
+                # Reuse the categorical codes, renumbered in sorted order of the names
+                col = frame[x].cat.remove_unused_categories()
+                names = np.asarray(col.cat.categories)
+                order = np.argsort(names, kind='mergesort')
+                rank = np.empty(len(order), dtype=np.intp)
+                rank[order] = np.arange(len(order))
+                codes[x] = rank[col.cat.codes.values]
+                self.levels[x] = pd.Index(names[order])
+            else:
+                codes[x], uniques = pd.factorize(frame[x], sort=True)
+                self.levels[x] = pd.Index(uniques)
+        if 'date' in dims:
+            dates = pd.DatetimeIndex(self.levels['date'])
+            for part, f in date_parts.items():
+                if part not in dims:
+                    part_codes, self.levels[part] = pd.factorize(f(dates), sort=True)
+                    self.levels[part] = pd.Index(self.levels[part])
+                    codes[part] = part_codes[codes['date']]
+        self.dims = list(codes)
+        self.sizes = dict((x, len(self.levels[x])) for x in self.dims)
+        values = dict((x, np.asarray(frame[x].values)) for x in self.measures)
+        # (dims, codes, measures) of the full table and each rollup
+        self.tables = [(set(self.dims), codes, values)]
+        for x in rollups:
+            group_codes, sums = _group(codes, values, list(x), self.sizes)
+            self.tables.append((set(x), group_codes, sums))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Codes of the levels of dim matching a where condition:
+    # a value, a list of values, or slice(lo, hi) for lo <= value <= hi
+    def _allowed(self, dim, value):
+        levels = self.levels[dim]
+        allowed = np.zeros(len(levels), dtype=bool)
+        if isinstance(value, slice):
+            lo, hi = value.start, value.stop
+            if isinstance(levels, pd.DatetimeIndex):
+                lo, hi = [None if x is None else pd.Timestamp(x) for x in (lo, hi)]
+            allowed[:] = True
+            if lo is not None:
+                allowed &= levels >= lo
+            if hi is not None:
+                allowed &= levels <= hi
+            return allowed
+        if not isinstance(value, (list, tuple, set, np.ndarray, pd.Index)):
+            value = [value]
+        value = list(value)
+        if isinstance(levels, pd.DatetimeIndex):
+            value = pd.to_datetime(value)
+        idx = levels.get_indexer(value)
+        allowed[idx[idx >= 0]] = True
+        return allowed
+
+    def _run(self, by, where, measures):
+        dims = set(by) | set(where)
+        unknown = dims - set(self.dims)
+        if unknown:
+            raise KeyError('unknown dimensions: ' + ', '.join(sorted(unknown)))
+        table_dims, codes, values = min((x for x in self.tables if dims <= x[0]), key=lambda x: len(x[2][self.measures[0]]))
+        n = len(values[self.measures[0]])
+        mask = np.ones(n, dtype=bool)
+        for dim, value in where.items():
+            mask &= self._allowed(dim, value)[codes[dim]]
+        if not mask.all():
+            codes = dict((x, codes[x][mask]) for x in by)
+            values = dict((x, values[x][mask]) for x in measures)
+        else:
+            values = dict((x, values[x]) for x in measures)
+        group_codes, sums = _group(codes, values, list(by), self.sizes)
+        out = dict((x, self.levels[x].take(group_codes[x])) for x in by)
+        out.update(sums)
+        return pd.DataFrame(out, columns=list(by) + list(measures))
+
+    # Sums of measures (default all) grouped by the dims in by, over the rows matching
+    # where ({dim: value, list of values or slice(lo, hi)}), sorted by the by dims
+    def query(self, by=(), where=None, measures=None):
+        by = [by] if isinstance(by, str) else list(by)
+        where = where or {}
+        measures = self.measures if measures is None else ([measures] if isinstance(measures, str) else list(measures))
+        key = (tuple(by), tuple(sorted((k, _freeze(v)) for k, v in where.items())), tuple(measures))
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key].copy()
+        self.misses += 1
+        result = self._run(by, where, measures)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result.copy()
+
+    def clear_cache(self):
+        self.cache.clear()
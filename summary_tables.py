@@ -0,0 +1,141 @@
+# Compact layout of pickups_hdl (pickups by nbhd / date / hour), for
+# create_summary_data.py and nyc_taxi_analysis.py
+# pickups_hdl has a row for every nbhd, date and hour, so anything stored per row
+# adds up: borough / nbhd are kept as categoricals (integer codes into one list of
+# names), counts as int32 and the calendar columns as int8, and the weather
+# (one row per date in jfk_weather.csv) is only joined onto the rows that need it
+# The zero counts (nbhd / date / hour combinations without pickups) can be filled in
+# through a dense nbhd x date x hour array (fill_zeros), either when the table is
+# created or only by the code that needs them
+import numpy as np, pandas as pd
+
+# Types of the pickups_hdl columns (date is parsed separately)
+pickups_hdl_dtypes = {'borough': 'category', 'nbhd': 'category', 'hour': np.int8, 'passenger_count': np.int32,
+                      'holiday': np.int8, 'day_of_week': np.int8, 'month': np.int8, 'year': np.int16}
+
+
+# Converts the pickups_hdl columns to their compact types (other columns are left as is)
+def compact_pickups_hdl(frame):
+    for col, dtype in pickups_hdl_dtypes.items():
+        if col in frame.columns:
+            frame[col] = frame[col].astype(dtype)
+    return frame
+
+
+# Reads pickups_hdl saved by create_summary_data.py (CSV or Parquet), in the compact types
+# years: only keep these years (with Parquet, only their folders are read)
+def read_pickups_hdl(path, years=None):
+    if path.endswith('.parquet'):
+        import trip_store
+        frame = trip_store.read_summary(path, filters=[('year', 'in', list(years))] if years else None)
+    else:
+        # skip the saved index column, and set the types while parsing
+        frame = pd.read_csv(path, usecols=lambda x: not x.startswith('Unnamed'),
+                            dtype=dict((k, v) for k, v in pickups_hdl_dtypes.items() if k != 'year'))
+    frame['date'] = pd.to_datetime(frame.date, format='%Y-%m-%d')
+    frame['year'] = frame.date.dt.year
+    if years and not path.endswith('.parquet'):
+        frame = frame[frame.year.isin(years)].reset_index(drop=True)
+    return compact_pickups_hdl(frame)
+
+
+# Daily weather (jfk_weather.csv), indexed by date
+def read_weather(path):
+    weather = pd.read_csv(path)
+    weather['EST'] = pd.to_datetime(weather.EST, format='%m/%d/%Y')
+    return weather.set_index('EST')
+
+
+# Adds the weather columns (all, or only cols) for each row's date
+# Rows on dates without weather get NaN, as with a left merge on date
+def join_weather(frame, weather, cols=None):
+    weather = weather if cols is None else weather[cols]
+    weather = weather[~weather.index.duplicated()].reindex(frame.date.values)
+    weather.index = frame.index
+    return pd.concat([frame, weather], axis=1)
+
+
+# Dense array of counts (nbhds x dates x hours) from a table of pickups by nbhd / date / hour
+# nbhds: table of borough / nbhd pairs to use as the first axis (by default those in frame),
+# dates / hours: values of the other axes (by default those in frame)
+# Returns the counts and the (sorted) nbhd pairs, dates and hours along each axis
+def pickups_hdl_cube(frame, col='passenger_count', nbhds=None, dates=None, hours=None):
+    pairs = pd.MultiIndex.from_frame(frame[['borough', 'nbhd']].astype(object))
+    if nbhds is None:
+        nbhd_index = pairs.unique().sort_values()
+    else:
+        nbhd_index = pd.MultiIndex.from_frame(nbhds[['borough', 'nbhd']].astype(object)).unique().sort_values()
+    dates = np.unique(frame.date.values if dates is None else np.asarray(dates))
+    hours = np.unique(frame.hour.values if hours is None else np.asarray(hours))
+    i = nbhd_index.get_indexer(pairs)
+    j = np.searchsorted(dates, frame.date.values)
+    k = np.searchsorted(hours, frame.hour.values)
+    # Rows outside the given axes are left out
+    keep = ((i >= 0) & (j < len(dates)) & (k < len(hours)) &
+            (dates[np.minimum(j, len(dates) - 1)] == frame.date.values) &
+            (hours[np.minimum(k, len(hours) - 1)] == frame.hour.values))
+    values = frame[col].values
+    counts = np.zeros((len(nbhd_index), len(dates), len(hours)), dtype=np.result_type(values.dtype, np.int32))
+    np.add.at(counts, (i[keep], j[keep], k[keep]), values[keep])
+    return counts, nbhd_index.to_frame(index=False), dates, hours
+
+
+# Long table (sorted by borough, nbhd, date, hour) of a dense array of counts
+def cube_to_frame(counts, nbhds, dates, hours, col='passenger_count'):
+    n_nbhds, n_dates, n_hours = counts.shape
+    borough = pd.Categorical(nbhds.borough.values)
+    nbhd = pd.Categorical(nbhds.nbhd.values)
+    return pd.DataFrame({'borough': pd.Categorical.from_codes(np.repeat(borough.codes, n_dates * n_hours),
+                                                              borough.categories),
+                         'nbhd': pd.Categorical.from_codes(np.repeat(nbhd.codes, n_dates * n_hours), nbhd.categories),
+                         'date': np.tile(np.repeat(dates, n_hours), n_nbhds),
+                         'hour': np.tile(hours, n_nbhds * n_dates).astype(np.int8),
+                         col: counts.ravel()})
+
+
+# Adds rows with zero counts for the nbhd / date / hour combinations missing from frame
+# (see pickups_hdl_cube for nbhds / dates / hours)
+# Columns that only depend on the date (holiday, day_of_week, month, year, weather ...)
+# are carried over to the new rows; any others are dropped
+def fill_zeros(frame, col='passenger_count', nbhds=None, dates=None, hours=None):
+    counts, nbhds, dates, hours = pickups_hdl_cube(frame, col, nbhds, dates, hours)
+    out = cube_to_frame(counts, nbhds, dates, hours, col)
+    date_cols = [x for x in frame.columns if x not in ('borough', 'nbhd', 'date', 'hour', col)]
+    if date_cols:
+        by_date = frame[['date'] + date_cols].drop_duplicates('date').set_index('date').reindex(dates)
+        for x in date_cols:
+            out[x] = np.tile(np.repeat(by_date[x].values, len(hours)), len(nbhds))
+    return compact_pickups_hdl(out)
+
+
+# Saves a long table (one row per key combination) as a compressed sparse tensor:
+# for each key column, its sorted unique values (the axis) and each row's position
+# on that axis (as the smallest integer type that fits), plus the value columns
+# (integers also stored in the smallest type that fits)
+def save_sparse_tensor(frame, path, keys):
+    arrays = {'columns': np.array([str(x) for x in frame.columns]), 'keys': np.array(keys)}
+    for x in frame.columns:
+        if x in keys:
+            codes, uniques = pd.factorize(frame[x], sort=True)
+            uniques = np.asarray(uniques)
+            arrays['axis_' + x] = uniques.astype(str) if uniques.dtype == object else uniques
+            arrays['index_' + x] = codes.astype(np.min_scalar_type(max(len(uniques) - 1, 0)))
+        elif pd.api.types.is_integer_dtype(frame[x].dtype):
+            arrays['value_' + x] = pd.to_numeric(frame[x], downcast='integer').values
+        else:
+            arrays['value_' + x] = frame[x].values
+    np.savez_compressed(path, **arrays)
+
+
+# Reads a table saved by save_sparse_tensor (text keys come back as categoricals)
+def load_sparse_tensor(path):
+    out = {}
+    with np.load(path, allow_pickle=False) as f:
+        keys = f['keys'].tolist()
+        for x in f['columns'].tolist():
+            if x in keys:
+                axis, codes = f['axis_' + x], f['index_' + x].astype(np.intp)
+                out[x] = pd.Categorical.from_codes(codes, axis) if axis.dtype.kind == 'U' else axis[codes]
+            else:
+                out[x] = f['value_' + x]
+    return pd.DataFrame(out)
@@ -0,0 +1,133 @@
+# Forecasts of pickup_service.PickupForecaster on a small synthetic table of pickups by
+# nbhd / date / hour, with a linear model standing in for the random forest
+# python -m pytest tests
+import os, sys, json, threading
+from urllib.request import urlopen
+from urllib.error import HTTPError
+import numpy as np, pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from covariate_store import CovariateStore
+from pickup_lags import LagFeatures
+from pickup_model import feature_matrix
+from pickup_service import PickupForecaster, PredictionService, make_server
+
+nbhds = pd.DataFrame({'borough': ['Bronx', 'Manhattan', 'Queens'], 'nbhd': ['Allerton', 'Chelsea', 'Astoria']})
+weather_col = 'Mean TemperatureF'
+
+
+class LinearModel(object):
+
+    def fit(self, X, y):
+        self.w = np.linalg.lstsq(np.c_[X, np.ones(len(X))], y, rcond=None)[0]
+        return self
+
+    def predict(self, X):
+        return np.c_[X, np.ones(len(X))] @ self.w
+
+
+# Pickups of every nbhd and hour on dates from start to end
+def pickups(start, end, seed=0):
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range(start, end)
+    index = pd.MultiIndex.from_product([range(len(nbhds)), dates, range(24)], names=['i', 'date', 'hour'])
+    frame = index.to_frame(index=False)
+    frame = pd.concat([nbhds.iloc[frame.i].reset_index(drop=True), frame.drop('i', axis=1)], axis=1)
+    frame['passenger_count'] = rng.poisson(5 + frame.hour.values % 6)
+    return frame
+
+
+# Daily weather from start to end
+def weather(start, end):
+    dates = pd.date_range(start, end)
+    return CovariateStore(dates[0], len(dates)).add(weather_col, dates.values, 50 + np.arange(len(dates)) % 10)
+
+
+# Forecaster fitted on the pickups of January and February 2015 (weather up to the end of February)
+@pytest.fixture
+def forecaster():
+    frame = pickups('2015-01-01', '2015-02-28')
+    covariates = weather('2015-01-01', '2015-02-28')
+    lags = LagFeatures.from_frame(frame, nbhds=nbhds)
+    train = frame.assign(holiday=(frame.date == '2015-01-19').astype(int), day_of_week=frame.date.dt.dayofweek,
+                         month=frame.date.dt.month)
+    train = lags.add_features(covariates.join(train), fill=-1)
+    X, names = feature_matrix(train)
+    model = LinearModel().fit(X, train.passenger_count.values)
+    return PickupForecaster.from_training(model, train, names, covariates, lags), model, train, X
+
+
+def test_matches_training_rows(forecaster):
+    fc, model, train, X = forecaster
+    out = fc.predict('2015-02-10 22:00', 3)
+    rows = train.set_index(['borough', 'nbhd', 'date', 'hour']).index.get_indexer(
+        pd.MultiIndex.from_frame(out[['borough', 'nbhd', 'date', 'hour']].astype({'borough': object, 'nbhd': object})))
+    assert (rows >= 0).all()
+    np.testing.assert_allclose(out.pickups.values, model.predict(X[rows]), rtol=1e-5)
+    # (the table's calendar columns are kept, the lags only add their own)
+    assert fc.feature_names.count('holiday') == 1 and 'weekend' not in fc.feature_names
+    holiday = fc.feature_names.index('holiday')
+    assert fc.features(pd.Timestamp('2015-01-19'), 8)[:, holiday].all()
+    assert not fc.features(pd.Timestamp('2015-01-20'), 8)[:, holiday].any()
+
+
+def test_forecasts_past_the_data(forecaster):
+    fc = forecaster[0]
+    # (the day after the last date, with the weather of the last one)
+    out = fc.predict('2015-03-01 06:00', 4)
+    assert out.shape[0] == 4 * len(nbhds) and np.isfinite(out.pickups).all()
+    with pytest.raises(KeyError):
+        fc.predict('2015-03-10 06:00')
+
+
+def test_forecasts_after_add_pickups(forecaster):
+    fc = forecaster[0]
+    new = pickups('2015-03-01', '2015-03-20', seed=1)
+    fc.predict('2015-03-02 08:00')
+    fc.add_pickups(new, weather('2015-01-01', '2015-03-20'))
+    out = fc.predict('2015-03-21 08:00', 2)
+    assert out.shape[0] == 2 * len(nbhds) and np.isfinite(out.pickups).all()
+    # the lags come from the added pickups (cached rows of earlier dates are dropped)
+    rows = fc.features(pd.Timestamp('2015-03-21'), 8)
+    lag_1d = rows[:, fc.feature_names.index('lag_1d')]
+    expected = new[(new.date == '2015-03-20') & (new.hour == 8)].set_index(['borough', 'nbhd']).passenger_count
+    np.testing.assert_array_equal(lag_1d, expected.loc[list(map(tuple, nbhds.values))].values)
+    rows = fc.features(pd.Timestamp('2015-03-02'), 8)
+    first = new[(new.date == '2015-03-01') & (new.hour == 8)].passenger_count.values
+    np.testing.assert_array_equal(rows[:, fc.feature_names.index('lag_1d')], first)
+
+
+class FailingModel(object):
+
+    def predict(self, X):
+        raise RuntimeError('model failed')
+
+
+# Status and JSON body of GET path from a server for forecaster
+def get(forecaster, path):
+    service = PredictionService(forecaster)
+    server = make_server(service, port=0, max_hours=24)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with urlopen('http://127.0.0.1:%d%s' % (server.server_address[1], path)) as r:
+            return r.status, json.loads(r.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        service.close()
+
+
+def test_server(forecaster):
+    fc = forecaster[0]
+    status, body = get(fc, '/predict?start=2015-02-10T22&hours=3')
+    assert status == 200 and len(body['hours']) == 3 and len(body['hours'][0]['pickups']) == len(nbhds)
+    for hours in ['0', '-1', '25', 'x']:
+        assert get(fc, '/predict?start=2015-02-10T22&hours=' + hours)[0] == 400
+    fc.model = FailingModel()
+    status, body = get(fc, '/predict?start=2015-02-10T22')
+    assert status == 500 and 'model failed' in body['error']
@@ -0,0 +1,98 @@
+# Running sums of summary_cube.py against a pandas groupby of all the rows added
+# python -m pytest tests
+import os, sys
+import numpy as np, pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from summary_cube import KeyedCube, SparseCube
+
+axes = [['date'], ['rounded_lon', 'rounded_lat'], ['hour']]
+key_cols = ['date', 'rounded_lon', 'rounded_lat', 'hour']
+cols = ['passenger_count', 'trip_distance']
+
+
+# Chunks of trips with more keys in each, so the cube grows as they are added
+def chunks(n_chunks=5, rows=400, seed=0):
+    rng = np.random.RandomState(seed)
+    out = []
+    for i in range(n_chunks):
+        n_dates, n_coords = 2 + 3 * i, 3 + 5 * i
+        out.append(pd.DataFrame({
+            'date': pd.Timestamp('2015-05-01') + pd.to_timedelta(rng.randint(0, n_dates, rows), unit='D'),
+            'rounded_lon': np.round(-74 + 0.001 * rng.randint(0, n_coords, rows), 3),
+            'rounded_lat': np.round(40.7 + 0.001 * rng.randint(0, n_coords, rows), 3),
+            'hour': rng.randint(0, 24, rows),
+            'passenger_count': rng.randint(1, 7, rows).astype(np.int64),
+            'trip_distance': rng.uniform(0, 10, rows)}))
+    return out
+
+
+def expected(frames):
+    return pd.concat(frames).groupby(key_cols, as_index=False)[cols].sum()
+
+
+def check(cube, frames):
+    out = cube.to_frame()
+    want = expected(frames)
+    assert list(out.columns) == key_cols + cols
+    pd.testing.assert_frame_equal(out[key_cols], want[key_cols], check_dtype=False)
+    np.testing.assert_array_equal(out.passenger_count.values, want.passenger_count.values)
+    np.testing.assert_allclose(out.trip_distance.values, want.trip_distance.values)
+    assert out.passenger_count.dtype.kind == 'i'
+
+
+@pytest.mark.parametrize('cls', [KeyedCube, SparseCube])
+def test_matches_groupby(cls):
+    frames = chunks()
+    cube = cls(axes, cols)
+    for x in frames:
+        cube.add(x)
+    check(cube, frames)
+
+
+@pytest.mark.parametrize('cls', [KeyedCube, SparseCube])
+def test_to_frame_between_adds(cls):
+    frames = chunks(seed=1)
+    cube = cls(axes, cols)
+    for i, x in enumerate(frames):
+        cube.add(x)
+        check(cube, frames[:i + 1])
+
+
+def test_keyed_cube_grows():
+    frames = chunks(seed=2)
+    cube = KeyedCube(axes, cols)
+    capacities = []
+    for x in frames:
+        cube.add(x)
+        capacities.append(cube.seen.shape)
+        assert all(n <= c for n, c in zip(cube.shape, cube.seen.shape))
+    assert capacities[-1] != capacities[0]
+    check(cube, frames)
+
+
+def test_keyed_cube_widens_values():
+    first = chunks(1, seed=3)[0]
+    second = first.assign(passenger_count=first.passenger_count + 0.5)
+    cube = KeyedCube(axes, cols).add(first).add(second)
+    out = cube.to_frame()
+    np.testing.assert_allclose(out.passenger_count.values, expected([first, second]).passenger_count.values)
+
+
+def test_sparse_cube_merges():
+    frames = chunks(seed=4)
+    cube = SparseCube(axes, cols)
+    # (merges every few chunks, and leaves some pending for to_frame)
+    cube.merge_rows = 900
+    n_merged = []
+    for x in frames:
+        cube.add(x)
+        n_merged.append(len(cube.index))
+    assert n_merged[0] == 0 and n_merged[-1] > 0 and cube.pending
+    check(cube, frames)
+
+
+def test_sparse_cube_empty():
+    out = SparseCube(axes, cols).to_frame()
+    assert out.shape[0] == 0 and list(out.columns) == key_cols + cols
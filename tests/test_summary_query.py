@@ -0,0 +1,108 @@
+# Queries of summary_query.SummaryQuery (with and without rollups) against a pandas
+# groupby of the table, and its cache
+# python -m pytest tests
+import os, sys
+import numpy as np, pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from summary_query import SummaryQuery
+
+dims = ['borough', 'nbhd', 'date', 'hour']
+measures = ['passenger_count', 'trip_distance']
+rollups = [['borough'], ['nbhd', 'hour'], ['borough', 'year']]
+
+
+# Pickups by nbhd / date / hour, as pickups_hdl (compact: categorical nbhds, int32 counts)
+def table(seed=0):
+    rng = np.random.RandomState(seed)
+    nbhds = pd.DataFrame({'borough': ['Bronx', 'Bronx', 'Manhattan', 'Queens'],
+                          'nbhd': ['Allerton', 'Belmont', 'Chelsea', 'Astoria']})
+    index = pd.MultiIndex.from_product([range(len(nbhds)), pd.date_range('2014-12-20', '2015-01-10'), range(24)],
+                                       names=['i', 'date', 'hour']).to_frame(index=False)
+    frame = pd.concat([nbhds.iloc[index.i].reset_index(drop=True), index[['date', 'hour']]], axis=1)
+    frame = frame.sample(frac=0.8, random_state=seed).reset_index(drop=True)
+    frame['borough'] = frame.borough.astype('category')
+    frame['passenger_count'] = rng.randint(0, 50, frame.shape[0]).astype(np.int32)
+    frame['trip_distance'] = rng.uniform(0, 10, frame.shape[0])
+    return frame
+
+
+def expected(frame, by, where=lambda x: x):
+    frame = where(frame.assign(year=frame.date.dt.year, day=frame.date.dt.dayofweek))
+    return frame.groupby(by, observed=True, as_index=False)[measures].sum()
+
+
+def check(out, want, by):
+    assert list(out.columns) == by + measures
+    pd.testing.assert_frame_equal(out[by].astype(object), want[by].astype(object), check_dtype=False)
+    np.testing.assert_array_equal(out.passenger_count.values, want.passenger_count.values)
+    assert out.passenger_count.dtype == np.int64
+    np.testing.assert_allclose(out.trip_distance.values, want.trip_distance.values)
+
+
+@pytest.mark.parametrize('with_rollups', [False, True])
+@pytest.mark.parametrize('by, where, mask', [
+    (['borough'], None, lambda x: x),
+    (['nbhd', 'hour'], {'borough': 'Bronx'}, lambda x: x[x.borough == 'Bronx']),
+    (['borough', 'year'], {'hour': [22, 23, 0]}, lambda x: x[x.hour.isin([22, 23, 0])]),
+    (['day', 'hour'], {'date': slice('2015-01-01', '2015-01-05')},
+     lambda x: x[(x.date >= '2015-01-01') & (x.date <= '2015-01-05')]),
+    (['nbhd'], {'year': 2015, 'hour': slice(8, 10)}, lambda x: x[(x.year == 2015) & x.hour.between(8, 10)]),
+])
+def test_matches_groupby(with_rollups, by, where, mask):
+    frame = table()
+    query = SummaryQuery(frame, dims, measures, rollups=rollups if with_rollups else ())
+    check(query.query(by, where), expected(frame, by, mask), by)
+
+
+def test_total():
+    frame = table(1)
+    out = SummaryQuery(frame, dims, measures, rollups=rollups).query()
+    assert out.passenger_count[0] == frame.passenger_count.astype(np.int64).sum()
+
+
+def test_integer_sums_are_exact():
+    # (sums past 2^53, where float64 sums would round)
+    frame = table(2).iloc[:3]
+    frame = frame.assign(borough='Bronx', passenger_count=np.array([2 ** 60, 1, 3], dtype=np.int64))
+    for x in [(), [['borough']]]:
+        out = SummaryQuery(frame, dims, measures, rollups=x).query('borough')
+        assert out.passenger_count[0] == 2 ** 60 + 4
+
+
+def test_int32_sums_dont_overflow():
+    frame = table(3)
+    frame['passenger_count'] = np.full(frame.shape[0], 2 ** 30, dtype=np.int32)
+    out = SummaryQuery(frame, dims, measures, rollups=rollups).query('borough')
+    want = frame.groupby('borough', observed=True).passenger_count.count().values * 2 ** 30
+    np.testing.assert_array_equal(out.passenger_count.values, want)
+
+
+def test_cache():
+    frame = table(4)
+    query = SummaryQuery(frame, dims, measures, rollups=rollups, cache_size=2)
+    first = query.query('borough', {'hour': [1, 2]})
+    # (the same where in another order is the same query)
+    query.query('borough', {'hour': [2, 1]})
+    assert (query.hits, query.misses) == (1, 1)
+    # results are copies, changing one doesn't change the cached result
+    first['passenger_count'] = 0
+    check(query.query('borough', {'hour': [1, 2]}), expected(frame, ['borough'], lambda x: x[x.hour.isin([1, 2])]),
+          ['borough'])
+    assert query.hits == 2
+    # the least recently used result is dropped past cache_size
+    query.query('nbhd')
+    query.query('hour')
+    assert len(query.cache) == 2
+    query.query('borough', {'hour': [1, 2]})
+    assert query.misses == 4
+    query.clear_cache()
+    assert not query.cache
+    query.query('hour')
+    assert query.misses == 5
+
+
+def test_unknown_dimension():
+    with pytest.raises(KeyError):
+        SummaryQuery(table(5), dims, measures).query('month_name')
@@ -0,0 +1,98 @@
+# Downloads of trip_download.py from a local HTTP server (with Range support): resuming a
+# partial file, skipping completed files, and fetching again files whose size changed
+# python -m pytest tests
+import os, sys, gzip, json, threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import trip_download
+from trip_download import download_file, download_all
+
+content = b''.join(b'2,2015-05-01 %02d:00:00,1,-73.9,40.7\n' % (i % 24) for i in range(5000))
+
+
+class Handler(BaseHTTPRequestHandler):
+    # (requests received, as (method, path, Range header))
+    requests = []
+
+    def _send(self, body):
+        rng = self.headers.get('Range')
+        self.requests.append((self.command, self.path, rng))
+        if self.path != '/trips.csv':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start = int(rng[len('bytes='):-1]) if rng else 0
+        self.send_response(206 if rng else 200)
+        if rng:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        if body:
+            self.wfile.write(content[start:])
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def do_GET(self):
+        self._send(True)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # (small blocks and members, so the test file is several gzip members)
+    monkeypatch.setattr(trip_download, 'block_size', 1000)
+    monkeypatch.setattr(trip_download, 'checkpoint_size', 20000)
+    Handler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield 'http://127.0.0.1:%d/trips.csv' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def read_gz(path):
+    with gzip.open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resumes_partial_file(url):
+    # a partial file of the first 30000 bytes (one gzip member) and some of a second member
+    with open('trips.gz.part', 'wb') as f:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f) as member:
+            member.write(content[:30000])
+        gz_bytes = f.tell()
+        f.write(b'\x1f\x8b partial member')
+    with open('trips.gz.part.json', 'w') as f:
+        json.dump({'raw_bytes': 30000, 'gz_bytes': gz_bytes}, f)
+    assert download_file(url, 'trips.gz') == len(content)
+    assert ('GET', '/trips.csv', 'bytes=30000-') in Handler.requests
+    assert read_gz('trips.gz') == content
+    assert not os.path.exists('trips.gz.part') and not os.path.exists('trips.gz.part.json')
+
+
+def test_skips_completed_file(url):
+    manifest = download_all([(url, 'trips.gz')], n_threads=1)
+    assert manifest['trips.gz']['raw_bytes'] == len(content)
+    Handler.requests = []
+    assert download_all([(url, 'trips.gz')], n_threads=1) == manifest
+    assert Handler.requests == []
+
+
+def test_fetches_file_with_other_size(url):
+    download_all([(url, 'trips.gz')], n_threads=1)
+    with open('trips.gz', 'ab') as f:
+        f.write(b'not part of the download')
+    Handler.requests = []
+    manifest = download_all([(url, 'trips.gz')], n_threads=1)
+    assert ('GET', '/trips.csv', None) in Handler.requests
+    assert read_gz('trips.gz') == content
+    assert manifest['trips.gz']['size'] == os.path.getsize('trips.gz')
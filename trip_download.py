@@ -0,0 +1,128 @@
+# Downloads the raw trip files for data_download.py
+# Each response is streamed straight into a gzip file (no DataFrame / CSV round
+# trip), several files are downloaded at once in a pool of threads, and files
+# completed so far are recorded in a manifest, so they are skipped on the next run
+# An interrupted download resumes with an HTTP Range request: the gzip file is
+# written as a series of gzip members, and after each member the number of raw
+# bytes received is saved next to the partial file (<file>.part.json)
+import os, json, gzip, threading, requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline_log import PipelineLog
+
+# Bytes read from the response at a time
+block_size = 1 << 20
+# Raw bytes per gzip member (how much is downloaded again after an interruption)
+checkpoint_size = 64 << 20
+
+
+def _save_json(path, obj):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+# Downloads url to file_name (gzip compressed), resuming a partial download if there is one
+# Returns the number of raw bytes downloaded, or None if the file doesn't exist on the server
+def download_file(url, file_name, session=None, timeout=60):
+    session = session or requests.Session()
+    part_file = file_name + '.part'
+    state_file = part_file + '.json'
+    state = {'raw_bytes': 0, 'gz_bytes': 0}
+    if os.path.exists(part_file) and os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    head = session.head(url, allow_redirects=True, timeout=timeout)
+    if head.status_code == 404:
+        return None
+    head.raise_for_status()
+    total_bytes = int(head.headers['Content-Length']) if 'Content-Length' in head.headers else None
+    headers = {'Range': 'bytes=%d-' % state['raw_bytes']} if state['raw_bytes'] > 0 else {}
+    r = session.get(url, headers=headers, stream=True, timeout=timeout)
+    r.raise_for_status()
+    if state['raw_bytes'] > 0 and r.status_code != 206:
+        # Server ignored the range, start over
+        state = {'raw_bytes': 0, 'gz_bytes': 0}
+    with open(part_file, 'r+b' if state['gz_bytes'] > 0 else 'wb') as f:
+        # Drop anything written after the last complete gzip member
+        f.truncate(state['gz_bytes'])
+        f.seek(state['gz_bytes'])
+        member = gzip.GzipFile(filename='', mode='wb', fileobj=f)
+        member_bytes = 0
+        for block in r.iter_content(block_size):
+            member.write(block)
+            state['raw_bytes'] += len(block)
+            member_bytes += len(block)
+            if member_bytes >= checkpoint_size:
+                member.close()
+                f.flush()
+                state['gz_bytes'] = f.tell()
+                _save_json(state_file, state)
+                member = gzip.GzipFile(filename='', mode='wb', fileobj=f)
+                member_bytes = 0
+        member.close()
+    r.close()
+    if total_bytes is not None and state['raw_bytes'] != total_bytes:
+        raise IOError('%s: got %d of %d bytes' % (url, state['raw_bytes'], total_bytes))
+    os.replace(part_file, file_name)
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    return state['raw_bytes']
+
+
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+# Downloads each (url, file name) pair in jobs, n_threads at a time
+# Files listed in the manifest (and still on disk, same size) are skipped
+# Each download is written to log (a pipeline_log.PipelineLog) as a download record
+# Returns the manifest of downloaded files
+def download_all(jobs, n_threads=4, manifest_file='download_manifest.json', timeout=60, log=None):
+    log = log or PipelineLog()
+    manifest = load_manifest(manifest_file)
+    # Files downloaded before there was a manifest (complete, since there is no partial file)
+    for url, file_name in jobs:
+        if file_name not in manifest and os.path.exists(file_name) and not os.path.exists(file_name + '.part'):
+            manifest[file_name] = {'url': url, 'raw_bytes': None, 'size': os.path.getsize(file_name)}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def run(url, file_name):
+        # requests sessions aren't thread safe, so one per thread
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        stage = log.begin('download', file=file_name, url=url)
+        try:
+            raw_bytes = download_file(url, file_name, local.session, timeout)
+        except Exception as e:
+            log.end(stage, status='error', error=type(e).__name__ + ': ' + str(e))
+            raise
+        log.end(stage, status='ok' if raw_bytes is not None else 'missing', bytes=raw_bytes,
+                gz_bytes=os.path.getsize(file_name) if raw_bytes is not None else None)
+        if raw_bytes is not None:
+            with lock:
+                manifest[file_name] = {'url': url, 'raw_bytes': raw_bytes,
+                                       'size': os.path.getsize(file_name)}
+                _save_json(manifest_file, manifest)
+        return raw_bytes
+
+    todo = [(url, file_name) for url, file_name in jobs
+            if not (file_name in manifest and os.path.exists(file_name) and
+                    os.path.getsize(file_name) == manifest[file_name]['size'])]
+    failed = []
+    with ThreadPoolExecutor(n_threads) as pool:
+        futures = dict((pool.submit(run, url, file_name), file_name) for url, file_name in todo)
+        for future in as_completed(futures):
+            try:
+                if future.result() is not None:
+                    print(futures[future])
+            except (IOError, requests.RequestException) as e:
+                # Partial file is kept, so the next run resumes it
+                print(futures[future] + ' failed: ' + str(e))
+                failed.append(futures[future])
+    if failed:
+        raise IOError('%d downloads failed, rerun to resume: %s' % (len(failed), ', '.join(sorted(failed))))
+    return manifest
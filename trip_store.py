@@ -0,0 +1,125 @@
+# Columnar (Parquet) storage for the trip data and summaries
+# Trips are stored partitioned by type / year / month, e.g.
+# trip_store/type=yellow/year=2015/month=5/part-0.parquet
+# with cleaned header names, parsed timestamps, categorical text columns and
+# float32 measures. Coordinates stay float64, so rounding them gives exactly
+# the same grid points as the CSV files
+# Reads can prune columns, and filter on type / year / month without opening
+# the other partitions
+# Requires pyarrow (the CSV files remain usable without it)
+import os, glob, shutil, pandas as pd
+import pyarrow as pa, pyarrow.parquet as pq
+from trip_summary import clean_col_names
+
+time_cols = ['pickup_time', 'dropoff_time']
+coord_cols = ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']
+cat_cols = ['vendor_name', 'vendor_id', 'vendorid', 'rate_code', 'ratecodeid', 'store_and_forward',
+            'store_and_fwd_flag', 'payment_type', 'trip_type']
+
+
+# Schema for a trip file, from its (cleaned) header names
+def trip_schema(col_names):
+    fields = []
+    for x in col_names:
+        if x in time_cols:
+            fields.append(pa.field(x, pa.timestamp('s')))
+        elif x in coord_cols:
+            fields.append(pa.field(x, pa.float64()))
+        elif x in cat_cols:
+            fields.append(pa.field(x, pa.dictionary(pa.int32(), pa.string())))
+        elif x == 'passenger_count':
+            fields.append(pa.field(x, pa.int8()))
+        else:
+            fields.append(pa.field(x, pa.float32()))
+    return pa.schema(fields)
+
+
+# Converts a chunk of raw trips to the storage types
+def typed_trips(tmp, schema):
+    tmp.columns = clean_col_names(tmp.columns.values.tolist())
+    tmp = tmp[schema.names].copy()
+    for x in schema.names:
+        if x in time_cols:
+            tmp[x] = pd.to_datetime(tmp[x], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        elif x in cat_cols:
+            tmp[x] = tmp[x].astype(str).str.strip().where(tmp[x].notnull(), None)
+        elif x == 'passenger_count':
+            # missing counts are dropped as 0 passengers when summarizing either way
+            tmp[x] = pd.to_numeric(tmp[x], errors='coerce').fillna(0).clip(-128, 127)
+        else:
+            tmp[x] = pd.to_numeric(tmp[x], errors='coerce')
+    return pa.Table.from_pandas(tmp, schema=schema, preserve_index=False)
+
+
+def partition_dir(root, trip_type, year, month):
+    return os.path.join(root, 'type=' + trip_type, 'year=' + str(int(year)), 'month=' + str(int(month)))
+
+
+# Converts one raw (CSV) trip file into its type / year / month partition
+def write_trips(file_name, root, trip_type, year, month, chunk_size=1000000):
+    out_dir = partition_dir(root, trip_type, year, month)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    out_file = os.path.join(out_dir, 'part-0.parquet')
+    col_names = pd.read_csv(file_name, nrows=0).columns.values.tolist()
+    schema = trip_schema([x for x in clean_col_names(col_names) if not x.startswith('unnamed')])
+    writer = pq.ParquetWriter(out_file + '.tmp', schema)
+    try:
+        # index_col=False: some raw files have extra delimiters at the end of each line
+        # (only the header's columns are read, and malformed lines are skipped)
+        for tmp in pd.read_csv(file_name, chunksize=chunk_size, index_col=False, usecols=range(len(col_names)),
+                               on_bad_lines='skip'):
+            writer.write_table(typed_trips(tmp, schema))
+    finally:
+        writer.close()
+    os.replace(out_file + '.tmp', out_file)
+    return out_dir
+
+
+# Partition directories in the store, optionally only some types / years / months
+def list_partitions(root, types=None, years=None, months=None):
+    parts = []
+    for x in sorted(glob.glob(os.path.join(root, 'type=*', 'year=*', 'month=*'))):
+        month_dir, month = os.path.split(x)
+        type_dir, year = os.path.split(month_dir)
+        trip_type = os.path.basename(type_dir)
+        if ((types is None or trip_type[5:] in types) and (years is None or int(year[5:]) in years) and
+                (months is None or int(month[6:]) in months)):
+            parts.append(x)
+    return parts
+
+
+# Reads trips from the store (or one partition of it), only the given columns
+# filters: list of (column, op, value) tuples, e.g. [('year', 'in', [2014, 2015])]
+def read_trips(path, columns=None, filters=None):
+    return pq.read_table(path, columns=columns, filters=filters, partitioning='hive').to_pandas()
+
+
+# Reads a partition in batches of batch_size rows, only the given columns
+def iter_trips(path, columns=None, batch_size=1000000):
+    for x in sorted(glob.glob(os.path.join(path, '*.parquet'))):
+        for batch in pq.ParquetFile(x).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+
+# Saves a summary table, with text columns stored as categoricals
+# (partition_cols, e.g. ['year'], splits the table into one folder per value)
+def write_summary(frame, path, partition_cols=None):
+    frame = frame.copy()
+    for x in frame.columns:
+        if x != 'date' and (frame[x].dtype == object or pd.api.types.is_string_dtype(frame[x].dtype)):
+            frame[x] = frame[x].astype('category')
+    if 'date' in frame.columns:
+        frame['date'] = pd.to_datetime(frame['date'])
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if partition_cols:
+        # write_to_dataset adds files to existing folders, so clear out the old table first
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        pq.write_to_dataset(table, path, partition_cols=partition_cols)
+    else:
+        pq.write_table(table, path)
+
+
+def read_summary(path, columns=None, filters=None):
+    return pq.read_table(path, columns=columns, filters=filters, partitioning='hive').to_pandas()
@@ -0,0 +1,356 @@
+# Helper functions for create_summary_data.py
+# Cleans a trip file (whole, or in fixed-size chunks) and summarizes it into
+# partial aggregates, which are added into running sums (summary_cube.py) across chunks / files
+import os, json, time, hashlib, numpy as np, pandas as pd
+from multiprocessing import Pool
+from summary_cube import KeyedCube, SparseCube
+from pipeline_log import PipelineLog, max_rss_mb
+from pickup_pyramid import grid_cells
+
+# Raw columns needed for the summaries (after cleaning the header names)
+trip_cols = ['pickup_time', 'dropoff_time', 'passenger_count', 'pickup_longitude', 'pickup_latitude',
+             'dropoff_longitude', 'dropoff_latitude', 'trip_distance', 'fare_amount', 'tip_amount', 'total_amount']
+
+# Group by keys / summed columns of each summary
+summary_keys = {'pickups_hd': ['rounded_lon', 'rounded_lat', 'day', 'hour'],
+                'date_avgs': ['date', 'type'],
+                'date_counts': ['date', 'type'],
+                'pickups_hdl': ['borough', 'nbhd', 'date', 'hour'],
+                'od_hdl': ['pickup_borough', 'pickup_nbhd', 'dropoff_borough', 'dropoff_nbhd', 'date', 'hour'],
+                'pickups_grid': ['grid_lon', 'grid_lat', 'hour']}
+# Format of the saved partial sums (saved partial sums in an older format are redone)
+partials_version = 4
+# Number of decimals of the finest level of the pickups pyramid (see pickup_pyramid.py):
+# pickups_grid sums the pickups by hour and cell of this level
+pyramid_dec = 4
+
+# Axes of the running sums for each summary (borough / nbhd of the
+# pickups_hd coords are carried along with the coords)
+summary_axes = {'pickups_hd': [['rounded_lon', 'rounded_lat', 'borough', 'nbhd'], ['day'], ['hour']],
+                'date_avgs': [['date'], ['type']],
+                'date_counts': [['date'], ['type']],
+                'pickups_hdl': [['borough', 'nbhd'], ['date'], ['hour']],
+                'od_hdl': [['pickup_borough', 'pickup_nbhd'], ['dropoff_borough', 'dropoff_nbhd'], ['date'], ['hour']],
+                'pickups_grid': [['grid_lon'], ['grid_lat'], ['hour']]}
+# Summaries kept as sparse running sums (only the key combinations with trips)
+sparse_summaries = ['od_hdl', 'pickups_grid']
+summary_cols = {'pickups_hd': ['passenger_count', 'trip_time_in_secs', 'trip_distance'],
+                'date_avgs': ['passenger_count', 'fare_amount', 'tip_amount', 'trip_distance'],
+                'date_counts': [0],
+                'pickups_hdl': ['passenger_count'],
+                'od_hdl': ['trips', 'trip_time_in_secs', 'fare_amount'],
+                'pickups_grid': ['passenger_count']}
+
+
+# Clean header names of some files
+def clean_col_names(col_names):
+    col_names = [x.strip(' ').lower() for x in col_names]
+    col_names = [x.replace('amt', 'amount') for x in col_names]
+    col_names = [x.replace('start_lon', 'pickup_longitude') for x in col_names]
+    col_names = [x.replace('start_lat', 'pickup_latitude') for x in col_names]
+    col_names = [x.replace('end_lon', 'dropoff_longitude') for x in col_names]
+    col_names = [x.replace('end_lat', 'dropoff_latitude') for x in col_names]
+    col_names = ['pickup_time' if 'pickup_datetime' in x else x for x in col_names]
+    col_names = ['dropoff_time' if 'dropoff_datetime' in x else x for x in col_names]
+    return col_names
+
+
+# Cleaning filters, applied in this order: (column, comparison, value)
+# e.g. passenger_count < 20 and 0 < passenger_count
+trip_filters = [('passenger_count', np.less, 20), ('rounded_lon', np.less, -73), ('rounded_lat', np.less, 41),
+                ('passenger_count', np.greater, 0), ('rounded_lon', np.greater, -75), ('rounded_lat', np.greater, 40),
+                ('trip_time_in_secs', np.greater, 0), ('trip_time_in_secs', np.less, 7200),
+                ('fare_amount', np.greater, 0), ('fare_amount', np.less, 200),
+                ('total_amount', np.greater, 0), ('total_amount', np.less, 200),
+                ('tip_amount', np.greater_equal, 0), ('tip_amount', np.less, 200),
+                ('trip_distance', np.greater, 0), ('trip_distance', np.less, 50)]
+
+
+def _parse_time(x):
+    if pd.api.types.is_datetime64_any_dtype(x):
+        return pd.DatetimeIndex(x)
+    return pd.DatetimeIndex(pd.to_datetime(x, format='%Y-%m-%d %H:%M:%S'))
+
+
+# Adds the rounded coords, the pyramid cells of the pickups and trip time, and drops records with values that don't make sense
+# Each timestamp column is parsed once (pickup_time is kept parsed), and all filters
+# are evaluated into one preallocated mask
+# If drop_counts (dict) is given, the number of records failing each filter is added to it
+# Returns the cleaned records and their trip speeds (miles / sec)
+def filter_trips(tmp, num_dec, drop_counts=None):
+    # (renamed into a new frame, the caller's keeps its columns)
+    tmp = tmp.set_axis(clean_col_names(tmp.columns.values.tolist()), axis=1)
+    pickup = _parse_time(tmp.pickup_time)
+    # (dropoff coords aren't filtered on: trips with bad dropoffs still count as pickups)
+    cols = {'rounded_lon': np.round(tmp.pickup_longitude.values, num_dec),
+            'rounded_lat': np.round(tmp.pickup_latitude.values, num_dec),
+            'rounded_dropoff_lon': np.round(tmp.dropoff_longitude.values, num_dec),
+            'rounded_dropoff_lat': np.round(tmp.dropoff_latitude.values, num_dec),
+            'trip_time_in_secs': (_parse_time(tmp.dropoff_time) - pickup).seconds.values}
+    n = tmp.shape[0]
+    keep = np.ones(n, dtype=bool)
+    test = np.empty(n, dtype=bool)
+    for col, op, value in trip_filters:
+        x = cols[col] if col in cols else tmp[col].values
+        op(x, value, out=test)
+        if drop_counts is not None:
+            name = col + (' < ' if op is np.less else ' > ' if op is np.greater else ' >= ') + str(value)
+            drop_counts[name] = drop_counts.get(name, 0) + n - int(np.count_nonzero(test))
+        np.logical_and(keep, test, out=keep)
+    out = tmp.loc[keep, [x for x in trip_cols if x not in ('pickup_time', 'dropoff_time')]]
+    out['pickup_time'] = pickup[keep]
+    for col in cols:
+        out[col] = cols[col][keep]
+    out['grid_lon'], out['grid_lat'] = grid_cells(out.pickup_longitude.values, out.pickup_latitude.values,
+                                                  pyramid_dec)
+    speed = out.trip_distance.values / out.trip_time_in_secs.values
+    return out, speed
+
+
+# 1% / 99% trip speed percentiles (one selection for both, not a full sort)
+def speed_bounds(speed):
+    return np.percentile(speed, [1, 99])
+
+
+# Cleans a set of trips: filters out records with values that don't make sense,
+# removes trip speeds that may not make sense (outside bounds, by default the
+# 1% / 99% percentiles of these trips), and adds the day, hour and date columns
+def clean_trips(tmp, num_dec, bounds=None, drop_counts=None):
+    tmp, speed = filter_trips(tmp, num_dec, drop_counts)
+    speed_lo, speed_hi = speed_bounds(speed) if bounds is None else bounds
+    keep = (speed < speed_hi) & (speed > speed_lo)
+    if drop_counts is not None:
+        drop_counts['trip speed'] = drop_counts.get('trip speed', 0) + len(keep) - int(np.count_nonzero(keep))
+    tmp = tmp[keep]
+    pickup = pd.DatetimeIndex(tmp.pickup_time.values)
+    return tmp.assign(day=pickup.dayofweek, hour=pickup.hour, date=pickup.normalize().astype('datetime64[ns]'))
+
+
+# Adds borough / nbhd columns (named names) for the coords in columns lon / lat, from either
+# the neighborhood raster or the pd_locs lookup table, dropping points not in any neighborhood
+def add_nbhds(tmp, nbhd_locs, lon='rounded_lon', lat='rounded_lat', names=('borough', 'nbhd')):
+    if isinstance(nbhd_locs, pd.DataFrame):
+        nbhd_locs = nbhd_locs.rename(columns={'rounded_lon': lon, 'rounded_lat': lat,
+                                              'borough': names[0], 'nbhd': names[1]})
+        return pd.merge(tmp, nbhd_locs, how='inner', on=[lon, lat])
+    tmp = tmp.copy()
+    tmp[names[0]], tmp[names[1]] = nbhd_locs.lookup(tmp[lon].values, tmp[lat].values)
+    return tmp.dropna(subset=[names[1]]).reset_index(drop=True)
+
+
+# Summarizes cleaned trips into partial sums, keyed by summary name
+def summarize_trips(tmp, trip_type, nbhd_locs):
+    tmp = tmp.assign(type=trip_type)
+    summ = {}
+    # For pickups hour and day (removing points not in neighborhood boundaries)
+    summ['pickups_hd'] = tmp.groupby(summary_keys['pickups_hd'])[summary_cols['pickups_hd']].sum().reset_index()
+    summ['pickups_hd'] = add_nbhds(summ['pickups_hd'], nbhd_locs)
+    # For date averages, take sums and number of records by date
+    summ['date_avgs'] = tmp.groupby(summary_keys['date_avgs'])[summary_cols['date_avgs']].sum().reset_index()
+    summ['date_counts'] = tmp.groupby(summary_keys['date_counts']).size().reset_index()
+    # For trips by pickup nbhd, dropoff nbhd, date and hour (trips with either end
+    # outside the neighborhoods are left out)
+    od = tmp[['rounded_lon', 'rounded_lat', 'rounded_dropoff_lon', 'rounded_dropoff_lat', 'date', 'hour',
+              'trip_time_in_secs', 'fare_amount']].assign(trips=1)
+    od = add_nbhds(od, nbhd_locs, names=('pickup_borough', 'pickup_nbhd'))
+    od = add_nbhds(od, nbhd_locs, 'rounded_dropoff_lon', 'rounded_dropoff_lat', ('dropoff_borough', 'dropoff_nbhd'))
+    summ['od_hdl'] = od.groupby(summary_keys['od_hdl'])[summary_cols['od_hdl']].sum().reset_index()
+    # For pickups by hour and finest pyramid cell (all cleaned pickups, in a
+    # neighborhood or not)
+    summ['pickups_grid'] = tmp.groupby(summary_keys['pickups_grid'])['passenger_count'].sum().reset_index()
+    # For pickups date, hour, and neighborhood
+    # (sum by rounded coord first, so each coord is only looked up once)
+    tmp = tmp.groupby(['rounded_lon', 'rounded_lat', 'date', 'hour'])['passenger_count'].sum().reset_index()
+    tmp = add_nbhds(tmp, nbhd_locs)
+    summ['pickups_hdl'] = tmp.groupby(summary_keys['pickups_hdl'])['passenger_count'].sum().reset_index()
+    return summ
+
+
+# Empty running sums for each summary
+def summary_cubes():
+    return dict((k, (SparseCube if k in sparse_summaries else KeyedCube)(summary_axes[k], summary_cols[k]))
+                for k in summary_axes)
+
+
+# Adds a set of partial sums into the running sums
+def add_summaries(cubes, summ):
+    for k in cubes:
+        cubes[k].add(summ[k])
+    return cubes
+
+
+# Running sums as tables, in the same layout as grouping the partial sums
+def cube_frames(cubes):
+    summ = {}
+    for k in cubes:
+        summ[k] = cubes[k].to_frame(sort_by=summary_keys[k])
+        summ[k] = summ[k][summary_keys[k] + summary_cols[k] +
+                          [x for x in summ[k].columns if x not in summary_keys[k] + summary_cols[k]]]
+    return summ
+
+
+# Reads only the columns needed for the summaries, in chunks of chunk_size rows
+# (or the whole file at once if chunk_size is None)
+# file_name can also be a type / year / month partition of the Parquet store (trip_store.py)
+def read_trips(file_name, chunk_size=None):
+    if os.path.isdir(file_name):
+        import trip_store
+        if chunk_size is None:
+            return trip_store.read_trips(file_name, columns=trip_cols)
+        return trip_store.iter_trips(file_name, columns=trip_cols, batch_size=chunk_size)
+    col_names = pd.read_csv(file_name, nrows=0).columns.values.tolist()
+    use_cols = [x for x, y in zip(col_names, clean_col_names(col_names)) if y in trip_cols]
+    # index_col=False: some raw files have extra delimiters at the end of each line
+    # (the raw files are saved as downloaded, so malformed lines are skipped here)
+    return pd.read_csv(file_name, usecols=use_cols, chunksize=chunk_size, index_col=False, on_bad_lines='skip')
+
+
+# Cleans and summarizes one trip file, returns the partial sums and number of records read
+# With chunk_size set, memory use is bounded by the chunk size (plus one float per
+# record for the trip speeds): a first pass over the chunks finds the 1% / 99% speed
+# percentiles of the whole file, and a second pass trims and summarizes each chunk
+# If stats (dict) is given, the file's wall time, records read / kept, records
+# dropped by each filter and peak memory are added to it
+def summarize_file(file_name, num_dec, nbhd_locs, chunk_size=None, stats=None):
+    start = time.time()
+    trip_type = 'green' if 'green' in file_name else 'yellow'
+    drop_counts = {}
+    n_clean = 0
+    if chunk_size is None:
+        tmp = read_trips(file_name)
+        n_records = tmp.shape[0]
+        tmp = clean_trips(tmp, num_dec, drop_counts=drop_counts)
+        n_clean = tmp.shape[0]
+        summ = summarize_trips(tmp, trip_type, nbhd_locs)
+    else:
+        n_records = 0
+        speeds = []
+        for tmp in read_trips(file_name, chunk_size):
+            n_records += tmp.shape[0]
+            speeds.append(filter_trips(tmp, num_dec)[1])
+        bounds = speed_bounds(np.concatenate(speeds))
+        del speeds
+        cubes = summary_cubes()
+        for tmp in read_trips(file_name, chunk_size):
+            tmp = clean_trips(tmp, num_dec, bounds, drop_counts)
+            n_clean += tmp.shape[0]
+            add_summaries(cubes, summarize_trips(tmp, trip_type, nbhd_locs))
+        summ = cube_frames(cubes)
+    if stats is not None:
+        stats.update({'seconds': time.time() - start, 'rows_in': n_records, 'rows_out': n_clean,
+                      'drops': drop_counts, 'max_rss_mb': max_rss_mb(), 'pid': os.getpid()})
+    return summ, n_records
+
+
+# Settings for summarize_file in each worker process, set once by _init_worker
+_worker_args = None
+
+
+def _init_worker(num_dec, nbhd_locs, chunk_size):
+    global _worker_args
+    _worker_args = (num_dec, nbhd_locs, chunk_size)
+
+
+def _summarize_file_worker(file_name):
+    stats = {}
+    summ, n_records = summarize_file(file_name, *_worker_args, stats=stats)
+    return file_name, summ, n_records, stats
+
+
+# Yields (file name, partial sums, number of records read, stats) for each file,
+# using a pool of n_workers processes if n_workers > 1
+# With ordered=False files are yielded as soon as they are done
+def _map_files(file_names, num_dec, nbhd_locs, chunk_size, n_workers, ordered=True):
+    if n_workers <= 1:
+        for x in file_names:
+            stats = {}
+            summ, n_records = summarize_file(x, num_dec, nbhd_locs, chunk_size, stats)
+            yield x, summ, n_records, stats
+        return
+    pool = Pool(n_workers, initializer=_init_worker, initargs=(num_dec, nbhd_locs, chunk_size))
+    try:
+        if ordered:
+            results = pool.imap(_summarize_file_worker, file_names)
+        else:
+            results = pool.imap_unordered(_summarize_file_worker, file_names)
+        for result in results:
+            yield result
+    except BaseException:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+
+# Fingerprint of the neighborhood lookup table, so partial sums
+# are redone when the neighborhoods change
+def _nbhd_locs_hash(nbhd_locs):
+    if isinstance(nbhd_locs, pd.DataFrame):
+        return str(pd.util.hash_pandas_object(nbhd_locs, index=False).sum())
+    h = hashlib.sha1(np.ascontiguousarray(nbhd_locs.grid).tobytes())
+    h.update(json.dumps([nbhd_locs.num_dec, nbhd_locs.lon0, nbhd_locs.lat0,
+                         nbhd_locs.borough.tolist(), nbhd_locs.nbhd.tolist()]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_manifest(partials_dir):
+    manifest_file = os.path.join(partials_dir, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return {'settings': None, 'files': {}}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+# Writes to a temporary file first, so a crash never leaves a half written manifest
+def save_manifest(partials_dir, manifest):
+    manifest_file = os.path.join(partials_dir, 'manifest.json')
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+def _file_stamp(file_name):
+    stat = os.stat(file_name)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Cleans and summarizes all files, returns the summed tables and number of records read
+# With n_workers > 1 each file is summarized in a pool of worker processes, and the
+# partial sums are added in file order, so the results are identical to a serial run
+# With partials_dir set, each file's partial sums are saved there along with a manifest
+# of file sizes / modification times, and only new or changed files are summarized
+# (so a rerun after new data arrives, or after a crash, picks up where it left off)
+# Each file summarized is written to log (a pipeline_log.PipelineLog) as a summarize_file record
+def summarize_files(file_names, num_dec, nbhd_locs, chunk_size=None, n_workers=1, partials_dir=None, log=None):
+    log = log or PipelineLog()
+    cubes = summary_cubes()
+    total_records = 0
+    if partials_dir is None:
+        for x, summ_tmp, records_tmp, stats in _map_files(file_names, num_dec, nbhd_locs, chunk_size, n_workers):
+            print(x)
+            log.write(dict(stats, stage='summarize_file', file=x))
+            add_summaries(cubes, summ_tmp)
+            total_records += records_tmp
+        return cube_frames(cubes), total_records
+    if not os.path.isdir(partials_dir):
+        os.makedirs(partials_dir)
+    settings = {'num_dec': num_dec, 'nbhd_locs': _nbhd_locs_hash(nbhd_locs), 'pyramid_dec': pyramid_dec,
+                'version': partials_version}
+    manifest = load_manifest(partials_dir)
+    if manifest['settings'] != settings:
+        manifest = {'settings': settings, 'files': {}}
+    todo = [x for x in file_names if manifest['files'].get(x, {}).get('stamp') != _file_stamp(x)]
+    print(str(len(file_names) - len(todo)) + ' files already summarized...')
+    for x, summ_tmp, records_tmp, stats in _map_files(todo, num_dec, nbhd_locs, chunk_size, n_workers, ordered=False):
+        print(x)
+        log.write(dict(stats, stage='summarize_file', file=x))
+        partial_file = os.path.join(partials_dir, x.replace('/', '_').replace(os.sep, '_') + '.pkl')
+        pd.to_pickle(summ_tmp, partial_file + '.tmp')
+        os.replace(partial_file + '.tmp', partial_file)
+        manifest['files'][x] = {'stamp': _file_stamp(x), 'records': records_tmp, 'partial': partial_file}
+        save_manifest(partials_dir, manifest)
+    # Add up the partial sums of all files (in file order)
+    for x in file_names:
+        add_summaries(cubes, pd.read_pickle(manifest['files'][x]['partial']))
+        total_records += manifest['files'][x]['records']
+    return cube_frames(cubes), total_records